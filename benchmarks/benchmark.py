@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+""" Benchmarks for the stores and databases
+
+    Synthetic sequential and associative databases are generated with each of
+    the requested numbers of rows and held in each kind of store. Each
+    operation is timed (the best of several repetitions is reported) and its
+    memory use measured with tracemalloc where that is available (python 3).
+
+    Run the benchmarks, saving the results as JSON
+
+        python benchmarks/benchmark.py run -o results.json
+        python benchmarks/benchmark.py run --sizes 1000 100000 --stores tuple json
+
+    and compare the results from two versions
+
+        python benchmarks/benchmark.py compare old.json new.json
+
+    The package is imported from the src directory next to this one, so
+    checking out another version and running the same command benchmarks that
+    version.
+
+    The operations are
+    - load: create the database, from in memory data or by opening a file
+    - scan_column: sum a column
+    - scan_rows: read a value from every row
+    - filter: select the rows matching an expression
+    - index_lookup: select the rows with one value of an indexed column
+    - lookup: read single rows by index
+    - set: change a value in single rows
+    - transaction_set: the same changes inside one transaction
+    - append: add single rows
+    - extend: add many rows at once
+    - delete: delete single rows
+    - delete_many: delete many rows at once (sequential only)
+    - patches: generate the pending JSON patches after a set (JSON stores)
+    - write: write the database after a set (JSON and SQLite stores)
+    Operations that change the database are each run on a freshly loaded
+    copy, which isn't included in their time.
+"""
+from __future__ import print_function
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_here = os.path.dirname(os.path.abspath(__file__) )
+sys.path.insert(0, os.path.join(os.path.dirname(_here), "src") )
+
+from dbmeta.database import SeqDatabase, AssocDatabase
+from dbmeta.column import ColumnDesc, IndexColumnDesc
+from dbmeta.tuple_store import MutableTupleSeqStore, MutableTupleAssocStore
+from dbmeta.columnar_store import (
+        MutableColumnarSeqStore, MutableColumnarAssocStore)
+from dbmeta.json_store import MutableJSONSeqStore, MutableJSONAssocStore
+from dbmeta.sqlite_store import MutableSQLiteSeqStore, MutableSQLiteAssocStore
+
+#: The number of rows read or changed one at a time
+n_single = 1000
+
+#: The number of rows deleted one at a time
+n_deletes = 100
+
+#: The number of categories in the indexed column
+n_categories = 100
+
+class SeqSchema(SeqDatabase):
+    """ Synthetic sequential database """
+    category = ColumnDesc(index="hash")
+    value = ColumnDesc()
+    name = ColumnDesc()
+    flag = ColumnDesc()
+
+    def __init__(self, make_store):
+        super(SeqSchema, self).__init__(make_store(self) )
+
+class AssocSchema(AssocDatabase):
+    """ Synthetic associative database """
+    key = IndexColumnDesc()
+    category = ColumnDesc(index="hash")
+    value = ColumnDesc()
+    name = ColumnDesc()
+    flag = ColumnDesc()
+
+    def __init__(self, make_store):
+        super(AssocSchema, self).__init__(make_store(self) )
+
+#: The schemas by name
+schemas = {"seq": SeqSchema, "assoc": AssocSchema}
+
+def make_row(rng, idx):
+    """ Make the data for one row """
+    return {
+            "category": rng.randrange(n_categories),
+            "value": rng.random(),
+            "name": "name{0}".format(idx),
+            "flag": rng.random() < 0.5}
+
+class Workload(object):
+    """ The synthetic data for one schema and size """
+
+    def __init__(self, schema, n_rows, seed=1):
+        rng = random.Random(seed)
+        self.schema = schema
+        self.n_rows = n_rows
+        rows = [make_row(rng, idx) for idx in range(n_rows)]
+        n_new = max(1, n_rows // 10)
+        new_rows = [make_row(rng, idx) for idx in range(n_rows, n_rows + n_new)]
+        if schema is SeqSchema:
+            self.data = rows
+            keys = list(range(n_rows) )
+        else:
+            keys = ["k{0:08d}".format(idx) for idx in range(n_rows)]
+            self.data = dict(zip(keys, rows) )
+            for idx, row in enumerate(new_rows):
+                row["key"] = "n{0:08d}".format(idx)
+        self.new_rows = new_rows
+        self.append_rows = new_rows[:n_single]
+        self.keys = [rng.choice(keys) for _ in range(n_single)]
+        # Delete from the back so that the positions in a sequential database
+        # stay valid
+        self.delete_keys = sorted(
+                rng.sample(keys, min(n_deletes, n_rows) ), reverse=True)
+        self.delete_many_keys = rng.sample(keys, n_new)
+
+class StoreKind(object):
+    """ A kind of store, and how to fill one with a workload's data """
+
+    def __init__(self, seq_cls, assoc_cls, file_format=None):
+        self._classes = {SeqSchema: seq_cls, AssocSchema: assoc_cls}
+        self.file_format = file_format
+
+    def prepare(self, workload, path):
+        """ Write the file that the store is opened from, if it has one """
+        schema = workload.schema
+        if self.file_format == "json":
+            with open(path, 'w') as fp:
+                json.dump(workload.data, fp)
+        elif self.file_format == "sqlite":
+            db = schema(lambda db: self._classes[schema](db=db, db_file=path) )
+            if schema is SeqSchema:
+                db.extend(workload.data)
+            else:
+                db.add_many(
+                        dict(row, key=key)
+                        for key, row in workload.data.items() )
+            db._store.write()
+            db._store.close()
+
+    def open(self, workload, path):
+        """ Create a database of the workload's schema using this store """
+        cls = self._classes[workload.schema]
+        if self.file_format is None:
+            return workload.schema(lambda db: cls(
+                db=db, data=workload.data, store_type="JSON") )
+        return workload.schema(lambda db: cls(db=db, db_file=path) )
+
+#: The kinds of store by name
+store_kinds = {
+        "tuple": StoreKind(MutableTupleSeqStore, MutableTupleAssocStore),
+        "columnar": StoreKind(MutableColumnarSeqStore, MutableColumnarAssocStore),
+        "json": StoreKind(MutableJSONSeqStore, MutableJSONAssocStore, "json"),
+        "sqlite": StoreKind(
+            MutableSQLiteSeqStore, MutableSQLiteAssocStore, "sqlite"),
+        }
+
+def _scan_rows(db, w):
+    for row in (db if w.schema is SeqSchema else db.values() ):
+        row.value
+
+def _lookup(db, w):
+    for key in w.keys:
+        db[key].value
+
+def _set(db, w):
+    for key in w.keys:
+        db[key].value = 0.5
+
+def _transaction_set(db, w):
+    with db.transaction():
+        _set(db, w)
+
+def _append(db, w):
+    add = db.append if w.schema is SeqSchema else db.add
+    for row in w.append_rows:
+        add(**row)
+
+def _extend(db, w):
+    (db.extend if w.schema is SeqSchema else db.add_many)(w.new_rows)
+
+def _delete(db, w):
+    for key in w.delete_keys:
+        del db[key]
+
+def _build_index(db, w):
+    list(db.select(db.category == 0) )
+
+class Benchmark(object):
+    """ An operation to time
+
+        prepare is called on the database before the timed operation, if
+        mutates is set it gets a freshly loaded database every time
+    """
+
+    def __init__(self, name, run, prepare=None, mutates=False, schemas=None,
+                 file_formats=None):
+        self.name = name
+        self.run = run
+        self.prepare = prepare
+        self.mutates = mutates
+        self._schemas = schemas
+        self._file_formats = file_formats
+
+    def applies(self, schema, kind):
+        """ Whether this benchmark can be run for a schema and kind of store """
+        return (
+                (self._schemas is None or schema in self._schemas) and
+                (self._file_formats is None or
+                 kind.file_format in self._file_formats) )
+
+#: The benchmarks, other than loading, in the order that they are run
+benchmarks = [
+        Benchmark("scan_column", lambda db, w: db.value.sum() ),
+        Benchmark("scan_rows", _scan_rows),
+        Benchmark("filter", lambda db, w: list(db.select(db.value > 0.9) ) ),
+        Benchmark(
+            "index_lookup", lambda db, w: list(db.select(db.category == 7) ),
+            prepare=_build_index),
+        Benchmark("lookup", _lookup),
+        Benchmark("set", _set, mutates=True),
+        Benchmark("transaction_set", _transaction_set, mutates=True),
+        Benchmark("append", _append, mutates=True),
+        Benchmark("extend", _extend, mutates=True),
+        Benchmark("delete", _delete, mutates=True),
+        Benchmark(
+            "delete_many", lambda db, w: db.delete_many(w.delete_many_keys),
+            mutates=True, schemas=(SeqSchema,) ),
+        Benchmark(
+            "patches", lambda db, w: db._store._pending_patches(),
+            prepare=_set, mutates=True, file_formats=("json",) ),
+        Benchmark(
+            "write", lambda db, w: db._store.write(),
+            prepare=_set, mutates=True, file_formats=("json", "sqlite") ),
+        ]
+
+def measure(func, repeat, memory):
+    """ Time a function and measure its memory use
+
+        func is called with whether it should set itself up, then again with
+        False to run the timed operation. Returns the list of times and the
+        peak and net (still allocated at the end) memory in bytes
+    """
+    times = []
+    for _ in range(repeat):
+        state = func(True)
+        gc.collect()
+        start = default_timer()
+        func(False, state)
+        times.append(default_timer() - start)
+        del state
+    peak = net = None
+    if memory and tracemalloc is not None:
+        state = func(True)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = func(False, state)
+            net, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del result, state
+    return times, peak, net
+
+def _close(db):
+    """ Close a database's store if it needs it """
+    close = getattr(db._store, "close", None)
+    if close is not None:
+        close()
+
+def run_case(schema_name, kind_name, workload, tmp_dir, repeat, memory, names):
+    """ Run the benchmarks for one schema, kind of store and size
+
+        Yields a result for each benchmark
+    """
+    kind = store_kinds[kind_name]
+    schema = workload.schema
+    base = os.path.join(tmp_dir, "{0}_{1}_{2}.db".format(
+        schema_name, kind_name, workload.n_rows) )
+    kind.prepare(workload, base)
+    work = base + ".work"
+    state = {"n": 0}
+
+    def fresh():
+        """ Open a fresh database from a copy of the prepared file """
+        if kind.file_format is not None:
+            state["n"] += 1
+            path = "{0}{1}".format(work, state["n"])
+            shutil.copyfile(base, path)
+        else:
+            path = None
+        return kind.open(workload, path)
+
+    def result(name, times, peak, net):
+        return {
+                "schema": schema_name,
+                "store": kind_name,
+                "rows": workload.n_rows,
+                "benchmark": name,
+                "seconds": times,
+                "best": min(times),
+                "peak_bytes": peak,
+                "net_bytes": net}
+
+    if names is None or "load" in names:
+        def load(setup, db=None):
+            if setup:
+                return None
+            return fresh()
+        yield result("load", *measure(load, repeat, memory) )
+
+    shared = fresh()
+    for bench in benchmarks:
+        if names is not None and bench.name not in names:
+            continue
+        if not bench.applies(schema, kind):
+            continue
+        def func(setup, db=None, bench=bench):
+            if setup:
+                db = fresh() if bench.mutates else shared
+                if bench.prepare is not None:
+                    bench.prepare(db, workload)
+                return db
+            return bench.run(db, workload)
+        yield result(bench.name, *measure(func, repeat, memory) )
+    _close(shared)
+
+def _git_revision():
+    """ Get the commit of the working tree, None if it can't be found """
+    try:
+        with open(os.devnull, 'w') as null:
+            out = subprocess.check_output(
+                    ["git", "rev-parse", "HEAD"], cwd=_here, stderr=null)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode("ascii").strip()
+
+def run(args):
+    """ Run the benchmarks and save the results """
+    metadata = {
+            "python": sys.version,
+            "platform": platform.platform(),
+            "revision": _git_revision(),
+            "date": datetime.datetime.now().isoformat(),
+            "repeat": args.repeat,
+            "memory": args.memory and tracemalloc is not None}
+    results = []
+    tmp_dir = tempfile.mkdtemp(prefix="dbmeta_bench")
+    try:
+        for n_rows in args.sizes:
+            for schema_name in args.schemas:
+                workload = Workload(schemas[schema_name], n_rows)
+                for kind_name in args.stores:
+                    for res in run_case(
+                            schema_name, kind_name, workload, tmp_dir,
+                            args.repeat, args.memory, args.benchmarks):
+                        results.append(res)
+                        print("{0:>6} {1:>9} {2:>8} {3:<16} {4:10.6f}s {5}".format(
+                            res["schema"], res["store"], res["rows"],
+                            res["benchmark"], res["best"],
+                            "" if res["peak_bytes"] is None else
+                            "{0:.1f}MB peak".format(res["peak_bytes"] / 1e6) ) )
+                        sys.stdout.flush()
+                    for name in os.listdir(tmp_dir):
+                        os.remove(os.path.join(tmp_dir, name) )
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    with open(args.output, 'w') as fp:
+        json.dump({"metadata": metadata, "results": results}, fp, indent=2)
+    print("Results written to {0}".format(args.output) )
+
+def compare(args):
+    """ Compare the best times and peak memory of two sets of results """
+    def load(path):
+        with open(path) as fp:
+            return {
+                    (r["schema"], r["store"], r["rows"], r["benchmark"]): r
+                    for r in json.load(fp)["results"]}
+    old = load(args.old)
+    new = load(args.new)
+    print("{0:>6} {1:>9} {2:>8} {3:<16} {4:>11} {5:>11} {6:>7} {7:>7}".format(
+        "schema", "store", "rows", "benchmark", "old", "new", "time", "memory") )
+    for key in sorted(set(old) & set(new) ):
+        o = old[key]
+        n = new[key]
+        mem = ""
+        if o["peak_bytes"] and n["peak_bytes"] is not None:
+            mem = "{0:.2f}x".format(n["peak_bytes"] / float(o["peak_bytes"]) )
+        ratio = n["best"] / o["best"] if o["best"] else float("nan")
+        print("{0:>6} {1:>9} {2:>8} {3:<16} {4:10.6f}s {5:10.6f}s {6:>6.2f}x {7:>7}".format(
+            key[0], key[1], key[2], key[3], o["best"], n["best"], ratio, mem) )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+            "-o", "--output", default="benchmark_results.json",
+            help="The file to write the results to")
+    run_parser.add_argument(
+            "--sizes", nargs="+", type=int, default=[1000, 100000, 1000000],
+            help="The numbers of rows to generate")
+    run_parser.add_argument(
+            "--schemas", nargs="+", choices=sorted(schemas),
+            default=["seq", "assoc"], help="The kinds of database")
+    run_parser.add_argument(
+            "--stores", nargs="+", choices=sorted(store_kinds),
+            default=["tuple", "columnar", "json", "sqlite"],
+            help="The kinds of store")
+    run_parser.add_argument(
+            "--benchmarks", nargs="+",
+            choices=["load"] + [b.name for b in benchmarks],
+            help="Only run these benchmarks")
+    run_parser.add_argument(
+            "--repeat", type=int, default=3,
+            help="The number of times to time each benchmark")
+    run_parser.add_argument(
+            "--no-memory", dest="memory", action="store_false",
+            help="Don't measure memory use")
+    run_parser.set_defaults(func=run)
+    compare_parser = subparsers.add_parser(
+            "compare", help="Compare two sets of results")
+    compare_parser.add_argument("old", help="The results to compare against")
+    compare_parser.add_argument("new", help="The new results")
+    compare_parser.set_defaults(func=compare)
+    args = parser.parse_args(argv)
+    if getattr(args, "func", None) is None:
+        parser.error("No command given")
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
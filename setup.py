@@ -27,6 +27,10 @@ setup(
         "jsonpatch",
         "funcsigs"
         ],
+    extras_require={
+        "numpy": ["numpy"],
+        "parallel": ['futures; python_version < "3"'],
+        },
     python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, !=3.4.*',
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",
@@ -0,0 +1,152 @@
+""" Aggregating the values of database columns
+
+    Reading a column from a database gives a ColumnMonad, which has methods
+    for each of the aggregations here
+
+    >>> db.energy.sum()
+    >>> db.energy.mean()
+
+    The values are read from the store a whole column at a time rather than
+    row by row, and a sorted index already built on the column answers min and
+    max directly. Whether or not an index is built, distinct values and groups
+    are always given in the order of the rows that they first appear in.
+
+    Aggregations can also be calculated over groups of rows, grouped by the
+    values of one or more columns
+
+    >>> db.group_by(db.run).agg(n="count", total=(db.energy, "sum") )
+"""
+from __future__ import division
+from builtins import object, zip
+from future.utils import iteritems, string_types
+from collections import OrderedDict
+
+def mean(values):
+    """ The arithmetic mean of a sequence of values """
+    if not len(values):
+        raise ValueError("mean() arg is an empty sequence")
+    return sum(values) / len(values)
+
+def distinct(values):
+    """ The distinct values in a sequence, in the order that they first
+        appear
+    """
+    return list(OrderedDict.fromkeys(values) )
+
+#: The aggregations that can be requested by name. Each takes the sequence of
+#: values to aggregate
+aggregations = {
+        "sum": sum,
+        "min": min,
+        "max": max,
+        "count": len,
+        "mean": mean,
+        "distinct": distinct,
+        }
+
+def aggregate(db, column, name):
+    """ Aggregate all the values of a column in a database
+
+        name is the name of one of the aggregations
+    """
+    try:
+        func = aggregations[name]
+    except KeyError:
+        raise ValueError("Unknown aggregation '{0}'".format(name) )
+    if name == "count":
+        return len(db)
+    index = db._indices.get(column.name)
+    if index is not None and name in ("min", "max"):
+        bounds = index.bounds()
+        if bounds is not None:
+            return bounds[0] if name == "min" else bounds[1]
+    return func(column.values(db) )
+
+def _resolve_column(db, column):
+    """ Get a column of a database from the column, its name or a ColumnMonad
+        reading it
+    """
+    if isinstance(column, string_types):
+        return getattr(type(db), column)
+    return getattr(column, "column", column)
+
+class GroupBy(object):
+    """ The rows of a database grouped by the values of some columns
+
+        Made by DBBase.group_by
+    """
+
+    def __init__(self, db, columns):
+        if not columns:
+            raise ValueError("No columns to group by")
+        self._db = db
+        self._columns = [_resolve_column(db, c) for c in columns]
+
+    def _groups(self):
+        """ Get an OrderedDict of the key of each group to the positions of
+            its rows
+
+            The groups are in the order of the rows that they first appear in
+        """
+        db = self._db
+        if len(self._columns) == 1:
+            keys = self._columns[0].values(db)
+        else:
+            keys = zip(*[c.values(db) for c in self._columns])
+        groups = OrderedDict()
+        for pos, key in enumerate(keys):
+            try:
+                groups[key].append(pos)
+            except KeyError:
+                groups[key] = [pos]
+        return groups
+
+    def count(self):
+        """ Get an OrderedDict of the key of each group to its number of rows
+        """
+        return OrderedDict(
+                (key, len(pos) ) for key, pos in iteritems(self._groups() ) )
+
+    def agg(self, **aggs):
+        """ Aggregate columns within each group
+
+            Each keyword gives the name of a result and how to calculate it,
+            as a (column, function) pair. The column can be read from the
+            database (e.g. db.energy) or be the name of a column. The function
+            can be the name of one of the aggregations or any function taking
+            the list of values in the group. Just 'count' gives the number of
+            rows in the group.
+
+            The groups are found in one pass over the grouped columns, then
+            each aggregated column is read once.
+
+            Returns an OrderedDict of the key of each group (a tuple if
+            grouping by several columns) to a dict of the results, in the
+            order of the rows that each group first appears in
+        """
+        db = self._db
+        groups = self._groups()
+        results = OrderedDict((key, {}) for key in groups)
+        values = {}
+        for name, spec in iteritems(aggs):
+            if isinstance(spec, string_types):
+                if spec != "count":
+                    raise ValueError(
+                            "Aggregation '{0}' needs a column".format(spec) )
+                for key, positions in iteritems(groups):
+                    results[key][name] = len(positions)
+                continue
+            column, func = spec
+            column = _resolve_column(db, column)
+            if isinstance(func, string_types):
+                try:
+                    func = aggregations[func]
+                except KeyError:
+                    raise ValueError("Unknown aggregation '{0}'".format(func) )
+            try:
+                col_values = values[column.name]
+            except KeyError:
+                col_values = values[column.name] = column.values(db)
+            for key, positions in iteritems(groups):
+                results[key][name] = func([col_values[p] for p in positions])
+        return results
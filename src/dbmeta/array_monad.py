@@ -0,0 +1,202 @@
+""" Vectorised CollMonad backed by a NumPy array
+
+    An ArrayMonad holds the whole result of a calculation in a NumPy array and
+    forwards arithmetic, comparison and logical operators to NumPy, so these are
+    evaluated in a single vectorised call rather than one Python call per
+    element. Any other operation (attribute access, function calls, etc.) falls
+    back to the normal elementwise CollMonad behaviour.
+
+    A column can be read into an ArrayMonad with as_array
+    >>> energy = db.energy.as_array()
+    >>> db.select( (energy > 10) & (energy < 20) )
+
+    NumPy is an optional dependency, it is only needed if these functions are
+    actually used.
+"""
+from .coll_monad import CollMonad
+from future.utils import PY3
+from .index import is_collection
+if PY3:
+    from collections.abc import Iterator
+else:
+    from collections import Iterator
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def require_numpy():
+    """ Raise an ImportError if NumPy is not available """
+    if np is None:
+        raise ImportError("NumPy is required for vectorised evaluation")
+
+def to_array(values, dtype=None):
+    """ Convert a sequence of values into a NumPy array """
+    require_numpy()
+    return np.array(values, dtype=dtype)
+
+def as_mask(selection):
+    """ Get a selection as a boolean NumPy array
+
+        Returns None if the selection is not an array
+    """
+    if np is None:
+        return None
+    if isinstance(selection, ArrayMonad):
+        selection = selection.array
+    if isinstance(selection, np.ndarray):
+        return selection.astype(bool, copy=False)
+    return None
+
+def _unwrap(x):
+    """ Get the value to pass to NumPy for an operand """
+    if isinstance(x, ArrayMonad):
+        return x.array
+    elif isinstance(x, (CollMonad, Iterator) ):
+        return np.array(list(x) )
+    return x
+
+class ArrayMonad(CollMonad):
+    """ CollMonad that holds its values in a NumPy array
+
+        Like a TupleMonad, the whole result is stored and can be iterated
+        through multiple times.
+    """
+
+    def __init__(self, itr, dtype=None):
+        require_numpy()
+        if isinstance(itr, np.ndarray) and dtype is None:
+            self._array = itr
+        else:
+            if not isinstance(itr, np.ndarray):
+                itr = list(itr)
+            self._array = np.array(itr, dtype=dtype)
+
+    @property
+    def array(self):
+        """ The underlying NumPy array """
+        return self._array
+
+    def __iter__(self):
+        return iter(self._array)
+
+    def __len__(self):
+        return len(self._array)
+
+    def __contains__(self, x):
+        return x in self._array
+
+    def __str__(self):
+        return str(self._array)
+
+    def __repr__(self):
+        return "ArrayMonad({0!r})".format(self._array)
+
+    def select(self, selection):
+        """ Return the elements for which selection is True """
+        mask = as_mask(selection)
+        if mask is None:
+            mask = np.array(list(selection), dtype=bool)
+        return ArrayMonad(self._array[mask])
+
+    def _vectorised(self, func, *others):
+        return ArrayMonad(func(self._array, *[_unwrap(o) for o in others]) )
+
+    def _contained_in(self, rhs, cls):
+        if issubclass(ArrayMonad, cls) and is_collection(rhs):
+            return ArrayMonad(np.isin(self._array, list(rhs) ) )
+        return super(ArrayMonad, self)._contained_in(rhs, cls)
+
+    def _combined_with(self, kind, others, cls):
+        if issubclass(ArrayMonad, cls):
+            func = np.logical_and if kind in ("and_", "all") else np.logical_or
+            return ArrayMonad(func.reduce(
+                [self._array] + [_unwrap(o) for o in others]) )
+        return super(ArrayMonad, self)._combined_with(kind, others, cls)
+
+    def __eq__(self, other):
+        return self._vectorised(np.equal, other)
+
+    def __ne__(self, other):
+        return self._vectorised(np.not_equal, other)
+
+    def __gt__(self, other):
+        return self._vectorised(np.greater, other)
+
+    def __ge__(self, other):
+        return self._vectorised(np.greater_equal, other)
+
+    def __le__(self, other):
+        return self._vectorised(np.less_equal, other)
+
+    def __lt__(self, other):
+        return self._vectorised(np.less, other)
+
+    def __add__(self, other):
+        return self._vectorised(np.add, other)
+
+    def __radd__(self, other):
+        return ArrayMonad(np.add(_unwrap(other), self._array) )
+
+    def __sub__(self, other):
+        return self._vectorised(np.subtract, other)
+
+    def __rsub__(self, other):
+        return ArrayMonad(np.subtract(_unwrap(other), self._array) )
+
+    def __mul__(self, other):
+        return self._vectorised(np.multiply, other)
+
+    def __rmul__(self, other):
+        return ArrayMonad(np.multiply(_unwrap(other), self._array) )
+
+    def __truediv__(self, other):
+        return self._vectorised(np.true_divide, other)
+
+    def __rtruediv__(self, other):
+        return ArrayMonad(np.true_divide(_unwrap(other), self._array) )
+
+    def __div__(self, other):
+        return self._vectorised(np.divide, other)
+
+    def __rdiv__(self, other):
+        return ArrayMonad(np.divide(_unwrap(other), self._array) )
+
+    def __floordiv__(self, other):
+        return self._vectorised(np.floor_divide, other)
+
+    def __rfloordiv__(self, other):
+        return ArrayMonad(np.floor_divide(_unwrap(other), self._array) )
+
+    def __mod__(self, other):
+        return self._vectorised(np.mod, other)
+
+    def __rmod__(self, other):
+        return ArrayMonad(np.mod(_unwrap(other), self._array) )
+
+    def __pow__(self, other):
+        return self._vectorised(np.power, other)
+
+    def __rpow__(self, other):
+        return ArrayMonad(np.power(_unwrap(other), self._array) )
+
+    def __neg__(self):
+        return ArrayMonad(-self._array)
+
+    def __abs__(self):
+        return ArrayMonad(np.abs(self._array) )
+
+    def __and__(self, other):
+        return self._vectorised(np.bitwise_and, other)
+
+    def __rand__(self, other):
+        return ArrayMonad(np.bitwise_and(_unwrap(other), self._array) )
+
+    def __or__(self, other):
+        return self._vectorised(np.bitwise_or, other)
+
+    def __ror__(self, other):
+        return ArrayMonad(np.bitwise_or(_unwrap(other), self._array) )
+
+    def __invert__(self):
+        return ArrayMonad(np.invert(self._array) )
@@ -1,12 +1,21 @@
 from builtins import zip
 from future.utils import PY3, iteritems
-from itertools import repeat
+from itertools import compress, repeat
 import operator
+from .parallel import apply_chunks, executor_for
 if PY3:
     from collections.abc import Iterator, Iterable
 else:
     from collections import Iterator, Iterable
 
+#: The elementwise functions used by CollMonad.and_, or_, any and all
+_combiners = {
+        "and_": lambda x, y: x and y,
+        "or_": lambda x, y: x or y,
+        "any": lambda *args: any(args),
+        "all": lambda *args: all(args),
+        }
+
 class CollMonad(Iterable):
     """ Special type of iterable that allows forwarding attribute retrieval,
         function calls, etc to the iterated objects.
@@ -90,30 +99,75 @@ class CollMonad(Iterable):
         args.append(g_kw)
         return cls(func(*a[:-1], **a[-1]) for a in zip(*args))
 
+    @classmethod
+    def apply_parallel(cls, func, *args, **kwargs):
+        """ Apply a function elementwise, split between several processes
+
+            This behaves as apply, except that func is called by a pool of
+            worker processes. The keyword arguments workers (the number of
+            processes in the pool) and executor (an existing executor to use
+            instead) are taken by this, any others are passed to func.
+            chunk_size sets the number of calls sent to a worker at once.
+
+            Everything passed to the workers must be picklable. All of the
+            calls are made before this returns (see the parallel module).
+        """
+        workers = kwargs.pop("workers", None)
+        executor = kwargs.pop("executor", None)
+        chunk_size = kwargs.pop("chunk_size", None)
+        if not any(isinstance(a, (CollMonad, Iterator) )
+                   for a in args + tuple(kwargs.values() ) ):
+            raise ValueError("apply_parallel needs at least one iterator")
+        # Use apply to line up the arguments for each call
+        arg_tuples = ItrMonad.apply(lambda *a, **kw: a + (kw,), *args, **kwargs)
+        with executor_for(workers, executor) as pool:
+            return cls(apply_chunks(func, arg_tuples, pool, chunk_size) )
+
     @classmethod
     def in_(cls, lhs, rhs):
         """ Elementwise 'lhs in rhs' """
+        if isinstance(lhs, CollMonad):
+            return lhs._contained_in(rhs, cls)
         return cls.apply(lambda x, y: x in y, lhs, rhs)
 
     @classmethod
     def and_(cls, lhs, rhs):
         """ Elementwise 'and' of lhs and rhs """
-        return cls.apply(lambda x, y: x and y, lhs, rhs)
+        return cls._combine("and_", lhs, rhs)
 
     @classmethod
     def or_(cls, lhs, rhs):
         """ Elementwise 'or' of lhs and rhs """
-        return cls.apply(lambda x, y: x or y, lhs, rhs)
+        return cls._combine("or_", lhs, rhs)
 
     @classmethod
     def any(cls, *args):
         """ Apply the any function elementwise """
-        return cls.apply(lambda *args: any(args), *args)
+        return cls._combine("any", *args)
 
     @classmethod
     def all(cls, *args):
         """ Apply the all function elementwise """
-        return cls.apply(lambda *args: all(args), *args)
+        return cls._combine("all", *args)
+
+    @classmethod
+    def _combine(cls, kind, *args):
+        """ Implementation of the and_, or_, any and all functions
+
+            If the first argument is a CollMonad it is given the chance to build
+            the result itself
+        """
+        if args and isinstance(args[0], CollMonad):
+            return args[0]._combined_with(kind, args[1:], cls)
+        return cls.apply(_combiners[kind], *args)
+
+    def _combined_with(self, kind, others, cls):
+        """ Combine this elementwise with others using and_, or_, any or all
+
+            cls is the class on which the function was called. This exists so
+            that derived classes can change how these combinations are built
+        """
+        return cls.apply(_combiners[kind], self, *others)
 
     @classmethod
     def flatten(cls, iterable, cls_tup=None, no_expand=None):
@@ -148,6 +202,14 @@ class CollMonad(Iterable):
         args = (self,) + args
         return type(self).apply(func, *args, **kwargs)
 
+    def _contained_in(self, rhs, cls):
+        """ Implementation of in_ where this is the left hand side
+
+            cls is the class on which in_ was called. This exists so that
+            derived classes can change how membership tests on them are built
+        """
+        return cls.apply(lambda x, y: x in y, self, rhs)
+
     def __getattr__(self, name):
         """ Return an iterator getting the attribute over all elements """
         return self.call(getattr, name)
@@ -262,4 +324,9 @@ class TupleMonad(CollMonad):
         return x in self._tup
 
     def select(self, selection):
-        return TupleMonad(x for (x, sel) in zip(self, selection) if sel)
+        """ Return the elements for which selection is True
+
+            selection can be any iterable of decisions, including a boolean
+            NumPy array
+        """
+        return TupleMonad(compress(self._tup, selection) )
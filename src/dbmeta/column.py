@@ -1,8 +1,10 @@
 from __future__ import print_function
-from future.utils import PY3, iteritems
+from future.utils import PY3, iteritems, string_types
 from builtins import object, zip
 from functools import wraps
-from .coll_monad import ItrMonad
+from .query import ColumnMonad
+from .index import index_types
+from .array_monad import to_array
 if PY3:
     from collections.abc import Mapping
     from inspect import signature
@@ -71,12 +73,27 @@ class ColumnBase(property):
         A column should be a property that returns all the values for that
         column as an iterator but is not directly settable
     """
+    # property reports itself as abstract when accessed through the class, which
+    # would make ABCMeta treat any database with a _col_cls as abstract
+    __isabstractmethod__ = False
+
     def __init__(self, name, desc, fget, index=None):
         property.__init__(self, fget=fget)
         self.__doc__ = desc.doc.format(name=name, index=index)
         self._name = name
         self._desc = desc
 
+    def __copy__(self):
+        """ Shallow copy of the column
+
+            properties cannot be copied through the default pickle protocol so
+            this has to be done by hand
+        """
+        cls = type(self)
+        obj = cls.__new__(cls)
+        property.__init__(obj, fget=self.fget, doc=self.__doc__)
+        obj.__dict__.update(self.__dict__)
+        return obj
 
     @property
     def name(self):
@@ -174,7 +191,7 @@ class ColumnDesc(ColumnDescBase):
     def __init__(
             self, doc=None, key=None, col_cls=None, default=NO_DEFAULT,
             read_func=read_identity, write_func=write_identity,
-            type=identity, store_type=identity):
+            type=identity, store_type=identity, index=None):
         """ Create the description
 
             Parameters:
@@ -182,6 +199,12 @@ class ColumnDesc(ColumnDescBase):
                 key: The name of the column in remote stores
                 col_cls: The column class to be created from this description
                 default: The default value this column should take
+                index: The type of secondary index to keep on this column
+
+            index can be None (no index), 'hash' for an index that can resolve
+            equality and membership selections, 'sorted' for one that can also
+            resolve range selections or a ColumnIndex subclass. See the index
+            module for more details.
 
             key should be a mapping from remote store type to the key of this
             column in that store, with None representing the default value. If a
@@ -231,6 +254,12 @@ class ColumnDesc(ColumnDescBase):
         self.default = default
         self.read_func = read_func
         self.write_func = write_func
+        try:
+            self.index_cls = index_types[index]
+        except KeyError:
+            if isinstance(index, string_types):
+                raise ValueError("Unknown index type '{0}'".format(index) )
+            self.index_cls = index
 
 class Column(ColumnBase):
     """ Default column implementation
@@ -240,7 +269,7 @@ class Column(ColumnBase):
     """
     def __init__(self, name, index, desc):
         def fget(obj):
-            return ItrMonad(self.get(obj, row_idx) for row_idx in obj)
+            return ColumnMonad(obj, self)
         ColumnBase.__init__(self, name=name, desc=desc, index=index, fget=fget)
         self._index = index
 
@@ -271,6 +300,42 @@ class Column(ColumnBase):
         """ The index of this column """
         return self._index
 
+    @property
+    def index_cls(self):
+        """ The type of secondary index kept on this column (None if there is
+            no index)
+        """
+        return self._desc.index_cls
+
+    def iter_values(self, db):
+        """ Iterate over the values of this column in the order of the rows
+
+            The values are read a whole column at a time from the store
+        """
+        values = db._store.iter_column(self.index)
+        if self.type is identity:
+            return values
+        cnv = self.type
+        return (cnv(v) for v in values)
+
+    def values(self, db):
+        """ Get the values of this column as a sequence in the order of the
+            rows
+
+            Where no conversion is needed this is the store's own data, so it
+            must not be modified
+        """
+        if self.type is identity:
+            return db._store.column_values(self.index)
+        return list(self.iter_values(db) )
+
+    def as_array(self, db, dtype=None):
+        """ Read the values of this column into a NumPy array
+
+            Requires NumPy
+        """
+        return to_array(self.values(db), dtype)
+
     def get(self, db, row_idx):
         """ Get the value of this column in the specified row """
         return self.type(db._store[row_idx, self.index])
@@ -280,7 +345,7 @@ class Column(ColumnBase):
         
             This will only work if the underlying store permits modification
         """
-        db._store[row_idx, self.index] = self.store_type(value)
+        db._set_value(row_idx, self, self.store_type(value) )
 
 class Field(property):
     def __init__(self, column):
@@ -395,9 +460,23 @@ class IndexColumn(ColumnBase):
     """ The index column """
     def __init__(self, name, desc):
         def fget(obj):
-            return ItrMonad(iter(obj))
+            return ColumnMonad(obj, self)
         super(IndexColumn, self).__init__(name=name, desc=desc, fget=fget)
 
+    def iter_values(self, db):
+        """ Iterate over the index of each row in the database """
+        cnv = self.type
+        return (cnv(idx) for idx in db._store)
+
+    def values(self, db):
+        """ Get the index of each row as a sequence in the order of the rows
+        """
+        return list(self.iter_values(db) )
+
+    def get(self, db, row_idx):
+        """ Get the index of the specified row """
+        return self.type(row_idx)
+
     @property
     def read_func(self):
         """ The conversion from remote store -> local store """
@@ -426,3 +505,42 @@ class IndexField(property):
     def column(self):
         """ The column in the database referred to by this field"""
         return self._column
+
+def make_row_codec(columns, store_type):
+    """ Generate the functions converting between remote data and tuples for
+        a store type
+
+        Returns a decoder, which converts a dict of remote data into a tuple
+        of stored values (as Column.read_from does for each column), and an
+        encoder, which does the reverse (as Column.write_to). The key of each
+        column is looked up once here and the conversions of columns using
+        the default read_func/write_func are written directly into the
+        generated code, so converting a row costs a single function call.
+    """
+    namespace = {"st": store_type}
+    terms = []
+    lines = ["def encode(tup):", "    data = {}"]
+    for i, c in enumerate(columns):
+        desc = c._desc
+        namespace["k{0}".format(i)] = c.key(store_type)
+        namespace["d{0}".format(i)] = desc.default
+        if desc.read_func is not read_identity:
+            namespace["r{0}".format(i)] = desc.read_func
+            terms.append("r{0}(k{0}, data, d{0}, st)".format(i) )
+        elif desc.default == ColumnDesc.NO_DEFAULT:
+            terms.append("data[k{0}]".format(i) )
+        else:
+            terms.append("data.get(k{0}, d{0})".format(i) )
+        if desc.write_func is not write_identity:
+            namespace["w{0}".format(i)] = desc.write_func
+            lines.append(
+                    "    w{0}(tup[{1}], k{0}, data, st)".format(i, c.index) )
+        else:
+            lines.append("    data[k{0}] = tup[{1}]".format(i, c.index) )
+    lines.append("    return data")
+    decode = eval(
+            "lambda data: ({0})".format(
+                "".join(t + ", " for t in terms) ),
+            namespace)
+    exec("\n".join(lines), namespace)
+    return decode, namespace["encode"]
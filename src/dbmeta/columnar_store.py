@@ -0,0 +1,236 @@
+""" Store classes that hold their data internally column by column
+
+    Rather than keeping one tuple per row, these stores keep one contiguous
+    sequence per column. Reading a whole column just hands back that sequence
+    and setting a single cell only touches one slot.
+
+    By default each column is held in a list. Numeric columns can instead be
+    held in an array.array by passing a mapping from column name to array
+    typecode as the typecodes parameter, e.g. typecodes={"energy": "d"}.
+"""
+from .store import (
+        Store, SeqStore, AssocStore, MutableSeqStore, MutableAssocStore,
+        compact)
+from builtins import zip
+from future.utils import PY3, iteritems
+from array import array
+from itertools import islice, repeat
+if PY3:
+    from collections.abc import Mapping
+else:
+    from collections import Mapping
+
+class ColumnarStore(Store):
+    """ Store that stores data internally as one sequence per column """
+    def __init__(self, data=None, store_type=None, typecodes=None, **kwargs):
+        super(ColumnarStore, self).__init__(**kwargs)
+        self._typecodes = {} if typecodes is None else dict(typecodes)
+        self._data = [self._make_column(c) for c in self._columns]
+        if data is not None:
+            self.from_dict(data, store_type)
+
+    def _make_column(self, column, values=()):
+        """ Create the internal sequence used to hold a column """
+        try:
+            return array(self._typecodes[column.name], values)
+        except KeyError:
+            return list(values)
+
+    def _iter_tuples(self):
+        """ Iterate over the rows as tuples, in the internal order """
+        if not self._data:
+            return repeat((), len(self) )
+        return zip(*self._data)
+
+    #: The number of rows converted at once when filling the columns
+    fill_batch_size = 10000
+
+    def _fill_columns(self, rows, store_type):
+        """ Set the internal columns from an iterable of remote row dicts
+
+            The rows are converted in batches so that they can be read from a
+            stream without holding them all. Returns the number of rows.
+        """
+        self._data = [self._make_column(c) for c in self._columns]
+        n_rows = 0
+        rows = iter(rows)
+        decode = self._decoder(store_type)
+        while True:
+            batch = list(map(decode, islice(rows, self.fill_batch_size) ) )
+            if not batch:
+                return n_rows
+            n_rows += len(batch)
+            for column, values in zip(self._data, zip(*batch) ):
+                column.extend(values)
+
+    def _extend_columns(self, tuples):
+        """ Append rows given as tuples to the end of the internal columns
+
+            An array column rejects values of the wrong type (for example a
+            None default), in which case every column is cut back to its old
+            length so that the columns never disagree on the number of rows
+        """
+        n_rows = len(self)
+        try:
+            for column, values in zip(self._data, zip(*tuples) ):
+                column.extend(values)
+        except Exception:
+            for column in self._data:
+                del column[n_rows:]
+            raise
+
+    def __getitem__(self, idx_pair):
+        row_idx, col_idx = idx_pair
+        return self._data[col_idx][row_idx]
+
+    def iter_column(self, col_idx):
+        return iter(self._data[col_idx])
+
+    def column_values(self, col_idx):
+        return self._data[col_idx]
+
+class ColumnarSeqStore(ColumnarStore, SeqStore):
+    """ Sequential store that stores data internally column by column """
+    def __init__(self, **kwargs):
+        """ Create the store """
+        self._n_rows = 0
+        super(ColumnarSeqStore, self).__init__(**kwargs)
+
+    def from_remote(self, data, store_type):
+        """ Update the internal data store from the supplied remote store data """
+        self._n_rows = self._fill_columns(data, store_type)
+
+    def from_dict(self, data, store_type):
+        """ Sequential stores receive their remote data as a sequence """
+        self.from_remote(data, store_type)
+
+    def to_remote(self, store_type):
+        """ Convert the internal data store to a tuple of dicts """
+        return tuple(map(self._encoder(store_type), self._iter_tuples() ) )
+
+    def to_dict(self, store_type):
+        """ Sequential stores give their remote data as a sequence """
+        return self.to_remote(store_type)
+
+    def __len__(self):
+        return self._n_rows
+
+class MutableColumnarSeqStore(ColumnarSeqStore, MutableSeqStore):
+    """ Mutable sequential store that stores data internally column by column """
+
+    def append(self, row_data):
+        self._extend_columns([self._dict_to_tuple(row_data)])
+        self._n_rows += 1
+
+    def extend(self, rows_data):
+        tuples = list(self._dicts_to_tuples(rows_data) )
+        self._extend_columns(tuples)
+        self._n_rows += len(tuples)
+
+    def __setitem__(self, idx_pair, value):
+        row_idx, col_idx = idx_pair
+        self._data[col_idx][row_idx] = value
+
+    def __delitem__(self, row_idx):
+        if row_idx < 0:
+            row_idx += self._n_rows
+        if not 0 <= row_idx < self._n_rows:
+            raise IndexError(row_idx)
+        for column in self._data:
+            del column[row_idx]
+        self._n_rows -= 1
+        MutableSeqStore.__delitem__(self, row_idx)
+
+    def _compact(self, deleted):
+        self._data = [compact(column, deleted) for column in self._data]
+        self._n_rows -= len(deleted)
+
+class ColumnarAssocStore(ColumnarStore, AssocStore):
+    """ Associative store that stores data internally column by column
+
+        The columns are held in the order given by _keys, with _positions
+        mapping each key to its position in the columns
+    """
+    def __init__(self, **kwargs):
+        """ Create the store """
+        self._keys = []
+        self._positions = {}
+        super(ColumnarAssocStore, self).__init__(**kwargs)
+
+    def from_dict(self, data, store_type):
+        """ Update the internal data store from the supplied remote store data
+
+            data can be a mapping or an iterable of (key, value) pairs
+        """
+        read_func = self._index_column.read_func
+        items = iteritems(data) if isinstance(data, Mapping) else data
+        keys = []
+        def rows():
+            for k, v in items:
+                keys.append(read_func(k, store_type) )
+                yield v
+        self._fill_columns(rows(), store_type)
+        self._keys = keys
+        self._positions = {k: pos for (pos, k) in enumerate(keys)}
+
+    def to_dict(self, store_type):
+        write_func = self._index_column.write_func
+        encode = self._encoder(store_type)
+        return {
+                write_func(k, store_type): encode(t)
+                for k, t in zip(self._keys, self._iter_tuples() )}
+
+    def __getitem__(self, idx_pair):
+        row_idx, col_idx = idx_pair
+        return self._data[col_idx][self._positions[row_idx]]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __contains__(self, row_idx):
+        return row_idx in self._positions
+
+class MutableColumnarAssocStore(ColumnarAssocStore, MutableAssocStore):
+    """ Mutable associative store that stores data internally column by column
+
+        Deleting a row moves the last row into its slot so that the columns
+        never have to be shifted. This means that the iteration order is not
+        preserved over deletions.
+    """
+
+    def add(self, index, row_data):
+        if index in self:
+            raise KeyError(
+                    "Attempting to add pre-existing index {0}!".format(index) )
+        self._extend_columns([self._dict_to_tuple(row_data)])
+        self._positions[index] = len(self._keys)
+        self._keys.append(index)
+
+    def add_many(self, items):
+        items = list(items)
+        self._check_new_indices(index for (index, _) in items)
+        tuples = list(self._dicts_to_tuples(row_data for (_, row_data) in items) )
+        self._extend_columns(tuples)
+        for index, _ in items:
+            self._positions[index] = len(self._keys)
+            self._keys.append(index)
+
+    def __setitem__(self, idx_pair, value):
+        row_idx, col_idx = idx_pair
+        self._data[col_idx][self._positions[row_idx]] = value
+
+    def __delitem__(self, row_idx):
+        pos = self._positions.pop(row_idx)
+        last = len(self._keys) - 1
+        if pos != last:
+            moved = self._keys[last]
+            self._keys[pos] = moved
+            self._positions[moved] = pos
+            for column in self._data:
+                column[pos] = column[last]
+        self._keys.pop()
+        for column in self._data:
+            column.pop()
@@ -9,12 +9,56 @@ if PY3:
 else:
     from collections import Sequence, Mapping
 from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from itertools import compress
 
 from .column import (
-        ColumnDesc, Column, Field, IndexColumnDesc, IndexColumn, IndexField)
-from .weakcoll import WeakColl
+        ColumnDesc, Column, Field, IndexColumnDesc, IndexColumn, IndexField,
+        identity, make_row_codec)
+from .weakcoll import RowRegistry, LRUCache
+from .query import Expr, Selection, select_indices
+from .array_monad import ArrayMonad, as_mask
+from .index import SortedIndex, is_collection
+from .aggregate import GroupBy
+from .join import join as join_rows
+from .parallel import executor_for
+from .locking import synchronised, null_lock
+from .metrics import instrumented_registry
 import copy
 
+#: The versions of the bookkeeping structures used with thread safe stores
+_SyncRowRegistry = synchronised(RowRegistry, (
+    "__len__", "__iter__", "__contains__", "get", "rows_at", "append",
+    "remove", "rm_by_ref", "remap") )
+_SyncLRUCache = synchronised(LRUCache, ("__len__", "touch", "remove", "clear") )
+
+def _exclusive(method):
+    """ Wrap a database method so that it holds the write lock of a thread
+        safe store
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self._store._lock
+        if lock is None:
+            return method(self, *args, **kwargs)
+        with lock.writing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _shared(method):
+    """ Wrap a database method so that it holds the read lock of a thread safe
+        store
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self._store._lock
+        if lock is None:
+            return method(self, *args, **kwargs)
+        with lock.reading():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 def c3_merge(bases):
     """ Merge together the list of base classes into the mro that will be
         created using the C3 linearisation algorithm
@@ -335,6 +379,11 @@ class DBBase(with_metaclass(DBMeta, object) ):
     """
     _col_cls = Column
     _row_cls = Row
+    # The functions undoing each change made in the current transaction, None
+    # outside of a transaction
+    _undo = None
+    # The store's savepoint from the start of the current transaction
+    _savepoint = None
 
     @property
     @abc.abstractmethod
@@ -350,8 +399,21 @@ class DBBase(with_metaclass(DBMeta, object) ):
     def is_mutable(self):
         return self._store.is_mutable
 
-    def __init__(self, store):
-        """ Create the database with an associated store """
+    def __init__(self, store, identity_map=False, row_cache_size=0):
+        """ Create the database with an associated store
+
+            Parameters:
+                store: The store holding the data
+                identity_map: If True, getting the same index twice returns the
+                              same row object for as long as that row is alive
+                row_cache_size: With the identity map, the number of most
+                                recently used rows to keep alive
+
+            If the store is thread safe (see locking.thread_safe) then so is
+            the database. If the store is instrumented (see
+            metrics.instrumented) then the database records into the same
+            metrics.
+        """
         # Check the store behaves as we need
         if self.is_sequential and not store.is_sequential:
             raise ValueError(
@@ -362,38 +424,400 @@ class DBBase(with_metaclass(DBMeta, object) ):
         if store._db is not self:
             raise ValueError("Store's database is not this database!")
         self._store = store
-        self._references = WeakColl()
+        shared = store._lock is not None
+        registry_cls = _SyncRowRegistry if shared else RowRegistry
+        self._metrics = store._metrics
+        if self._metrics is None:
+            self._references = registry_cls()
+        else:
+            # Count the rows as they add themselves to the registry
+            self._references = instrumented_registry(registry_cls)(
+                    metrics=self._metrics)
+        self._identity_map = identity_map
+        if identity_map and row_cache_size > 0:
+            self._row_cache = (_SyncLRUCache if shared else LRUCache)(
+                    row_cache_size)
+        else:
+            self._row_cache = None
+        # Secondary indexes that have been built, keyed by column name
+        self._indices = {}
+        # The names of indexed columns holding values their index can't hold
+        self._unindexable = set()
 
     def __len__(self):
         return len(self._store)
 
+    def locked(self):
+        """ Context manager holding the write lock of a thread safe store
+
+            Several changes made inside this are seen by other threads all at
+            once. For stores that are not thread safe this does nothing
+        """
+        return self._store.locked()
+
+    @contextmanager
+    def transaction(self):
+        """ Context manager making a group of changes together
+
+            Changes made inside the transaction go to the store straight away,
+            so they are seen by anything reading the database, but the store
+            can put off the work needed to record them (e.g. computing JSON
+            patches) until the transaction ends. Each changed value is then
+            only recorded once, however many times it was set. If an exception
+            is raised inside the transaction all of its changes are undone
+            before it is raised again.
+
+            Rows deleted from a sequential database inside a transaction are
+            only removed when it ends (see defer_deletes). For thread safe
+            stores the write lock is held throughout.
+
+            >>> with db.transaction():
+            >>>     for row in db:
+            >>>         row.energy *= scale
+        """
+        if self._undo is not None:
+            # Nested, everything is part of the outermost transaction
+            yield
+            return
+        self._store._count("transactions")
+        with self.locked(), self._store.batch():
+            self._begin_transaction()
+            try:
+                yield
+                self._commit_transaction()
+            except BaseException:
+                self._store._count("rollbacks")
+                self._rollback_transaction()
+                raise
+            finally:
+                self._undo = None
+                self._savepoint = None
+
+    #: Alias of transaction
+    batch = transaction
+
+    def _begin_transaction(self):
+        """ Start recording how to undo changes """
+        self._undo = []
+        self._savepoint = self._store.savepoint()
+
+    def _commit_transaction(self):
+        """ Make any changes that were put off until the end of the transaction
+        """
+        self._undo = None
+
+    def _rollback_transaction(self):
+        """ Undo all changes made in the transaction, latest first """
+        undo, self._undo = self._undo, None
+        with self._store.undoing(self._savepoint):
+            for func in reversed(undo):
+                func()
+
+    def _timer(self, name):
+        """ Context manager timing its contents into the metrics, if there are
+            any
+        """
+        return null_lock if self._metrics is None else self._metrics.timer(name)
+
+    def stats(self):
+        """ Get a snapshot of the metrics recorded by an instrumented store
+            (see the metrics module) and the database using it
+
+            Returns a dict of the 'counters' and 'timers' recorded so far,
+            which are empty unless the store is instrumented, and the 'gauges'
+            describing the current state of the store and database
+        """
+        if self._metrics is None:
+            stats = {"counters": {}, "timers": {}}
+        else:
+            stats = self._metrics.snapshot()
+        gauges = self._store._gauges()
+        gauges["live_rows"] = len(self._references)
+        gauges["indices"] = sorted(self._indices)
+        stats["gauges"] = gauges
+        return stats
+
     def __getitem__(self, idx):
-        """ Get the row corresponding to idx """
+        """ Get the row corresponding to idx
+
+            With the identity map, a live row for that index is returned if
+            there is one
+        """
         # A well behaved row class (i.e. one that calls Row.__init__) will add
         # itself to our references list
-        return self._row_cls(self, idx)
+        if not self._identity_map:
+            return self._row_cls(self, idx)
+        store_type = getattr(type(self), self._index_column).store_type
+        row = self._references.get(store_type(idx) )
+        if row is None:
+            row = self._row_cls(self, idx)
+        if self._row_cache is not None:
+            self._row_cache.touch(row)
+        return row
 
+    @_exclusive
     def __delitem__(self, row):
         """ Remove a row """
         if isinstance(row, self._row_cls):
             index = row._index
-            self._references.remove(row)
         else:
             index = row
+        self._forget_row(index)
         del self._store[index]
 
-    def select(self, selection):
+    def _forget_row(self, index):
+        """ Remove all record of a row that is about to be deleted """
+        self._forget_references(index)
+        self._unindex_row(index)
+
+    def _forget_references(self, index):
+        """ Drop the rows referring to an index that is about to be deleted """
+        # Any rows referring to this index are no longer part of the database
+        for r in self._references.rows_at(index):
+            self._references.remove(r)
+            if self._row_cache is not None:
+                self._row_cache.remove(r)
+
+    def clear_row_cache(self):
+        """ Stop keeping recently used rows alive """
+        if self._row_cache is not None:
+            self._row_cache.clear()
+
+    def _index_for(self, column):
+        """ Get the secondary index on a column, building it if necessary
+
+            Returns None if the column is not indexed
+        """
+        try:
+            return self._indices[column.name]
+        except KeyError:
+            pass
+        index_cls = getattr(column, "index_cls", None)
+        if index_cls is None or column.name in self._unindexable:
+            return None
+        return self._build_index(column, index_cls)
+
+    @_exclusive
+    def _build_index(self, column, index_cls):
+        """ Build a secondary index on a column
+
+            Returns None if the column holds values that the index can't hold
+        """
+        # Another thread may have built it in the meantime
+        try:
+            return self._indices[column.name]
+        except KeyError:
+            pass
+        if column.name in self._unindexable:
+            return None
+        index = index_cls(column)
+        try:
+            with self._timer("index_build"):
+                index.build(self)
+        except TypeError:
+            self._unindexable.add(column.name)
+            return None
+        self._indices[column.name] = index
+        return index
+
+    def _drop_index(self, name):
+        """ Stop using the index on a column after it was given a value that it
+            can't hold, selections on the column scan it instead
+
+            The index is tried again once the indexes are reset
+        """
+        del self._indices[name]
+        self._unindexable.add(name)
+
+    def _reset_indices(self):
+        """ Drop all built indexes, they will be rebuilt when next needed
+
+            This should be called if the store's contents are replaced
+        """
+        self._indices = {}
+        self._unindexable = set()
+
+    def _index_row(self, row_idx, store_data):
+        """ Add a new row to the built indexes """
+        for name, index in list(iteritems(self._indices) ):
+            column = index.column
+            try:
+                index.add(column.type(store_data[name]), row_idx)
+            except TypeError:
+                self._drop_index(name)
+
+    def _index_rows(self, row_indices, store_rows):
+        """ Add several new rows to the built indexes, each index is only
+            updated once
+        """
+        for name, index in list(iteritems(self._indices) ):
+            cnv = index.column.type
+            try:
+                index.add_many(
+                        [cnv(store_data[name]) for store_data in store_rows],
+                        row_indices)
+            except TypeError:
+                self._drop_index(name)
+
+    def _unindex_row(self, row_idx):
+        """ Remove a row from the built indexes """
+        for name, index in list(iteritems(self._indices) ):
+            try:
+                index.remove(index.column.get(self, row_idx), row_idx)
+            except TypeError:
+                self._drop_index(name)
+
+    def _unindex_rows(self, row_indices):
+        """ Remove several rows from the built indexes, each index is only
+            updated once
+        """
+        for name, index in list(iteritems(self._indices) ):
+            column = index.column
+            try:
+                index.remove_many(
+                        [column.get(self, idx) for idx in row_indices],
+                        row_indices)
+            except TypeError:
+                self._drop_index(name)
+
+    @_exclusive
+    def _set_value(self, row_idx, column, value):
+        """ Set the stored value of a column in a row
+
+            All changes to a row go through here so that the indexes stay up
+            to date
+        """
+        if self._undo is not None:
+            old = self._store[row_idx, column.index]
+            self._undo.append(lambda: self._set_value(row_idx, column, old) )
+        index = self._indices.get(column.name)
+        if index is None:
+            self._store[row_idx, column.index] = value
+        else:
+            old = column.get(self, row_idx)
+            self._store[row_idx, column.index] = value
+            try:
+                index.remove(old, row_idx)
+                index.add(column.type(value), row_idx)
+            except TypeError:
+                self._drop_index(column.name)
+
+    def _lookup(self, column, op, value):
+        """ Find the store indices of rows where 'column op value' is True
+
+            Returns None if this cannot be done without a scan
+        """
+        if isinstance(column, IndexColumn):
+            if not self.is_associative or not (
+                    op == "eq" or (op == "in" and is_collection(value) ) ):
+                return None
+            values = [value] if op == "eq" else value
+            keys = (column.store_type(v) for v in values)
+            return list({k for k in keys if k in self._store})
+        index = self._index_for(column)
+        if index is None:
+            return None
+        return self._index_lookup(index, op, value)
+
+    @_shared
+    def _index_lookup(self, index, op, value):
+        """ Look up a value in a secondary index """
+        return index.lookup(op, value)
+
+    def _ordered_indices(self, column, descending=False):
+        """ Get the store indices of all rows in the order of a column's
+            values, read from its index
+
+            A sorted index is built if the column asks for one. Returns None
+            if the column has no index that can give the order.
+        """
+        index = self._indices.get(column.name)
+        if index is None:
+            index_cls = getattr(column, "index_cls", None)
+            if index_cls is None or not issubclass(index_cls, SortedIndex):
+                return None
+            index = self._build_index(column, index_cls)
+            if index is None:
+                return None
+        return self._index_order(index, descending)
+
+    @_shared
+    def _index_order(self, index, descending):
+        """ Read the order of the rows from a secondary index """
+        return index.ordered(descending)
+
+    def _rows_from_indices(self, indices, ordered=False):
+        """ Iterate over the rows with the given store indices
+
+            For sequential databases the rows are returned in order, ordered
+            should be set if the indices are already in order
+        """
+        if self.is_sequential:
+            if not ordered:
+                indices = sorted(indices)
+            return (self[idx] for idx in indices)
+        cnv = getattr(type(self), self._index_column).type
+        return (self[cnv(idx)] for idx in indices)
+
+    def select(self, selection, workers=None, executor=None):
         """ Select all rows that correspond to the given selection
 
             selection is an iterable of True/False decisions that should be
             constructed by applying conditions to the database' columns
 
-            Returns an ItrMonad
+            If the selection is a query expression built from this database'
+            columns (see the query module) then any comparisons on indexed
+            columns are resolved through their indexes, and the rest of the
+            expression is compiled into a single predicate. Rows in an
+            associative database selected through an index are returned in the
+            order given by the index.
+
+            The selection can also be a boolean NumPy array (or an ArrayMonad)
+            with one entry per row.
+
+            If workers or executor is given then an expression that has to be
+            evaluated on every row is instead evaluated in chunks by a pool of
+            that many processes, or by the executor (see the parallel module).
+            Any other kind of selection has already been evaluated, so these
+            are ignored.
+
+            Returns a Selection (see the query module), an ItrMonad over the
+            rows which can first be sorted and limited
+
+            >>> db.select(db.run == 3).order_by(db.energy, descending=True).limit(10)
         """
+        self._store._count("selects")
+        if isinstance(selection, Expr) and selection.database is self:
+            if workers is None and executor is None:
+                return Selection(self, *select_indices(selection) )
+            with executor_for(workers, executor) as pool:
+                found = select_indices(selection, pool)
+            return Selection(self, *found)
+        mask = as_mask(selection)
+        if mask is not None:
+            if len(mask) != len(self):
+                raise ValueError(
+                        "Mask of length {0} provided for {1} rows".format(
+                            len(mask), len(self) ) )
+            positions = mask.nonzero()[0].tolist()
+            if self.is_sequential:
+                return Selection(self, positions, True)
+            keys = list(self._store)
+            return Selection(self, [keys[p] for p in positions], True)
         if self.is_associative:
-            return ItrMonad(self[idx] for (idx, sel) in zip(self, selection) if sel)
+            return Selection(self, compress(self._store, selection), True)
         else:
-            return ItrMonad(row for (row, sel) in zip(self, selection) if sel)
+            return Selection(self, compress(range(len(self) ), selection), True)
+
+    def order_by(self, column, descending=False):
+        """ Get all the rows sorted by the values of a column
+
+            Convenience method, equivalent to ordering a Selection of every
+            row (see Selection.order_by)
+
+            >>> db.order_by(db.time, descending=True).limit(10)
+        """
+        return Selection(self).order_by(column, descending)
 
     def select_one(self, selection):
         """ Convenience method. Returns the results of select if it would
@@ -410,6 +834,60 @@ class DBBase(with_metaclass(DBMeta, object) ):
             return row
         raise KeyError("More than one row selected!")
 
+    def group_by(self, *columns):
+        """ Group the rows by the values of some columns, so that other columns
+            can be aggregated within each group (see aggregate.GroupBy)
+
+            Columns can be given as read from the database or by name
+
+            >>> db.group_by(db.run).agg(n="count", total=(db.energy, "sum") )
+        """
+        return GroupBy(self, columns)
+
+    def join(self, other, on, how="inner"):
+        """ Join the rows of this database to those of another where the values
+            of a column in each are equal (see the join module)
+
+            on is the (column in this, column in other) pair, or the name of a
+            column held by both. how is either 'inner' or 'left'.
+
+            Returns an ItrMonad over (row, other row) pairs
+
+            >>> db_a.join(db_b, on=(db_a.run, db_b._index_column), how="left")
+        """
+        return join_rows(self, other, on, how)
+
+    def columns_as_arrays(self, *names):
+        """ Read columns into ArrayMonads for vectorised evaluation
+
+            Returns a dictionary of column name to ArrayMonad. If no names are
+            provided then all columns are read. Requires NumPy
+        """
+        if not names:
+            names = [c.name for c in self._columns]
+        return {
+                name: ArrayMonad(getattr(type(self), name).as_array(self) )
+                for name in names}
+
+    @classmethod
+    def _row_codec(cls, store_type):
+        """ Get the decoder and encoder converting rows of this class to and
+            from remote data of a store type (see column.make_row_codec)
+
+            These are generated the first time that they are needed for each
+            class and store type
+        """
+        # Look in this class' own dict so that subclasses get their own
+        codecs = cls.__dict__.get("_row_codecs")
+        if codecs is None:
+            codecs = {}
+            cls._row_codecs = codecs
+        try:
+            return codecs[store_type]
+        except KeyError:
+            codec = codecs[store_type] = make_row_codec(cls._columns, store_type)
+            return codec
+
     @classmethod
     def _convert_data_for_store(cls, data):
         """ Convert the provided data into what is expected by the store """
@@ -427,8 +905,42 @@ class DBBase(with_metaclass(DBMeta, object) ):
                 ", ".join(data) ) )
         return store_data
 
+    @classmethod
+    def _convert_rows_for_store(cls, rows, skip=() ):
+        """ Convert many rows of provided data into what is expected by the
+            store
+
+            This is equivalent to calling _convert_data_for_store on each row,
+            but the column information is only looked up once and the provided
+            dicts are not modified. Any keys in skip are ignored.
+        """
+        columns = [
+                (c.name, c._desc.default,
+                 None if c.store_type is identity else c.store_type)
+                for c in cls._columns]
+        for data in rows:
+            store_data = {}
+            n_found = 0
+            for name, default, store_type in columns:
+                try:
+                    val = data[name]
+                    n_found += 1
+                except KeyError:
+                    val = default
+                    if val is ColumnDesc.NO_DEFAULT:
+                        raise
+                store_data[name] = val if store_type is None else store_type(val)
+            if n_found + sum(1 for k in skip if k in data) != len(data):
+                raise KeyError("Unknown fields {0} provided".format(", ".join(
+                    k for k in data if k not in store_data and k not in skip) ) )
+            yield store_data
+
 class SeqDatabase(DBBase, Sequence):
     """ Database with a sequential store """
+    # The indices marked for deletion inside defer_deletes
+    _deferred_deletes = None
+    # Those marked outside of the current transaction
+    _outer_deletes = None
 
     def __getitem__(self, index):
         # For sequential databases, remap negative keys to make sure that they
@@ -438,7 +950,9 @@ class SeqDatabase(DBBase, Sequence):
             if pos_index < 0:
                 raise IndexError(index)
             index = pos_index
-        super(SeqDatabase, self).__getitem__(index)
+        elif index >= len(self):
+            raise IndexError(index)
+        return super(SeqDatabase, self).__getitem__(index)
 
     @property
     def is_sequential(self):
@@ -455,17 +969,133 @@ class SeqDatabase(DBBase, Sequence):
             (for instance, if a row is deleted. remap should be a mapping of old
             index to new index.
         """
-        for row in self._references:
-            try:
-                row._index = remap[row._index]
-            except KeyError:
-                pass
+        self._references.remap(remap)
+        for index in self._indices.values():
+            index.remap(remap)
+
+    def __delitem__(self, row):
+        """ Remove a row
+
+            Inside defer_deletes the row is only marked for deletion
+        """
+        if self._deferred_deletes is not None:
+            self.delete_many([row])
+            return
+        if not isinstance(row, self._row_cls):
+            # Stored positions are never negative
+            if row < 0:
+                row += len(self)
+            if not 0 <= row < len(self):
+                raise IndexError(row)
+        super(SeqDatabase, self).__delitem__(row)
+
+    @_exclusive
+    def delete_many(self, rows):
+        """ Remove several rows at once
+
+            rows can contain rows or indices. The store is compacted once and
+            the indices of any live rows remapped once, so this is much faster
+            than deleting the rows one at a time. Inside defer_deletes the rows
+            are only marked for deletion
+        """
+        indices = set()
+        for row in rows:
+            index = row._index if isinstance(row, self._row_cls) else row
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(index)
+            indices.add(index)
+        if self._deferred_deletes is not None:
+            self._deferred_deletes.update(indices)
+            return
+        self._delete_indices(sorted(indices) )
+
+    def _delete_indices(self, indices):
+        """ Remove the rows with the given sorted, unique indices """
+        for index in indices:
+            self._forget_references(index)
+        self._unindex_rows(indices)
+        self._store.delete_many(indices)
+
+    def _begin_transaction(self):
+        super(SeqDatabase, self)._begin_transaction()
+        # Deleting rows would move the rows after them, which couldn't be
+        # undone, so deletions wait until the transaction is committed
+        self._outer_deletes = self._deferred_deletes
+        self._deferred_deletes = set()
+
+    def _commit_transaction(self):
+        super(SeqDatabase, self)._commit_transaction()
+        deleted = self._deferred_deletes
+        self._deferred_deletes = self._outer_deletes
+        # Inside defer_deletes this just passes them on
+        self.delete_many(deleted)
 
+    def _rollback_transaction(self):
+        self._deferred_deletes = self._outer_deletes
+        super(SeqDatabase, self)._rollback_transaction()
+
+    def _undo_append(self, start):
+        """ Remember how to remove rows appended from start in a transaction
+        """
+        if self._undo is not None:
+            self._undo.append(
+                    lambda: self._delete_indices(range(start, len(self) ) ) )
+
+    @contextmanager
+    def defer_deletes(self):
+        """ Context manager that defers deletions until it exits
+
+            Inside the context, deleting a row only marks it for deletion (a
+            tombstone) and the rows stay where they are, so row indices remain
+            stable. This makes it safe to delete rows while iterating over the
+            database. On exit all marked rows are removed in one delete_many.
+
+            >>> with db.defer_deletes():
+            >>>     for row in db:
+            >>>         if row.stale:
+            >>>             del db[row]
+        """
+        if self._deferred_deletes is not None:
+            # Nested, the outermost context does the deletion
+            yield
+            return
+        self._deferred_deletes = set()
+        try:
+            yield
+        finally:
+            deleted = self._deferred_deletes
+            self._deferred_deletes = None
+            self.delete_many(deleted)
+
+    @_exclusive
     def append(self, **row_data):
         """ Add a new row with the supplied data """
-        self._store.append(self._convert_data_for_store(row_data) )
+        store_data = self._convert_data_for_store(row_data)
+        self._undo_append(len(self) )
+        self._store.append(store_data)
+        self._index_row(len(self) - 1, store_data)
         return self[-1]
 
+    @_exclusive
+    def extend(self, rows, return_rows=False):
+        """ Add several new rows at once
+
+            rows should be an iterable of dicts, each holding the data that
+            would be passed to append. The data is converted in one batch and
+            added to the store in one operation. If return_rows is True a list
+            of the new rows is returned, otherwise nothing is.
+        """
+        store_rows = list(self._convert_rows_for_store(rows) )
+        start = len(self)
+        self._undo_append(start)
+        self._store.extend(store_rows)
+        if self._indices:
+            self._index_rows(range(start, len(self) ), store_rows)
+        if return_rows:
+            return [self[idx] for idx in range(start, len(self) )]
+
 class AssocDatabase(DBBase, Mapping):
     """ Database with an associative store """
 
@@ -485,11 +1115,59 @@ class AssocDatabase(DBBase, Mapping):
         cnv = getattr(type(self), self._index_column).type
         return (cnv(x) for x in self._store)
 
+    @_exclusive
+    def __delitem__(self, row):
+        if self._undo is not None:
+            index = row._index if isinstance(row, self._row_cls) else row
+            store_data = {
+                    c.name: self._store[index, c.index] for c in self._columns}
+            self._undo.append(lambda: self._restore_row(index, store_data) )
+        super(AssocDatabase, self).__delitem__(row)
+
+    def _restore_row(self, store_index, store_data):
+        """ Put back a row deleted in a transaction """
+        self._store.add(store_index, store_data)
+        self._index_row(store_index, store_data)
+
+    def _undo_add(self, store_indices):
+        """ Remember how to remove rows added in a transaction """
+        if self._undo is not None:
+            def undo():
+                for index in store_indices:
+                    self._forget_row(index)
+                    del self._store[index]
+            self._undo.append(undo)
+
+    @_exclusive
     def add(self, **row_data):
         """ Add a new row with the supplied index and data """
         # First get the index - we have to convert it to the store type
         index = row_data.pop(self._index_column)
         store_type = getattr(type(self), self._index_column).store_type
         store_index = store_type(index)
-        self._store.add(store_index, self._convert_data_for_store(row_data) )
+        store_data = self._convert_data_for_store(row_data)
+        self._store.add(store_index, store_data)
+        self._undo_add([store_index])
+        self._index_row(store_index, store_data)
         return self[index]
+
+    @_exclusive
+    def add_many(self, rows, return_rows=False):
+        """ Add several new rows at once
+
+            rows should be an iterable of dicts, each holding the index and data
+            that would be passed to add. The data is converted in one batch and
+            added to the store in one operation. If return_rows is True a list
+            of the new rows is returned, otherwise nothing is.
+        """
+        rows = list(rows)
+        index_name = self._index_column
+        store_type = getattr(type(self), index_name).store_type
+        store_indices = [store_type(r[index_name]) for r in rows]
+        store_rows = list(self._convert_rows_for_store(rows, skip=(index_name,) ) )
+        self._store.add_many(zip(store_indices, store_rows) )
+        self._undo_add(store_indices)
+        if self._indices:
+            self._index_rows(store_indices, store_rows)
+        if return_rows:
+            return [self[r[index_name]] for r in rows]
@@ -0,0 +1,328 @@
+""" Secondary indexes on database columns
+
+    An index maps the values held in a column to the indices of the rows that
+    hold them, so that selections on that column can be resolved without
+    scanning every row. Indexes are declared through the index parameter of a
+    ColumnDesc, built by the database the first time that they are needed and
+    kept up to date by the database from then on.
+
+    The values held in an index are those returned by the column (i.e. after
+    its type conversion has been applied), so that lookups agree with
+    comparisons made on the column itself.
+
+    Lookups are requested with an operation name and a value. The operation
+    names are 'eq', 'in', 'lt', 'le', 'gt' and 'ge'. If an index cannot answer
+    a lookup it returns None and the caller should fall back to a scan. If a
+    column holds values that its index cannot hold at all (e.g. values of
+    types that cannot be ordered against each other in a SortedIndex) the
+    database drops the index and scans the column instead.
+"""
+from builtins import object, range, zip
+from future.utils import iteritems, itervalues, with_metaclass
+from itertools import chain
+from operator import itemgetter
+import abc
+import bisect
+
+def is_collection(value):
+    """ Whether the right hand side of an 'in' lookup can be expanded
+
+        Strings are excluded as 'x in string' tests for substrings
+    """
+    return isinstance(value, (list, tuple, set, frozenset) )
+
+def remap_rows(remap, rows):
+    """ Get a list of the row indices in rows, with those in remap replaced by
+        their new indices
+
+        The remappings made by the stores can do this in one pass without a
+        lookup per row
+    """
+    try:
+        remap_all = remap.remap_all
+    except AttributeError:
+        return [remap[r] if r in remap else r for r in rows]
+    return remap_all(rows)
+
+class ColumnIndex(with_metaclass(abc.ABCMeta, object) ):
+    """ Base class for secondary indexes on a column
+
+        Adding a value that the index cannot hold (e.g. an unhashable value in
+        a HashIndex) raises a TypeError, in which case the database stops using
+        the index and scans the column instead.
+    """
+
+    def __init__(self, column):
+        self._column = column
+        self.clear()
+
+    @property
+    def column(self):
+        """ The column that this indexes """
+        return self._column
+
+    def build(self, db):
+        """ Fill the index from the current contents of the database """
+        self.clear()
+        for row_idx, value in zip(db._store, self._column.iter_values(db) ):
+            self.add(value, row_idx)
+
+    @abc.abstractmethod
+    def clear(self):
+        """ Remove all entries from the index """
+        pass
+
+    @abc.abstractmethod
+    def add(self, value, row_idx):
+        """ Record that the given row holds value """
+        pass
+
+    def add_many(self, values, row_indices):
+        """ Record that each of the given rows holds the matching value
+
+            The implementation here adds them one at a time, indexes for which
+            that is slow should override this
+        """
+        for value, row_idx in zip(values, row_indices):
+            self.add(value, row_idx)
+
+    @abc.abstractmethod
+    def remove(self, value, row_idx):
+        """ Remove the record that the given row holds value """
+        pass
+
+    def remove_many(self, values, row_indices):
+        """ Remove the records that each of the given rows holds the matching
+            value
+
+            The implementation here removes them one at a time, indexes for
+            which that is slow should override this
+        """
+        for value, row_idx in zip(values, row_indices):
+            self.remove(value, row_idx)
+
+    @abc.abstractmethod
+    def remap(self, remap):
+        """ Reassign row indices, remap is a mapping of old to new index """
+        pass
+
+    @abc.abstractmethod
+    def lookup(self, op, value):
+        """ Get the indices of all rows satisfying 'row_value op value'
+
+            Returns None if this index cannot answer the lookup
+        """
+        pass
+
+    def bounds(self):
+        """ Get the smallest and largest values held, None if this index cannot
+            give them
+        """
+        return None
+
+    def ordered(self, descending=False):
+        """ Get a list of the indices of all rows in the order of their values,
+            None if this index cannot give them
+
+            The order of rows with equal values is not defined
+        """
+        return None
+
+class HashIndex(ColumnIndex):
+    """ Index held in a dict, supports equality and membership lookups
+
+        As well as the rows holding each value, the value held by each row is
+        kept so that remapping only has to touch the rows that move
+    """
+
+    def clear(self):
+        self._rows = {}
+        self._values = {}
+
+    def add(self, value, row_idx):
+        try:
+            self._rows[value].add(row_idx)
+        except KeyError:
+            self._rows[value] = {row_idx}
+        self._values[row_idx] = value
+
+    def remove(self, value, row_idx):
+        rows = self._rows[value]
+        rows.remove(row_idx)
+        if not rows:
+            del self._rows[value]
+        del self._values[row_idx]
+
+    def remap(self, remap):
+        if not remap:
+            return
+        if 4 * len(remap) > len(self._values):
+            # Moving a row touches several dicts and sets, so when many rows
+            # move it is quicker to rebuild both in one pass
+            self._values = dict(zip(
+                remap_rows(remap, self._values), itervalues(self._values) ) )
+            self._rows = {
+                    value: set(remap_rows(remap, rows) )
+                    for value, rows in iteritems(self._rows)}
+            return
+        moving = [idx for idx in remap if idx in self._values]
+        # Take all of the moving rows out before putting any back, as a row may
+        # move to the old index of another
+        moved = []
+        for idx, new_idx in zip(moving, remap_rows(remap, moving) ):
+            value = self._values.pop(idx)
+            self._rows[value].remove(idx)
+            moved.append( (new_idx, value) )
+        for new_idx, value in moved:
+            self._rows[value].add(new_idx)
+            self._values[new_idx] = value
+
+    def lookup(self, op, value):
+        try:
+            if op == "eq":
+                return list(self._rows.get(value, () ) )
+            elif op == "in" and is_collection(value):
+                result = set()
+                for v in value:
+                    result.update(self._rows.get(v, () ) )
+                return list(result)
+        except TypeError:
+            # Unhashable value
+            pass
+        return None
+
+class SortedIndex(ColumnIndex):
+    """ Index held in sorted order, supports equality, membership and range
+        lookups
+
+        The values and their rows are held in two parallel lists, sorted by
+        value. Rows holding None are kept apart from these, so a column can
+        hold None alongside values that are ordered. They are only found by
+        looking up None itself, range lookups never return them. Values that
+        cannot be ordered against each other raise a TypeError.
+    """
+
+    def clear(self):
+        self._values = []
+        self._rows = []
+        self._none_rows = []
+
+    def build(self, db):
+        pairs = []
+        none_rows = []
+        for value, row_idx in zip(self._column.iter_values(db), db._store):
+            if value is None:
+                none_rows.append(row_idx)
+            else:
+                pairs.append( (value, row_idx) )
+        pairs.sort(key=itemgetter(0) )
+        self._values = [p[0] for p in pairs]
+        self._rows = [p[1] for p in pairs]
+        self._none_rows = none_rows
+
+    def add(self, value, row_idx):
+        if value is None:
+            self._none_rows.append(row_idx)
+            return
+        pos = bisect.bisect_right(self._values, value)
+        self._values.insert(pos, value)
+        self._rows.insert(pos, row_idx)
+
+    def add_many(self, values, row_indices):
+        pairs = []
+        for value, row_idx in zip(values, row_indices):
+            if value is None:
+                self._none_rows.append(row_idx)
+            else:
+                pairs.append( (value, row_idx) )
+        if len(pairs) < 2:
+            for value, row_idx in pairs:
+                self.add(value, row_idx)
+            return
+        pairs.sort(key=itemgetter(0) )
+        if self._values and pairs[0][0] < self._values[-1]:
+            # Inserting into the middle of the lists moves everything after,
+            # so merge the two sorted runs instead. The sort is stable, so
+            # rows already held stay ahead of new rows with equal values
+            pairs = sorted(
+                    chain(zip(self._values, self._rows), pairs),
+                    key=itemgetter(0) )
+            self._values = [p[0] for p in pairs]
+            self._rows = [p[1] for p in pairs]
+        else:
+            self._values.extend(p[0] for p in pairs)
+            self._rows.extend(p[1] for p in pairs)
+
+    def remove(self, value, row_idx):
+        if value is None:
+            self._none_rows.remove(row_idx)
+            return
+        lo = bisect.bisect_left(self._values, value)
+        hi = bisect.bisect_right(self._values, value)
+        for pos in range(lo, hi):
+            if self._rows[pos] == row_idx:
+                del self._values[pos]
+                del self._rows[pos]
+                return
+        raise KeyError(row_idx)
+
+    def remove_many(self, values, row_indices):
+        removed = set(row_indices)
+        if len(removed) < 2:
+            return super(SortedIndex, self).remove_many(values, row_indices)
+        # Removing from the middle of the lists moves everything after, so
+        # rebuild them in one pass instead
+        keep = [pos for pos, r in enumerate(self._rows) if r not in removed]
+        self._values = [self._values[pos] for pos in keep]
+        self._rows = [self._rows[pos] for pos in keep]
+        self._none_rows = [r for r in self._none_rows if r not in removed]
+
+    def remap(self, remap):
+        if not remap:
+            return
+        self._rows = remap_rows(remap, self._rows)
+        self._none_rows = remap_rows(remap, self._none_rows)
+
+    def lookup(self, op, value):
+        values = self._values
+        if value is None:
+            return list(self._none_rows) if op == "eq" else None
+        try:
+            if op == "eq":
+                return self._rows[
+                        bisect.bisect_left(values, value):
+                        bisect.bisect_right(values, value)]
+            elif op == "lt":
+                return self._rows[:bisect.bisect_left(values, value)]
+            elif op == "le":
+                return self._rows[:bisect.bisect_right(values, value)]
+            elif op == "gt":
+                return self._rows[bisect.bisect_right(values, value):]
+            elif op == "ge":
+                return self._rows[bisect.bisect_left(values, value):]
+            elif op == "in" and is_collection(value):
+                result = []
+                for v in set(value):
+                    result += self.lookup("eq", v)
+                return result
+        except TypeError:
+            # Value not comparable with the indexed values
+            pass
+        return None
+
+    def bounds(self):
+        if not self._values or self._none_rows:
+            # None can't be compared to the other values
+            return None
+        return self._values[0], self._values[-1]
+
+    def ordered(self, descending=False):
+        if self._none_rows:
+            return None
+        return self._rows[::-1] if descending else list(self._rows)
+
+#: The index types that can be requested by name
+index_types = {
+        "hash": HashIndex,
+        "sorted": SortedIndex,
+        }
@@ -0,0 +1,142 @@
+""" Joining the rows of two databases
+
+    The result of a join is an ItrMonad over pairs of rows, one from each
+    database, for which the values of the joined columns are equal. A left join
+    also gives each row of the left database that has no match, paired with
+    None.
+
+    >>> db_a.join(db_b, on=(db_a.run, db_b.run) )
+    >>> db_a.join(db_b, on="run", how="left")
+
+    Nothing is done until the result is iterated over. Then
+    - if the right database is associative and is joined on its index column
+      each left value is looked up directly in its store
+    - otherwise if the right column has a built index each left value is
+      looked up in that
+    - otherwise a hash table is built from the values of the column in the
+      smaller database and probed with the values of the other
+    The values are read from the stores a whole column at a time, and rows are
+    only made for the pairs returned.
+
+    The pairs are in the order of the rows of the database that is probed.
+    This is the left database unless the hash table is built on it, in which
+    case the unmatched rows of a left join come last.
+"""
+from builtins import zip, range
+from future.utils import string_types
+from .coll_monad import ItrMonad
+from .column import IndexColumn
+from .aggregate import _resolve_column
+
+#: The kinds of join that can be made
+join_types = ("inner", "left")
+
+def _store_indices(db):
+    """ Get the store indices of a database's rows, in the order of its column
+        values
+    """
+    return range(len(db) ) if db.is_sequential else list(db._store)
+
+def _row_getter(db):
+    """ Get a function making the row with a store index """
+    if db.is_sequential:
+        return db.__getitem__
+    cnv = getattr(type(db), db._index_column).type
+    return lambda idx: db[cnv(idx)]
+
+def _hash_table(db, column):
+    """ Build a dict of each value of a column to the store indices of the
+        rows holding it
+    """
+    table = {}
+    for idx, value in zip(_store_indices(db), column.values(db) ):
+        try:
+            table[value].append(idx)
+        except KeyError:
+            table[value] = [idx]
+    return table
+
+def _store_finder(db, column):
+    """ Make a function finding the store indices of the rows with an index
+        value, by looking it up in the database's store
+    """
+    store = db._store
+    store_type = column.store_type
+    def find(value):
+        try:
+            key = store_type(value)
+        except (TypeError, ValueError):
+            return ()
+        return (key,) if key in store else ()
+    return find
+
+def _probe(left, right, lcol, find, how):
+    """ Pair each row of the left database with the rows of the right found
+        for its value
+    """
+    left_row = _row_getter(left)
+    right_row = _row_getter(right)
+    for lidx, value in zip(_store_indices(left), lcol.values(left) ):
+        found = find(value)
+        if found:
+            row = left_row(lidx)
+            for ridx in found:
+                yield row, right_row(ridx)
+        elif how == "left":
+            yield left_row(lidx), None
+
+def _probe_right(left, right, lcol, rcol, how):
+    """ Pair rows by building a hash table on the left database and probing it
+        with each row of the right
+    """
+    table = _hash_table(left, lcol)
+    left_row = _row_getter(left)
+    right_row = _row_getter(right)
+    matched = set()
+    for ridx, value in zip(_store_indices(right), rcol.values(right) ):
+        found = table.get(value)
+        if found:
+            row = right_row(ridx)
+            for lidx in found:
+                yield left_row(lidx), row
+            if how == "left":
+                matched.update(found)
+    if how == "left":
+        for lidx in _store_indices(left):
+            if lidx not in matched:
+                yield left_row(lidx), None
+
+def _join(left, right, lcol, rcol, how):
+    """ Generator over the pairs of joined rows """
+    if right.is_associative and isinstance(rcol, IndexColumn):
+        pairs = _probe(left, right, lcol, _store_finder(right, rcol), how)
+    elif rcol.name in right._indices:
+        index = right._indices[rcol.name]
+        pairs = _probe(
+                left, right, lcol,
+                lambda value: right._index_lookup(index, "eq", value), how)
+    elif len(left) < len(right):
+        pairs = _probe_right(left, right, lcol, rcol, how)
+    else:
+        pairs = _probe(left, right, lcol, _hash_table(right, rcol).get, how)
+    for pair in pairs:
+        yield pair
+
+def join(left, right, on, how="inner"):
+    """ Join the rows of two databases
+
+        on gives the columns to join, either as a (left, right) pair or as a
+        single name held by both databases. Each column can be read from its
+        database (e.g. db.run) or be given by name. The values of the columns
+        must be hashable. how is either 'inner' or 'left'.
+
+        Returns an ItrMonad over (left row, right row) pairs
+    """
+    if how not in join_types:
+        raise ValueError("Unknown join type '{0}'".format(how) )
+    if isinstance(on, string_types):
+        on = (on, on)
+    lcol, rcol = on
+    return ItrMonad(_join(
+        left, right, _resolve_column(left, lcol), _resolve_column(right, rcol),
+        how) )
@@ -1,79 +1,485 @@
 """ Store classes for reading and writing to JSON """
 
-from future.utils import iteritems
-from .store import Store
+from future.utils import iteritems, itervalues
+from builtins import range, str, zip
+from .store import Store, BulkIndexShift
+from .json_stream import iter_json_rows
 from .tuple_store import (
         TupleSeqStore, TupleAssocStore, MutableTupleSeqStore,
         MutableTupleAssocStore)
+from contextlib import contextmanager
 import json
 import jsonpatch
+import hashlib
 import os
 import time
 import logging
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where the files are not locked
+    fcntl = None
 logger = logging.getLogger(__name__)
 
+#: Replace a file in one step, os.rename already does so on POSIX in python 2
+_replace = getattr(os, "replace", os.rename)
+
+#: The values allowed for the fsync policy of MutableJSONStore
+fsync_policies = ("never", "data", "full")
+
+def _escape_pointer(key):
+    """ Escape a key for use in a JSON pointer """
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+def _as_bytes(text):
+    """ Encode text as it would be written to a file """
+    return text if isinstance(text, bytes) else text.encode("utf-8")
+
+def _hash_text(text):
+    """ Get the hash of some text as it would be written to a file """
+    return hashlib.sha1(_as_bytes(text) ).hexdigest()
+
+class _HashingFile(object):
+    """ Wraps a text file object, hashing everything read from or written to
+        it
+    """
+
+    def __init__(self, fp):
+        self._fp = fp
+        self._hasher = hashlib.sha1()
+
+    def read(self, size=-1):
+        data = self._fp.read(size)
+        self._hasher.update(_as_bytes(data) )
+        return data
+
+    def write(self, data):
+        self._hasher.update(_as_bytes(data) )
+        return self._fp.write(data)
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+def _stat(path):
+    """ Get the (inode, size, modification time) of a file, or None if it does
+        not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, getattr(st, "st_mtime_ns", st.st_mtime) )
+
+def _fsync_dir(path):
+    """ Make sure that changes to the entries of the directory holding a file
+        are on disk
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path) ), os.O_RDONLY)
+    except OSError:
+        # Directories can't be opened on some platforms
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _hash_path(path):
+    """ Get the hash of the contents of a file, or None if it does not exist """
+    hasher = hashlib.sha1()
+    try:
+        fp = open(path, 'rb')
+    except IOError:
+        return None
+    with fp:
+        for chunk in iter(lambda: fp.read(1 << 16), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
 class JSONStore(Store):
     """ Immutable JSON store """
 
-    def __init__(self, db_file, allow_missing=False, **kwargs):
+    def __init__(self, db_file, allow_missing=False, verify_hash=False,
+                 journal=False, **kwargs):
         """ Create the store
 
             If allow_missing is True, then allow the file to be absent
+
+            The store remembers the inode, size and modification time of the
+            file when it last read or wrote it and will not read it again while
+            these are unchanged. If verify_hash is True then a hash of the
+            file's contents is also kept and compared, which catches changes
+            that these miss (e.g. on filesystems with coarse timestamps) and
+            avoids reparsing files that have only been touched.
+
+            If journal is True then changes to the database may also be held in
+            a journal file (see MutableJSONStore), which is replayed on top of
+            the database file whenever it is read.
         """
         self._db_file = db_file
+        self._journal_file = db_file + ".jsonpatch" if journal else None
+        self._verify_hash = verify_hash
+        # The state and hash of the file when it was last read or written
+        self._file_state = None
+        self._file_hash = None
+        # The hash of the database file's contents, which ties a journal to it
+        self._base_hash = None
+        # The hash of the journal's contents so far, the number of operations
+        # in it and whether or not it can be appended to
+        self._journal_hasher = None
+        self._journal_ops = 0
+        self._journal_ok = True
+        super(JSONStore, self).__init__(**kwargs)
+        if not self._load() and not allow_missing:
+            raise IOError("Database file {0} does not exist".format(db_file) )
+
+    def _stat_file(self):
+        """ Get the (inode, size, modification time) of the file on disk, or
+            None if it does not exist
+
+            If there is a journal then its state is included too
+        """
+        state = _stat(self._db_file)
+        if state is None or self._journal_file is None:
+            return state
+        return state + (_stat(self._journal_file),)
+
+    def _hash_file(self):
+        """ Get the hash of the contents of the file (and journal) on disk """
+        base_hash = _hash_path(self._db_file)
+        if self._journal_file is None:
+            return base_hash
+        return (base_hash, _hash_path(self._journal_file) )
+
+    def _content_hash(self):
+        """ The hash of the contents last read or written, in the same form as
+            _hash_file
+        """
+        if self._journal_file is None:
+            return self._base_hash
+        return (
+                self._base_hash,
+                self._journal_hasher.hexdigest() if self._journal_hasher
+                else None)
+
+    def _file_unchanged(self):
+        """ Whether the file is the same as when it was last read or written """
+        state = self._stat_file()
+        if state is None or self._file_state is None:
+            return False
+        if state == self._file_state:
+            return not self._verify_hash or self._hash_file() == self._file_hash
+        if self._verify_hash and self._hash_file() == self._file_hash:
+            # Only the metadata has changed
+            self._file_state = state
+            return True
+        return False
+
+    def _record_file(self, state):
+        """ Remember the state of the file that the store now reflects """
+        self._file_state = state
+        self._file_hash = self._content_hash() if self._verify_hash else None
+
+    def _read_journal(self):
+        """ Read the text of the journal, None if there isn't one """
+        self._journal_hasher = None
+        self._journal_ops = 0
+        self._journal_ok = True
+        if self._journal_file is None:
+            return None
+        try:
+            fp = open(self._journal_file, 'r')
+        except IOError:
+            return None
+        with fp:
+            text = fp.read()
+        data = _as_bytes(text)
+        self._count("bytes_read", len(data) )
+        self._journal_hasher = hashlib.sha1(data)
+        return text
+
+    def _journal_operations(self, journal):
+        """ Get the patch operations held in the text of a journal
+
+            The first line of the journal holds the hash of the database file
+            that it applies to, and each following line the list of operations
+            from one write. A journal that applies to a different file was left
+            behind when merging it into the database file was interrupted, so
+            it is ignored. Likewise an incomplete last line was left behind by
+            an interrupted write. In both cases the journal cannot be appended
+            to and the next write has to merge it instead.
+        """
+        lines = journal.splitlines()
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = {}
+        if header.get("base") != self._base_hash:
+            logger.warning(
+                    "Ignoring journal {0} which does not match {1}".format(
+                        self._journal_file, self._db_file) )
+            self._journal_ok = False
+            return []
+        ops = []
+        for line_no, line in enumerate(lines[1:], 1):
+            try:
+                ops += json.loads(line)
+            except ValueError:
+                if line_no != len(lines) - 1:
+                    raise
+                logger.warning(
+                        "Ignoring incomplete last entry of journal {0}".format(
+                            self._journal_file) )
+                self._journal_ok = False
+        self._journal_ops = len(ops)
+        return ops
+
+    def _decode(self, content, journal):
+        """ Decode the contents of the database file and replay the journal on
+            top of them
+        """
+        self._base_hash = _hash_text(content)
+        data = json.loads(content)
+        if journal:
+            ops = self._journal_operations(journal)
+            if ops:
+                jsonpatch.JsonPatch(ops).apply(data, in_place=True)
+        return data
+
+    def _load(self):
+        """ Fill the internal storage from the file on disk
+
+            Unless there is a journal to replay, the file is read one row at a
+            time, and each row converted straight into the internal
+            representation. Returns False if the file does not exist.
+        """
+        # Take the state before reading so that any change made while reading
+        # is picked up next time
+        state = self._stat_file()
         try:
-            with open(db_file, 'r') as fp:
-                data = json.load(fp)
+            fp = open(self._db_file, 'r')
         except IOError:
-            if not allow_missing:
-                raise
+            return False
+        with fp:
+            self._count("bytes_read", os.fstat(fp.fileno() ).st_size)
+            journal = self._read_journal()
+            if journal:
+                # The journal has to be applied to the whole document
+                self.from_dict(self._decode(fp.read(), journal), "JSON")
             else:
-                data = None
-        super(JSONStore, self).__init__(
-                data=data, store_type="JSON", **kwargs)
+                if self._verify_hash:
+                    fp = _HashingFile(fp)
+                self.from_dict(iter_json_rows(fp), "JSON")
+                if self._verify_hash:
+                    # The parser stops at the end of the document, so anything
+                    # after that has to be read to get the hash of the file
+                    while fp.read(1 << 16):
+                        pass
+                self._base_hash = fp.hexdigest() if self._verify_hash else None
+        self._record_file(state)
+        return True
 
     def update(self):
         """ Update our internal storage from the file on disk.
 
+            Nothing is read if the file has not changed since it was last read.
+
             If this is a sequential store it will almost certainly mess up any
             referenced rows
         """
-        if not os.path.exists(self._db_file):
+        if self._file_unchanged():
             return
-        with open(self._db_file, 'r') as fp:
-            self.from_dict(json.load(fp), "JSON")
+        if self._load():
+            self._db._reset_indices()
 
 class MutableJSONStore(JSONStore):
     """ Mutable sequential JSON store """
-    def __init__(self, db_file, update_on_change=False, **kwargs):
+    def __init__(self, db_file, update_on_change=False, journal=False,
+                 journal_max_ops=10000, journal_max_bytes=1 << 24,
+                 lock=True, fsync="data", **kwargs):
         """ Create the store
         
             parameters:
                 update_on_change: If True, update is called whenever a change is
                                   made. Should probably only be called on an
                                   associative store
+                journal: If True, write appends the pending changes to a
+                         journal file (the database file name followed by
+                         '.jsonpatch') rather than rewriting the whole
+                         database file
+                journal_max_ops: The most patch operations that the journal
+                                 can hold before it is merged into the
+                                 database file
+                journal_max_bytes: The largest size in bytes that the journal
+                                   can reach before it is merged into the
+                                   database file
+                lock: If True, hold an advisory lock on a lock file (the
+                      database file name followed by '.lock') while reading
+                      and writing, so that several processes can safely
+                      write to the same database. Only available where the
+                      fcntl module is
+                fsync: When to flush the files written to disk. 'never'
+                       leaves it to the operating system, 'data' (the
+                       default) flushes the database file before it is used
+                       and each append to the journal, and 'full' also
+                       flushes the directory holding a new file, so that it
+                       is certain to survive a crash
+
+            The database file is never written in place, a new file is written
+            next to it and then moved over it. Other processes reading the
+            database therefore see either the old or new file, and a crash
+            while writing leaves the old file in place.
         """
-        self._patches = []
+        if fsync not in fsync_policies:
+            raise ValueError("Unknown fsync policy {0}, must be one of {1}".format(
+                fsync, ", ".join(fsync_policies) ) )
+        self._lock_file = db_file + ".lock" if lock and fcntl else None
+        self._lock_fd = None
+        self._fsync = fsync
+        # Inside batch, the value that each changed cell started with
+        self._batch = None
+        self._clear_patches()
         self._up_on_change = update_on_change
+        self._journal_max_ops = journal_max_ops
+        self._journal_max_bytes = journal_max_bytes
         super(MutableJSONStore, self).__init__(
-                db_file=db_file, allow_missing=True, **kwargs)
+                db_file=db_file, allow_missing=True, journal=journal, **kwargs)
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """ Context manager holding the lock on the lock file
+
+            Inside an exclusive lock no other process can read or write the
+            database, inside a shared lock no other process can write it.
+            Nested calls use the lock that is already held.
+        """
+        if self._lock_file is None or self._lock_fd is not None:
+            yield
+            return
+        self._lock_fd = os.open(self._lock_file, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(
+                    self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            # Closing the file releases the lock
+            fd, self._lock_fd = self._lock_fd, None
+            os.close(fd)
+
+    def _sync(self, fp, created=None):
+        """ Flush a file that has been written to disk as the fsync policy
+            asks
+
+            created is the path of the file if it is a new directory entry
+        """
+        if self._fsync == "never":
+            return
+        fp.flush()
+        os.fsync(fp.fileno() )
+        if created is not None and self._fsync == "full":
+            _fsync_dir(created)
+
+    @contextmanager
+    def batch(self):
+        """ Context manager putting off recording changed values as patches
+            until it exits
+
+            Each changed cell then gets one patch however many times it was
+            changed, and one that ends up back at its starting value gets
+            none (unless it already had pending changes from before). With
+            update_on_change the store is only updated on exit.
+        """
+        if self._batch is not None:
+            yield
+            return
+        self._batch = {}
+        try:
+            yield
+        finally:
+            self._flush_batch()
+            self._batch = None
+        self._changed()
+
+    def savepoint(self):
+        """ Get a copy of the pending patches, see Store.savepoint """
+        self._flush_batch()
+        return (self._patches, list(self._patches),
+                {idx: dict(cells) for idx, cells in iteritems(self._cell_patches)},
+                dict(self._row_patches) )
+
+    @contextmanager
+    def undoing(self, savepoint):
+        """ Context manager inside which all changes made since savepoint was
+            taken are undone
+
+            The pending patches then go back to how they were, unless they were
+            written in the meantime in which case the undoing is recorded as
+            further changes
+        """
+        yield
+        self._flush_batch()
+        patches, saved, cells, rows = savepoint
+        if patches is self._patches:
+            self._patches[:] = saved
+            self._cell_patches = cells
+            self._row_patches = rows
+
+    def _flush_batch(self):
+        """ Record the changes to cells put off inside batch """
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, {}
+        for (row_idx, col_idx), old_value in iteritems(batch):
+            self._set_patch(row_idx, col_idx, old_value)
+
+    def _changed(self):
+        """ Called after each change, update the store if that was asked for
+        """
+        if self._up_on_change and self._batch is None:
+            self.update()
+
+    def _load(self):
+        with self._file_lock(False):
+            return super(MutableJSONStore, self)._load()
 
     def update(self, **kwargs):
         """ Update our internal storage from the file on disk.
 
+            Any pending patches are applied on top of the file's contents. If
+            the file has not changed since it was last read or written then the
+            internal storage already holds exactly that, so nothing is read.
+
             If this is a sequential store it will almost certainly mess up any
             referenced rows
         """
+        with self._file_lock(False):
+            self._update(**kwargs)
+
+    def _update(self, **kwargs):
+        """ Update our internal storage from the file on disk without taking
+            the lock
+        """
         if 'indent' not in kwargs:
             kwargs["indent"] = 2
         if not os.path.exists(self._db_file):
             # If the file doesn't exist then we don't need to do anything
             return
+        if self._file_unchanged():
+            return
+        patches = self._pending_patches()
+        if not patches:
+            # Nothing to apply, so the file can be streamed
+            self._load()
+            self._db._reset_indices()
+            return
         # We have to try and patch the existing file
+        state = self._stat_file()
         with open(self._db_file, 'r') as fp:
-            on_disk = json.load(fp)
+            self._count("bytes_read", os.fstat(fp.fileno() ).st_size)
+            journal = self._read_journal()
+            on_disk = self._decode(fp.read(), journal)
         try:
-            patch = jsonpatch.JsonPatch(self._patches)
+            patch = jsonpatch.JsonPatch(patches)
             patch.apply(on_disk, in_place=True)
         except Exception as e:
             # Use the current POSIX time stamp to make a unique filename
@@ -85,68 +491,303 @@ class MutableJSONStore(JSONStore):
                 "Failed to apply patches! Will write current info in {0},"+
                 "{1} files").format(tmp_db, tmp_patches))
             with open(tmp_db, 'w') as fp:
-                json.dump(self.to_dict(), fp, **kwargs)
+                json.dump(self.to_dict("JSON"), fp, **kwargs)
+            with open(tmp_patches, 'w') as fp:
+                json.dump(patches, fp, **kwargs)
             raise e
         self.from_dict(on_disk, "JSON")
+        self._db._reset_indices()
+        self._record_file(state)
 
     def write(self, **kwargs):
         """ Write the store back to disk
         
             kwargs are forwarded back to the json.dump function
+
+            In journal mode only the pending changes are appended to the
+            journal, unless this would take it past its limits in which case
+            the whole store is written and the journal removed.
+
+            The lock is held from reading any changes made by other processes
+            until the file has been written, so that none of them are lost.
+        """
+        with self._file_lock(True):
+            # First, attempt to update the local store
+            self._update()
+            if self._journal_file is None or not self._append_journal():
+                self._write_file(**kwargs)
+            # The file now holds all of the changes
+            self._clear_patches()
+            self._record_file(self._stat_file() )
+
+    def _append_journal(self):
+        """ Append the pending patches to the journal
+
+            Returns False if the journal should be merged into the database
+            file instead
+        """
+        if not self._journal_ok or not os.path.exists(self._db_file):
+            return False
+        patches = self._pending_patches()
+        if not patches:
+            return True
+        n_ops = self._journal_ops + len(patches)
+        text = json.dumps(patches) + "\n"
+        try:
+            size = os.path.getsize(self._journal_file)
+        except OSError:
+            size = 0
+        if (n_ops > self._journal_max_ops or
+                size + len(text) > self._journal_max_bytes):
+            return False
+        if size == 0:
+            # Starting a new journal, tie it to the current database file
+            if self._base_hash is None:
+                self._base_hash = _hash_path(self._db_file)
+            text = json.dumps({"base": self._base_hash}) + "\n" + text
+            self._journal_hasher = hashlib.sha1()
+        with open(self._journal_file, 'a') as fp:
+            fp.write(text)
+            self._sync(fp, self._journal_file if size == 0 else None)
+        data = _as_bytes(text)
+        self._count("bytes_written", len(data) )
+        self._journal_hasher.update(data)
+        self._journal_ops = n_ops
+        return True
+
+    def _write_file(self, **kwargs):
+        """ Write the whole store to the database file, removing the journal
+
+            The data is written to a temporary file which then replaces the
+            database file
+        """
+        hashed = self._verify_hash or self._journal_file is not None
+        tmp_file = "{0}.{1}.tmp".format(self._db_file, os.getpid() )
+        try:
+            with open(tmp_file, 'w') as raw:
+                fp = _HashingFile(raw) if hashed else raw
+                json.dump(self.to_dict("JSON"), fp, **kwargs)
+                self._sync(raw)
+                self._count("bytes_written", raw.tell() )
+            try:
+                # Keep the permissions of the file being replaced
+                os.chmod(tmp_file, os.stat(self._db_file).st_mode & 0o7777)
+            except OSError:
+                pass
+            _replace(tmp_file, self._db_file)
+        except BaseException:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            raise
+        if self._fsync == "full":
+            _fsync_dir(self._db_file)
+        self._base_hash = fp.hexdigest() if hashed else None
+        if self._journal_file is not None:
+            try:
+                os.remove(self._journal_file)
+            except OSError:
+                pass
+            self._journal_hasher = None
+            self._journal_ops = 0
+            self._journal_ok = True
+
+    def _gauges(self):
+        gauges = super(MutableJSONStore, self)._gauges()
+        gauges["pending_patches"] = sum(
+                op is not None for op in self._patches)
+        gauges["batched_changes"] = 0 if self._batch is None else len(self._batch)
+        gauges["journal_ops"] = self._journal_ops
+        return gauges
+
+    def _clear_patches(self):
+        """ Drop all pending patches """
+        if self._batch:
+            # Changes put off inside batch are dropped too
+            self._batch = {}
+        # Operations that are cancelled by later changes are replaced by None,
+        # so that the positions of the others stay the same
+        self._patches = []
+        # The pending operations for each cell, by row then column index. Each
+        # holds the remote data that the cell started with and the positions
+        # of its operations in _patches
+        self._cell_patches = {}
+        # The position in _patches of the operation adding each row that isn't
+        # on disk yet
+        self._row_patches = {}
+
+    def _pending_patches(self):
+        """ Get the list of pending patch operations """
+        self._flush_batch()
+        return [op for op in self._patches if op is not None]
+
+    def _add_patches(self, ops):
+        """ Add operations to the pending patches, returns their positions """
+        start = len(self._patches)
+        self._patches += ops
+        return range(start, len(self._patches) )
+
+    def _replace_patches(self, positions, ops):
+        """ Replace the pending operations at the given positions with new
+            ones, returns the positions now held
+
+            The old positions are reused so that repeated changes don't grow
+            the list, any that aren't needed are cancelled but kept for later
+        """
+        positions = list(positions)
+        n_reused = min(len(positions), len(ops) )
+        for pos, op in zip(positions, ops):
+            self._patches[pos] = op
+        self._cancel_patches(positions[n_reused:])
+        return positions + list(self._add_patches(ops[n_reused:]) )
+
+    def _cancel_patches(self, positions):
+        """ Cancel the pending operations at the given positions """
+        for pos in positions:
+            self._patches[pos] = None
+
+    def _row_path(self, row_idx):
+        """ Get the JSON pointer to a row """
+        return "/" + _escape_pointer(
+                self._index_column.write_func(row_idx, "JSON") )
+
+    def _add_row_patch(self, row_idx):
+        """ Record the addition of a row """
+        self._flush_batch()
+        self._cell_patches.pop(row_idx, None)
+        self._row_patches[row_idx] = self._add_patches([{
+            "op": "add", "path": self._add_path(row_idx),
+            "value": self._row_to_remote(self._data[row_idx], "JSON")}])[0]
+
+    def _add_path(self, row_idx):
+        """ Get the path at which a row is added """
+        return self._row_path(row_idx)
+
+    def _set_patch(self, row_idx, col_idx, old_value):
+        """ Record the change of a cell which previously held old_value
+
+            Only the remote data written by that cell's column is compared.
+            Changes to the same cell are merged together, and changes to rows
+            that are still to be added are folded into the operation adding
+            them. A cell that is set back to the value it started with still
+            replaces what is on disk, as another process may have changed it in
+            the meantime.
         """
-        # First, attempt to update the local store
-        self.update()
-        # Only get here if the file doesn't already exist
-        with open(self._db_file, 'w') as fp:
-            json.dump(self.to_dict("JSON"), fp, **kwargs)
+        try:
+            pos = self._row_patches[row_idx]
+        except KeyError:
+            pass
+        else:
+            # Replaced rather than changed, as a savepoint may hold the old one
+            self._patches[pos] = dict(
+                    self._patches[pos],
+                    value=self._remote_from_tuple(self._row(row_idx), "JSON") )
+            return
+        column = self._columns[col_idx]
+        cells = self._cell_patches.setdefault(row_idx, {})
+        try:
+            before, positions = cells[col_idx]
+        except KeyError:
+            before, positions = {}, ()
+            column.write_to(old_value, before, "JSON")
+        after = {}
+        column.write_to(self._row(row_idx)[col_idx], after, "JSON")
+        prefix = self._row_path(row_idx)
+        ops = []
+        for op in jsonpatch.make_patch(before, after):
+            op = dict(op, path=prefix + op["path"])
+            if "from" in op:
+                op["from"] = prefix + op["from"]
+            ops.append(op)
+        if not ops and positions:
+            ops = [{"op": "replace", "path": prefix + "/" + _escape_pointer(key),
+                    "value": value}
+                   for key, value in sorted(iteritems(after) )]
+        cells[col_idx] = (before, self._replace_patches(positions, ops) )
 
     def __setitem__(self, idx_pair, value):
         # Get the current value
         row_idx, col_idx = idx_pair
-        before = self._remote_from_tuple(
-                self._data[row_idx], "JSON")
+        old_value = self._row(row_idx)[col_idx]
         super(MutableJSONStore, self).__setitem__(idx_pair, value)
-        # Use make_patch to patch the value, and prepend the path to each
-        # operation
-        after = self._remote_from_tuple(
-                self._data[row_idx], "JSON")
-        path = self._index_column.write_func(row_idx, "JSON")
-        self._patches += [{
-            "op": o["op"], "value" : o["value"],
-            "path": "/{0}{1}".format(path, o["path"])}
-            for o in jsonpatch.make_patch(before, after)]
-        if self._up_on_change:
-            self.update()
+        if self._batch is None:
+            self._set_patch(row_idx, col_idx, old_value)
+        elif idx_pair not in self._batch:
+            self._batch[idx_pair] = old_value
+        self._changed()
 
 class JSONSeqStore(JSONStore, TupleSeqStore):
     pass
 
 class MutableJSONSeqStore(MutableJSONStore, MutableTupleSeqStore):
+    def _add_path(self, row_idx):
+        return "/-"
+
+    def _delete_patches(self, deleted):
+        """ Record the removal of the rows with the given sorted indices
+
+            This has to be called while the rows are still there. The rows are
+            removed from the highest index down so that each path is still
+            valid when it is applied. Rows that were never written are just
+            dropped from the pending additions.
+        """
+        self._flush_batch()
+        patches = []
+        for idx in reversed(deleted):
+            try:
+                pos = self._row_patches.pop(idx)
+            except KeyError:
+                pass
+            else:
+                self._cancel_patches([pos])
+                continue
+            # The patch here first checks that the thing we're about to remove
+            # is what we *expect* to remove. The reason to do this is make
+            # *very* sure that we're removing the right thing
+            patches.append({
+                "op": "test", "path": "/{0}".format(idx),
+                "value": self._row_to_remote(self._data[idx], "JSON")})
+            # Then the one that removes it
+            patches.append({"op": "remove", "path": "/{0}".format(idx)})
+        self._add_patches(patches)
+        # Everything after the first deleted row moves, so the paths of
+        # pending changes to their cells can't be merged with new ones any more
+        shift = BulkIndexShift(deleted, len(self._data) )
+        self._row_patches = {
+                shift.get(idx, idx): pos
+                for idx, pos in iteritems(self._row_patches)}
+        self._cell_patches = {
+                idx: cells for idx, cells in iteritems(self._cell_patches)
+                if idx < deleted[0]}
+
     def __delitem__(self, idx):
+        # The patches have to be made while the row is still there
+        if idx < 0:
+            idx += len(self._data)
+        self._delete_patches([idx])
         super(MutableJSONSeqStore, self).__delitem__(idx)
-        # The patch here first checks that the thing we're about to remove is
-        # what we *expect* to remove. The reason to do this is make *very* sure
-        # that we're removing the right thing
-        # Convert the index if necessary
-        if self.is_associative:
-            idx = self._index_column.write_func(idx, "JSON")
-        self._patches.append({
-            "op": "test", "path": "/{0}".format(idx),
-            "value": self._remote_from_tuple(
-                self._data[idx], "JSON")})
-        # Then the one that removes it
-        self._patches.append({"op": "remove", "path": "/"+idx})
-        if self._up_on_change:
-            self.update()
+        self._changed()
+
+    def _compact(self, deleted):
+        self._delete_patches(deleted)
+        super(MutableJSONSeqStore, self)._compact(deleted)
+
+    def delete_many(self, row_indices):
+        super(MutableJSONSeqStore, self).delete_many(row_indices)
+        self._changed()
 
     def append(self, row_data):
         super(MutableJSONSeqStore, self).append(row_data)
-        self._patches.append({
-            "op": "add", "path": "/-",
-            "value": self._remote_from_tuple(
-                self._data[-1], "JSON")})
-        if self._up_on_change:
-            self.update()
+        self._add_row_patch(len(self._data) - 1)
+        self._changed()
+
+    def extend(self, rows_data):
+        start = len(self._data)
+        super(MutableJSONSeqStore, self).extend(rows_data)
+        for row_idx in range(start, len(self._data) ):
+            self._add_row_patch(row_idx)
+        self._changed()
                
 
 class JSONAssocStore(JSONStore, TupleAssocStore):
@@ -154,17 +795,28 @@ class JSONAssocStore(JSONStore, TupleAssocStore):
 
 class MutableJSONAssocStore(MutableJSONStore, MutableTupleAssocStore):
     def __delitem__(self, idx):
+        self._flush_batch()
         super(MutableJSONAssocStore, self).__delitem__(idx)
-        idx = self._index_column.write_func(idx, "JSON")
-        self._patches.append({"op": "remove", "path" : "/"+idx})
-        if self._up_on_change:
-            self.update()
+        # Pending changes to the row are superseded by its removal
+        for _, positions in itervalues(self._cell_patches.pop(idx, {}) ):
+            self._cancel_patches(positions)
+        try:
+            pos = self._row_patches.pop(idx)
+        except KeyError:
+            self._add_patches([{"op": "remove", "path": self._row_path(idx)}])
+        else:
+            # The row was never written
+            self._cancel_patches([pos])
+        self._changed()
 
     def add(self, index, row_data):
         super(MutableJSONAssocStore, self).add(index, row_data)
-        write_index = self._index_column.write_func(index, "JSON")
-        self._patches.append({
-            "op": "add", "path": "/{0}".format(write_index), 
-            "value": self._remote_from_tuple(self._data[index], "JSON")})
-        if self._up_on_change:
-            self.update()
+        self._add_row_patch(index)
+        self._changed()
+
+    def add_many(self, items):
+        items = list(items)
+        super(MutableJSONAssocStore, self).add_many(items)
+        for index, _ in items:
+            self._add_row_patch(index)
+        self._changed()
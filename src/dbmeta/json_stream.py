@@ -0,0 +1,148 @@
+""" Incremental reading of large JSON documents
+
+    json.load reads and decodes a whole document at once. For a database file
+    that is a list (sequential) or an object (associative) of rows, that means
+    the whole decoded document has to be held in memory alongside whatever the
+    store converts it into. The functions here instead read the file in chunks
+    and decode one row at a time, so only the row currently being converted is
+    held in its decoded form.
+
+    Each row is decoded by the standard library's JSONDecoder, so apart from
+    the top level the results are identical to json.load.
+"""
+import json
+import re
+
+#: Characters that can follow a JSON value
+_delimiter = re.compile(r"[\s,\]}:]")
+
+class _ChunkReader(object):
+    """ Buffer over a file object that decodes one JSON value at a time """
+
+    def __init__(self, fp, chunk_size):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        """ Read more data into the buffer, returns False at the end of file """
+        if self._eof:
+            return False
+        chunk = self._fp.read(size or self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # Drop anything already consumed before growing the buffer
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        self._buf += chunk
+        return True
+
+    def peek(self):
+        """ Skip whitespace and return the next character ('' at the end) """
+        while True:
+            buf = self._buf
+            pos = self._pos
+            while pos < len(buf) and buf[pos] in " \t\n\r":
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars):
+        """ Consume the next non-whitespace character, which must be in chars """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                    "Expected one of '{0}' but found '{1}'".format(chars, char) )
+        self._pos += 1
+        return char
+
+    def decode(self):
+        """ Decode the next JSON value """
+        if self.peek() not in '"[{':
+            # A number (or literal) at the end of the buffer may have been cut
+            # short and still decode, so make sure that its end is buffered
+            while (_delimiter.search(self._buf, self._pos) is None
+                    and self._fill() ):
+                pass
+        size = self._chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                # Most likely the value is incomplete, read more and try again.
+                # The amount read doubles each time so that very large values
+                # aren't decoded too many times
+                if not self._fill(size):
+                    raise
+                size *= 2
+                continue
+            self._pos = end
+            return value
+
+def iter_json_array(fp, chunk_size=1 << 16):
+    """ Iterate over the elements of a JSON array read from a file object """
+    reader = _ChunkReader(fp, chunk_size)
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.decode()
+        if reader.expect(",]") == "]":
+            return
+
+def iter_json_object(fp, chunk_size=1 << 16):
+    """ Iterate over the (key, value) pairs of a JSON object read from a file
+        object
+    """
+    reader = _ChunkReader(fp, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        if reader.peek() != '"':
+            raise ValueError("Expected an object key")
+        key = reader.decode()
+        reader.expect(":")
+        yield key, reader.decode()
+        if reader.expect(",}") == "}":
+            return
+
+def iter_json_rows(fp, chunk_size=1 << 16):
+    """ Iterate over the rows in a JSON database file
+
+        If the top level of the file is an array its elements are returned, if
+        it is an object then its (key, value) pairs are
+    """
+    reader = _ChunkReader(fp, chunk_size)
+    first = reader.peek()
+    # Hand the buffered data over to the right iterator
+    if first == "[":
+        itr = iter_json_array
+    elif first == "{":
+        itr = iter_json_object
+    else:
+        raise ValueError("JSON database must be an array or an object")
+    return itr(_Prefixed(reader), chunk_size)
+
+class _Prefixed(object):
+    """ File-like object that returns the data left in a reader's buffer before
+        continuing with its file
+    """
+
+    def __init__(self, reader):
+        self._prefix = reader._buf[reader._pos:]
+        self._fp = reader._fp
+
+    def read(self, size):
+        if self._prefix:
+            data, self._prefix = self._prefix, ""
+            return data
+        return self._fp.read(size)
@@ -0,0 +1,252 @@
+""" Sharing databases between threads
+
+    None of the stores are safe to use from several threads at once by
+    themselves. thread_safe creates a version of a store class whose methods
+    are guarded by a reader/writer lock, so any number of threads can read
+    from it at the same time while changes are made by one thread at a time.
+    The plain store classes are left as they are, so there is no cost unless
+    this is asked for.
+
+    >>> store = thread_safe(MutableJSONSeqStore)(db=db, db_file="db.json")
+
+    A database using such a store also holds the lock while it keeps its own
+    bookkeeping (secondary indexes and live rows) up to date. Each call into
+    the store or database is atomic, several changes can be made without any
+    other thread seeing the state in between them inside its locked context
+
+    >>> with db.locked():
+    >>>     row.x += 1
+    >>>     row.y -= 1
+
+    Iterators handed back by a locked store are taken from a snapshot of its
+    data, so they can safely be used while other threads make changes.
+"""
+from builtins import object
+from functools import wraps
+import threading
+try:
+    from threading import get_ident
+except ImportError:
+    from thread import get_ident
+
+class _Holder(object):
+    """ Context manager calling an acquire and release function """
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._release()
+
+#: Context manager that does nothing, used in place of a lock
+null_lock = _Holder(lambda: None, lambda: None)
+
+class RWLock(object):
+    """ Reader/writer lock
+
+        Any number of threads can hold the read lock together, or one thread
+        can hold the write lock. Threads waiting for the write lock have
+        priority over new readers so that writers are not starved.
+
+        Both locks are reentrant and the thread holding the write lock can
+        also take the read lock. A thread holding only the read lock cannot
+        take the write lock, as two threads doing so would deadlock, and
+        trying raises a RuntimeError.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock() )
+        # The number of times each reading thread holds the read lock
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._reading = _Holder(self.acquire_read, self.release_read)
+        self._writing = _Holder(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        """ Acquire the read lock, blocking while another thread writes """
+        me = get_ident()
+        with self._cond:
+            if me not in self._readers and self._writer != me:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self):
+        """ Release the read lock """
+        me = get_ident()
+        with self._cond:
+            depth = self._readers[me] - 1
+            if depth:
+                self._readers[me] = depth
+            else:
+                del self._readers[me]
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        """ Acquire the write lock, blocking while any other thread holds
+            either lock
+        """
+        me = get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError(
+                        "Cannot take the write lock while holding the read lock")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        """ Release the write lock """
+        with self._cond:
+            if self._writer != get_ident():
+                raise RuntimeError("Write lock released by a thread not holding it")
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    def reading(self):
+        """ Context manager holding the read lock """
+        return self._reading
+
+    def writing(self):
+        """ Context manager holding the write lock """
+        return self._writing
+
+def _shared(method):
+    """ Wrap a store method so that it holds the read lock """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock.reading():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _snapshot(method):
+    """ Wrap a store method returning an iterator so that it holds the read
+        lock while the iterator is exhausted into a list
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock.reading():
+            return iter(list(method(self, *args, **kwargs) ) )
+    return wrapper
+
+def _copied(method):
+    """ Wrap a store method returning a sequence so that it holds the read
+        lock while the sequence is copied
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock.reading():
+            return method(self, *args, **kwargs)[:]
+    return wrapper
+
+def _exclusive(method):
+    """ Wrap a store method so that it holds the write lock """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock.writing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+#: The store methods to lock and how to wrap them
+_store_methods = {
+        "__getitem__": _shared,
+        "__len__": _shared,
+        "__contains__": _shared,
+        "to_remote": _shared,
+        "to_dict": _shared,
+        "select_indices": _shared,
+        "__iter__": _snapshot,
+        "iter_column": _snapshot,
+        "column_values": _copied,
+        "__setitem__": _exclusive,
+        "__delitem__": _exclusive,
+        "append": _exclusive,
+        "extend": _exclusive,
+        "add": _exclusive,
+        "add_many": _exclusive,
+        "delete_many": _exclusive,
+        "from_remote": _exclusive,
+        "from_dict": _exclusive,
+        "update": _exclusive,
+        "write": _exclusive,
+        "close": _exclusive,
+        }
+
+#: The thread safe versions of each store class that have been made
+_thread_safe_classes = {}
+
+def thread_safe(store_cls):
+    """ Get a version of a store class that can be shared between threads
+
+        The returned class derives from store_cls and is created with the same
+        arguments. Each of its methods reading data holds the read lock and
+        each changing data holds the write lock of a RWLock kept in the _lock
+        attribute.
+    """
+    if any(issubclass(store_cls, c) for c in _thread_safe_classes.values() ):
+        # Already thread safe
+        return store_cls
+    try:
+        return _thread_safe_classes[store_cls]
+    except KeyError:
+        pass
+    dct = {"__doc__": "Thread safe version of {0}\n\n{1}".format(
+        store_cls.__name__, store_cls.__doc__ or "")}
+    for name, wrap in _store_methods.items():
+        method = getattr(store_cls, name, None)
+        if method is None or getattr(method, "__isabstractmethod__", False):
+            continue
+        dct[name] = wrap(method)
+
+    def __init__(self, *args, **kwargs):
+        # The lock has to exist before the store starts loading its data
+        self._lock = RWLock()
+        store_cls.__init__(self, *args, **kwargs)
+    dct["__init__"] = __init__
+    cls = _thread_safe_classes[store_cls] = type(
+            "ThreadSafe" + store_cls.__name__, (store_cls,), dct)
+    return cls
+
+def synchronised(cls, names):
+    """ Make a subclass of cls whose named methods hold a mutex
+
+        This is used for the database's own bookkeeping structures, which do
+        not need separate readers and writers. The mutex is reentrant, as weak
+        reference callbacks can run in the middle of other methods.
+    """
+    dct = {}
+    for name in names:
+        method = getattr(cls, name)
+        def wrap(method):
+            @wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self._mutex:
+                    return method(self, *args, **kwargs)
+            return wrapper
+        dct[name] = wrap(method)
+
+    def __init__(self, *args, **kwargs):
+        self._mutex = threading.RLock()
+        cls.__init__(self, *args, **kwargs)
+    dct["__init__"] = __init__
+    dct["__doc__"] = "Version of {0} that can be shared between threads".format(
+            cls.__name__)
+    return type("Synchronised" + cls.__name__, (cls,), dct)
@@ -0,0 +1,223 @@
+""" Counting and timing what stores and databases do
+
+    None of the stores record anything by themselves. instrumented creates a
+    version of a store class that counts its reads and writes and times its
+    slow operations into a Metrics object, in the same way that thread_safe
+    (see the locking module) adds a lock. The plain store classes are left as
+    they are, so there is no cost unless this is asked for.
+
+    >>> metrics = Metrics(sinks=[logging_sink()])
+    >>> store = instrumented(MutableJSONSeqStore)(
+    >>>     db=db, db_file="db.json", metrics=metrics)
+
+    A database using such a store also counts the rows that it makes, and its
+    stats method gives a snapshot of everything recorded so far along with the
+    current state of the store
+
+    >>> db.stats()
+    {'counters': {'cell_reads': 120, 'rows_built': 12, ...},
+     'timers': {'write': {'count': 1, 'total': 0.01, 'max': 0.01}, ...},
+     'gauges': {'rows': 12, 'pending_patches': 0, ...}}
+
+    The counters are
+    - cell_reads, cell_writes: single values read from or written to the store
+    - column_reads: whole columns read from the store at once (e.g. for
+      aggregations), iterating over a column is not counted
+    - rows_added, rows_deleted: rows added to or deleted from the store
+    - patches_queued: JSON patch operations added to the queue of changes
+      (JSON stores)
+    - bytes_read, bytes_written: read from or written to files (JSON stores)
+    - rows_built: Row objects made by the database
+    - selects, transactions, rollbacks: calls made on the database
+    and the timers are load (filling the store from remote data), update,
+    write and index_build.
+
+    Every value recorded is also passed to each of the sinks, which are called
+    as sink(kind, name, value) with kind either 'counter' or 'timer'.
+"""
+from builtins import object
+from functools import wraps
+from timeit import default_timer
+from contextlib import contextmanager
+import logging
+import threading
+
+class Metrics(object):
+    """ Counters and timers, along with the sinks they are reported to """
+
+    def __init__(self, sinks=() ):
+        self._mutex = threading.Lock()
+        self._sinks = list(sinks)
+        self._counters = {}
+        # The number of times, total and longest time of each timer
+        self._timers = {}
+
+    def add_sink(self, sink):
+        """ Report everything recorded from now on to a sink """
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        """ Stop reporting to a sink """
+        self._sinks.remove(sink)
+
+    def count(self, name, n=1):
+        """ Add to a counter """
+        with self._mutex:
+            self._counters[name] = self._counters.get(name, 0) + n
+        for sink in self._sinks:
+            sink("counter", name, n)
+
+    def record(self, name, seconds):
+        """ Record a time taken """
+        with self._mutex:
+            timer = self._timers.get(name)
+            if timer is None:
+                self._timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+        for sink in self._sinks:
+            sink("timer", name, seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """ Context manager recording the time taken inside it """
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.record(name, default_timer() - start)
+
+    def snapshot(self):
+        """ Get a dict of the 'counters' and 'timers' recorded so far
+
+            Each timer is a dict of its 'count', 'total' and 'max' times
+        """
+        with self._mutex:
+            return {
+                    "counters": dict(self._counters),
+                    "timers": {
+                        name: {"count": n, "total": total, "max": longest}
+                        for name, (n, total, longest) in self._timers.items()}}
+
+    def reset(self):
+        """ Set all counters and timers back to zero """
+        with self._mutex:
+            self._counters = {}
+            self._timers = {}
+
+def logging_sink(logger=None, level=logging.DEBUG):
+    """ Make a sink writing everything recorded to a logger
+
+        By default this is the logger for this module
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    def sink(kind, name, value):
+        logger.log(level, "%s %s: %s", kind, name, value)
+    return sink
+
+def _counted(name, items_arg=None):
+    """ Wrap a method so that each call adds to a counter
+
+        If items_arg is given then that positional argument is an iterable and
+        the counter is increased by its length, otherwise by one
+    """
+    def wrap(method):
+        if items_arg is None:
+            @wraps(method)
+            def wrapper(self, *args, **kwargs):
+                result = method(self, *args, **kwargs)
+                self._metrics.count(name)
+                return result
+        else:
+            @wraps(method)
+            def wrapper(self, *args, **kwargs):
+                args = list(args)
+                items = args[items_arg] = list(args[items_arg])
+                result = method(self, *args, **kwargs)
+                self._metrics.count(name, len(items) )
+                return result
+        return wrapper
+    return wrap
+
+def _timed(name):
+    """ Wrap a method so that each call is timed """
+    def wrap(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._metrics.timer(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return wrap
+
+#: The store methods to instrument and how to wrap them
+_store_methods = {
+        "__getitem__": _counted("cell_reads"),
+        "__setitem__": _counted("cell_writes"),
+        "column_values": _counted("column_reads"),
+        "append": _counted("rows_added"),
+        "add": _counted("rows_added"),
+        "extend": _counted("rows_added", items_arg=0),
+        "add_many": _counted("rows_added", items_arg=0),
+        "__delitem__": _counted("rows_deleted"),
+        "delete_many": _counted("rows_deleted", items_arg=0),
+        "_add_patches": _counted("patches_queued", items_arg=0),
+        "from_dict": _timed("load"),
+        "update": _timed("update"),
+        "write": _timed("write"),
+        }
+
+#: The row registry methods to instrument, a row adds itself to its
+#: database's registry when it is made
+_registry_methods = {"append": _counted("rows_built")}
+
+#: The instrumented versions of each class that have been made
+_instrumented_classes = {}
+
+def _instrumented(cls, methods):
+    """ Get a version of a class whose methods record into a Metrics object
+
+        The returned class is created with the same arguments as cls, plus an
+        optional metrics keyword argument. If this is not given then a new
+        Metrics object is made. It is held in the _metrics attribute.
+    """
+    if any(issubclass(cls, c) for c in _instrumented_classes.values() ):
+        # Already instrumented
+        return cls
+    try:
+        return _instrumented_classes[cls]
+    except KeyError:
+        pass
+    dct = {"__doc__": "Instrumented version of {0}\n\n{1}".format(
+        cls.__name__, cls.__doc__ or "")}
+    for name, wrap in methods.items():
+        method = getattr(cls, name, None)
+        if method is None or getattr(method, "__isabstractmethod__", False):
+            continue
+        dct[name] = wrap(method)
+
+    def __init__(self, *args, **kwargs):
+        # Metrics have to exist before the store starts loading its data
+        metrics = kwargs.pop("metrics", None)
+        self._metrics = Metrics() if metrics is None else metrics
+        cls.__init__(self, *args, **kwargs)
+    dct["__init__"] = __init__
+    new_cls = _instrumented_classes[cls] = type(
+            "Instrumented" + cls.__name__, (cls,), dct)
+    return new_cls
+
+def instrumented(store_cls):
+    """ Get a version of a store class that records metrics
+
+        The returned class derives from store_cls and is created with the same
+        arguments, plus an optional metrics keyword argument giving the Metrics
+        object to record into. If this is not given a new one is made. It can
+        be combined with thread_safe.
+    """
+    return _instrumented(store_cls, _store_methods)
+
+def instrumented_registry(registry_cls):
+    """ Get a version of a row registry class that counts the rows built """
+    return _instrumented(registry_cls, _registry_methods)
@@ -0,0 +1,391 @@
+""" Read-only stores served straight from a memory-mapped binary file
+
+    Opening one of these stores only reads a small header, every value is
+    decoded from the mapped file when it is asked for. As the file is mapped
+    read-only, any number of processes opening the same file share one copy of
+    it in the page cache.
+
+    The file is written from an existing store by write_mmap. The values held
+    are those of the store itself (i.e. after the read_func conversions) and
+    each column is laid out in one of these forms, chosen from its values
+    - int: fixed-width 64 bit integers
+    - float: fixed-width doubles
+    - bool: one byte per value
+    - str, bytes: the UTF-8 encoded (for str) values one after another in a
+      heap, with an array of offsets into it
+    - json: as str, holding the JSON encoding of each value. This is used for
+      anything else, which therefore has to be JSON serialisable. If the
+      column holds tuples but no lists then its JSON arrays are read back as
+      tuples, so that tuple indices can still be looked up
+    If a column holds any None values then a bitmap marks which these are.
+
+    Each section starts at a multiple of 8 bytes. The file ends with the
+    header (JSON describing the layout), then the length of the header as an
+    unsigned 64 bit integer and then the magic bytes. Fixed-width values are
+    written in the byte order of the machine writing them, files written on a
+    machine with a different byte order can't be read.
+
+    The rows of associative stores are written sorted by their index where
+    possible, so that indices can be found by a binary search.
+"""
+from builtins import object, range
+from future.utils import PY3, integer_types, text_type
+from .store import Store, SeqStore, AssocStore
+from array import array
+import abc
+import bisect
+import json
+import mmap
+import struct
+import sys
+if PY3:
+    from collections.abc import Sequence
+else:
+    from collections import Sequence
+
+#: The bytes that end every file
+_magic = b"DBMMAP01"
+
+#: The struct codes of the fixed-width kinds
+_fixed_codes = {"int": "q", "float": "d", "bool": "?"}
+
+#: The fixed-width kinds that can be copied straight into an array
+_array_kinds = ("int", "float")
+
+#: The range of values held by an int column
+_int_range = (-(1 << 63), (1 << 63) - 1)
+
+def _column_kind(values):
+    """ Choose the layout for a column's values """
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, bool) for v in present):
+        return "bool"
+    if all(isinstance(v, integer_types) and not isinstance(v, bool) and
+           _int_range[0] <= v <= _int_range[1] for v in present):
+        return "int"
+    if all(isinstance(v, float) for v in present):
+        return "float"
+    if all(isinstance(v, text_type) for v in present):
+        return "str"
+    if all(isinstance(v, bytes) for v in present):
+        return "bytes"
+    return "json"
+
+def _holds(value, cls):
+    """ Whether a value is, or contains, an instance of cls """
+    if isinstance(value, cls):
+        return True
+    if isinstance(value, (tuple, list) ):
+        return any(_holds(v, cls) for v in value)
+    if isinstance(value, dict):
+        return any(_holds(v, cls) for v in value.values() )
+    return False
+
+def _as_tuples(value):
+    """ Convert the arrays in a decoded JSON value to tuples """
+    if isinstance(value, list):
+        return tuple(_as_tuples(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _as_tuples(v) for (k, v) in value.items()}
+    return value
+
+def _encode(kind, value):
+    """ Encode a value for the heap of a column """
+    if kind == "str":
+        return value.encode("utf-8")
+    elif kind == "bytes":
+        return value
+    return json.dumps(value).encode("utf-8")
+
+class _Writer(object):
+    """ Writes the sections of a file, keeping track of the position """
+
+    def __init__(self, fp):
+        self._fp = fp
+        self._pos = 0
+
+    def write(self, data):
+        """ Write a section, returns its offset """
+        pad = -self._pos % 8
+        if pad:
+            self._fp.write(b"\0" * pad)
+            self._pos += pad
+        offset = self._pos
+        self._fp.write(data)
+        self._pos += len(data)
+        return offset
+
+    def write_column(self, values):
+        """ Write the sections for a column, returns its description """
+        kind = _column_kind(values)
+        spec = {"kind": kind, "nulls": None}
+        if any(v is None for v in values):
+            bitmap = bytearray((len(values) + 7) // 8)
+            for idx, v in enumerate(values):
+                if v is None:
+                    bitmap[idx >> 3] |= 1 << (idx & 7)
+            spec["nulls"] = self.write(bytes(bitmap) )
+        if kind in _fixed_codes:
+            placeholder = False if kind == "bool" else 0
+            values = [placeholder if v is None else v for v in values]
+            spec["offset"] = self.write(struct.pack(
+                "={0}{1}".format(len(values), _fixed_codes[kind]), *values) )
+            return spec
+        if kind == "json":
+            spec["tuples"] = (
+                    any(_holds(v, tuple) for v in values) and
+                    not any(_holds(v, list) for v in values) )
+        offsets = [0]
+        chunks = []
+        for v in values:
+            chunk = b"" if v is None else _encode(kind, v)
+            chunks.append(chunk)
+            offsets.append(offsets[-1] + len(chunk) )
+        spec["offset"] = self.write(struct.pack(
+            "={0}Q".format(len(offsets) ), *offsets) )
+        spec["heap"] = self.write(b"".join(chunks) )
+        return spec
+
+def write_mmap(db_file, store):
+    """ Write the contents of a store to a file that can be opened by an
+        MmapSeqStore or MmapAssocStore
+
+        The store's values are read a whole column at a time
+    """
+    n_rows = len(store)
+    order = None
+    keys = None
+    if store.is_associative:
+        keys = list(store)
+        try:
+            order = sorted(range(n_rows), key=keys.__getitem__)
+        except TypeError:
+            # The indices can't be compared, so they will need a hash table
+            pass
+        else:
+            keys = [keys[idx] for idx in order]
+    header = {
+            "n_rows": n_rows,
+            "byteorder": sys.byteorder,
+            "columns": {},
+            "keys": None,
+            "sorted_keys": order is not None}
+    with open(db_file, 'wb') as fp:
+        writer = _Writer(fp)
+        for c in store._columns:
+            values = list(store.iter_column(c.index) )
+            if order is not None:
+                values = [values[idx] for idx in order]
+            header["columns"][c.name] = writer.write_column(values)
+        if keys is not None:
+            header["keys"] = writer.write_column(keys)
+        # The header goes straight before its size at the end of the file
+        data = json.dumps(header).encode("utf-8")
+        writer.write(data)
+        fp.write(struct.pack("<Q", len(data) ) )
+        fp.write(_magic)
+
+class _ColumnReader(Sequence):
+    """ Decodes the values of one column from the mapped file """
+
+    def __init__(self, mm, spec, n_rows):
+        self._mm = mm
+        self._kind = spec["kind"]
+        self._nulls = spec["nulls"]
+        self._offset = spec["offset"]
+        self._heap = spec.get("heap")
+        self._tuples = spec.get("tuples", False)
+        self._n_rows = n_rows
+        self._code = _fixed_codes.get(self._kind)
+        if self._code is not None:
+            self._size = struct.calcsize("=" + self._code)
+
+    def __len__(self):
+        return self._n_rows
+
+    def _is_null(self, idx):
+        if self._nulls is None:
+            return False
+        byte = struct.unpack_from("B", self._mm, self._nulls + (idx >> 3) )[0]
+        return bool(byte & (1 << (idx & 7) ) )
+
+    def _decode(self, data):
+        """ Decode a value from the heap """
+        if self._kind == "str":
+            return data.decode("utf-8")
+        elif self._kind == "bytes":
+            return data
+        value = json.loads(data.decode("utf-8") )
+        return _as_tuples(value) if self._tuples else value
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._n_rows) )]
+        if idx < 0:
+            idx += self._n_rows
+        if not 0 <= idx < self._n_rows:
+            raise IndexError("Row index out of range")
+        if self._is_null(idx):
+            return None
+        if self._code is not None:
+            return struct.unpack_from(
+                    "=" + self._code, self._mm,
+                    self._offset + idx * self._size)[0]
+        start, stop = struct.unpack_from("=2Q", self._mm, self._offset + idx * 8)
+        return self._decode(self._mm[self._heap + start:self._heap + stop])
+
+    def _fixed_values(self):
+        """ All values of a fixed-width column, without their nulls
+
+            The values are copied out of the file, so nothing refers to the
+            mapping once they are returned and the store can still be closed
+        """
+        if PY3 and self._kind in _array_kinds:
+            end = self._offset + self._n_rows * self._size
+            values = array(self._code)
+            with memoryview(self._mm) as view:
+                values.frombytes(view[self._offset:end])
+            return values
+        return struct.unpack_from(
+                "={0}{1}".format(self._n_rows, self._code), self._mm,
+                self._offset)
+
+    def values(self):
+        """ Get all values of the column as a sequence
+
+            Fixed-width columns without None values are copied out of the file
+            in one go
+        """
+        if self._code is not None and self._nulls is None:
+            return self._fixed_values()
+        return list(self)
+
+    def __iter__(self):
+        if self._code is not None:
+            values = self._fixed_values()
+            if self._nulls is None:
+                return iter(values)
+            return (
+                    None if self._is_null(idx) else v
+                    for (idx, v) in enumerate(values) )
+        return self._iter_heap()
+
+    def _iter_heap(self):
+        offsets = struct.unpack_from(
+                "={0}Q".format(self._n_rows + 1), self._mm, self._offset)
+        heap = self._heap
+        for idx in range(self._n_rows):
+            if self._is_null(idx):
+                yield None
+            else:
+                yield self._decode(
+                        self._mm[heap + offsets[idx]:heap + offsets[idx + 1]])
+
+class MmapStore(Store):
+    """ Read-only store that decodes its data from a memory-mapped file as it
+        is needed
+    """
+
+    def __init__(self, db_file, **kwargs):
+        """ Create the store
+
+            db_file should have been written by write_mmap
+        """
+        super(MmapStore, self).__init__(**kwargs)
+        with open(db_file, 'rb') as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        tail = len(_magic) + 8
+        if len(self._mmap) < tail or self._mmap[-len(_magic):] != _magic:
+            raise ValueError(
+                    "{0} is not a memory-mapped database file".format(db_file) )
+        header_size = struct.unpack_from("<Q", self._mmap, len(self._mmap) - tail)[0]
+        start = len(self._mmap) - tail - header_size
+        header = json.loads(
+                self._mmap[start:start + header_size].decode("utf-8") )
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(
+                    "{0} was written with a different byte order".format(db_file) )
+        self._n_rows = header["n_rows"]
+        missing = [c.name for c in self._columns if c.name not in header["columns"]]
+        if missing:
+            raise ValueError("{0} does not hold the columns {1}".format(
+                db_file, ", ".join(missing) ) )
+        self._readers = [
+                _ColumnReader(self._mmap, header["columns"][c.name], self._n_rows)
+                for c in self._columns]
+        self._header = header
+
+    def close(self):
+        """ Unmap the file """
+        self._mmap.close()
+
+    @abc.abstractmethod
+    def _position(self, row_idx):
+        """ Get the position in the file of a row """
+        pass
+
+    def __getitem__(self, idx_pair):
+        row_idx, col_idx = idx_pair
+        return self._readers[col_idx][self._position(row_idx)]
+
+    def iter_column(self, col_idx):
+        return iter(self._readers[col_idx])
+
+    def column_values(self, col_idx):
+        return self._readers[col_idx].values()
+
+    def __len__(self):
+        return self._n_rows
+
+class MmapSeqStore(MmapStore, SeqStore):
+    """ Read-only sequential store served from a memory-mapped file """
+
+    def _position(self, row_idx):
+        return row_idx
+
+class MmapAssocStore(MmapStore, AssocStore):
+    """ Read-only associative store served from a memory-mapped file
+
+        If the indices were written in sorted order they are found by a binary
+        search of the file, otherwise a dict of index to position is built the
+        first time that one is looked up.
+    """
+
+    def __init__(self, **kwargs):
+        super(MmapAssocStore, self).__init__(**kwargs)
+        if self._header["keys"] is None:
+            raise ValueError("File does not hold an associative store")
+        self._keys = _ColumnReader(
+                self._mmap, self._header["keys"], self._n_rows)
+        self._sorted = self._header["sorted_keys"]
+        self._positions = None
+
+    def _find(self, row_idx):
+        """ Get the position of a row, None if it isn't there """
+        if self._sorted:
+            try:
+                pos = bisect.bisect_left(self._keys, row_idx)
+            except TypeError:
+                return None
+            if pos < self._n_rows and self._keys[pos] == row_idx:
+                return pos
+            return None
+        try:
+            if self._positions is None:
+                self._positions = {
+                        k: pos for (pos, k) in enumerate(self._keys)}
+            return self._positions.get(row_idx)
+        except TypeError:
+            return None
+
+    def _position(self, row_idx):
+        pos = self._find(row_idx)
+        if pos is None:
+            raise KeyError(row_idx)
+        return pos
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __contains__(self, row_idx):
+        return self._find(row_idx) is not None
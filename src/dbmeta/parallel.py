@@ -0,0 +1,130 @@
+""" Evaluating selections and functions over several processes
+
+    Selections and CollMonad calculations are normally evaluated one element at
+    a time in a single process. For CPU heavy predicates or functions on large
+    databases the work can instead be split into chunks which are evaluated by
+    a process pool
+
+    >>> db.select( (db.energy > 10) & (db.name != "x"), workers=8)
+    >>> ItrMonad.apply_parallel(expensive, db.energy, workers=8)
+
+    An existing concurrent.futures executor can be passed instead of a number
+    of workers. Everything sent to the workers has to be picklable, so
+    functions must be defined at module level. Query expressions are sent as
+    their compiled source along with the raw values of the columns that they
+    read, rather than as rows. The results are always returned in order.
+
+    This needs concurrent.futures, which on python 2 is provided by the
+    'futures' backport.
+"""
+from builtins import map, range
+from contextlib import contextmanager
+from itertools import compress, islice
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+#: The number of chunks given to each worker, more allow the work to be shared
+#: out more evenly
+chunks_per_worker = 4
+
+def require_futures():
+    """ Raise an ImportError if concurrent.futures is not available """
+    if ProcessPoolExecutor is None:
+        raise ImportError(
+                "concurrent.futures (the 'futures' package on python 2) is "
+                "required for parallel evaluation")
+
+@contextmanager
+def executor_for(workers=None, executor=None):
+    """ Context manager giving the executor to use
+
+        If no executor is provided then a ProcessPoolExecutor with the given
+        number of workers is created, and shut down on exit
+    """
+    if executor is not None:
+        yield executor
+        return
+    require_futures()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield pool
+
+def _chunk_size(n_items, executor):
+    """ Choose the number of items in each chunk """
+    # _max_workers is not part of the public interface, but is held by both
+    # of the standard executors
+    n_workers = getattr(executor, "_max_workers", None) or 1
+    return max(1, -(-n_items // (n_workers * chunks_per_worker) ) )
+
+def _as_chunk(values):
+    """ Make a slice of column values picklable """
+    if isinstance(values, memoryview):
+        return values.tolist()
+    return values
+
+def _select_chunk(source, constants, start, columns):
+    """ Evaluate a predicate on a chunk of column values
+
+        Returns the positions (counted from start) of the values for which the
+        predicate is True
+    """
+    # Imported here to avoid a circular import
+    from .query import compile_source
+    predicate = compile_source(source, constants)
+    return list(compress(
+        range(start, start + len(columns[0]) ), map(predicate, *columns) ) )
+
+def select_positions(db, source, constants, columns, executor, chunk_size=None):
+    """ Find the positions of the rows for which a compiled predicate is True,
+        evaluated in chunks by an executor
+
+        source and constants are as returned by query.predicate_source, columns
+        are the columns that it reads. Returns the positions in order.
+    """
+    n_rows = len(db)
+    if not columns:
+        # The predicate is a constant
+        from .query import compile_source
+        return list(range(n_rows) ) if compile_source(source, constants)() else []
+    values = [c.values(db) for c in columns]
+    if chunk_size is None:
+        chunk_size = _chunk_size(n_rows, executor)
+    starts = range(0, n_rows, chunk_size)
+    futures = [
+            executor.submit(
+                _select_chunk, source, constants, start,
+                [_as_chunk(v[start:start + chunk_size]) for v in values])
+            for start in starts]
+    positions = []
+    for future in futures:
+        positions += future.result()
+    return positions
+
+def _apply_chunk(func, arg_tuples):
+    """ Call a function on each tuple of arguments in a chunk
+
+        The last element of each tuple holds the keyword arguments
+    """
+    return [func(*args[:-1], **args[-1]) for args in arg_tuples]
+
+def apply_chunks(func, arg_tuples, executor, chunk_size=None):
+    """ Call a function on each of the argument tuples, evaluated in chunks by
+        an executor
+
+        Returns the list of results in order
+    """
+    if chunk_size is None:
+        arg_tuples = list(arg_tuples)
+        chunk_size = _chunk_size(len(arg_tuples), executor)
+    itr = iter(arg_tuples)
+    futures = []
+    while True:
+        chunk = list(islice(itr, chunk_size) )
+        if not chunk:
+            break
+        futures.append(executor.submit(_apply_chunk, func, chunk) )
+    results = []
+    for future in futures:
+        results += future.result()
+    return results
@@ -0,0 +1,555 @@
+""" Lazy query expressions over database columns
+
+    Reading a column from a database returns a ColumnMonad. This behaves exactly
+    like an ItrMonad over the column's values, but comparing it to a single
+    value produces a Comparison rather than evaluating anything. Comparisons
+    can be combined with &, |, ~ (or the CollMonad and_, or_, all and any
+    functions) into a tree of Expr nodes, still without evaluating anything.
+
+    Iterating over an expression gives the elementwise result as normal. In
+    that case the whole tree is first compiled into a single predicate
+    function, which is then mapped over the columns that it reads, rather than
+    stacking one generator per operation.
+
+    The database's select function also understands expressions. It resolves
+    whichever comparisons it can through the indexes of the database, and then
+    only evaluates the compiled remainder on the rows that those select.
+
+    >>> sel = (db.name == "x") & (db.energy > 10)
+    >>> db.select(sel)
+
+    The Selection that select returns can be sorted and limited before any of
+    its rows are made
+
+    >>> db.select(sel).order_by(db.energy, descending=True).limit(10)
+"""
+from .coll_monad import CollMonad, ItrMonad
+from .array_monad import ArrayMonad
+from .aggregate import aggregate, _resolve_column
+from .parallel import select_positions
+from builtins import map, range
+from future.utils import PY3
+from functools import partial
+from itertools import compress, islice
+import abc
+import heapq
+import operator
+if PY3:
+    from collections.abc import Iterator
+else:
+    from collections import Iterator
+
+def _contains(x, y):
+    """ Elementwise 'x in y' """
+    return x in y
+
+#: The functions corresponding to each named comparison
+comparison_ops = {
+        "eq": operator.eq,
+        "ne": operator.ne,
+        "lt": operator.lt,
+        "le": operator.le,
+        "gt": operator.gt,
+        "ge": operator.ge,
+        "in": _contains,
+        }
+
+#: The python operators for each named comparison, used when compiling
+_op_source = {
+        "eq": "==",
+        "ne": "!=",
+        "lt": "<",
+        "le": "<=",
+        "gt": ">",
+        "ge": ">=",
+        "in": "in",
+        }
+
+#: The order in which to evaluate the terms of an And. Equality tends to be the
+#: most selective and ne the least, anything more complicated goes last
+_op_rank = {"eq": 0, "in": 1, "lt": 2, "le": 2, "gt": 2, "ge": 2, "ne": 3}
+
+class QueryMonad(ItrMonad):
+    """ Base class for the monads here
+
+        These carry extra information about where their values came from, so
+        the results of applying any further functions to them are plain
+        ItrMonads
+    """
+
+    @classmethod
+    def apply(cls, func, *args, **kwargs):
+        return ItrMonad.apply(func, *args, **kwargs)
+
+class ColumnMonad(QueryMonad):
+    """ ItrMonad over the values of a column in a database
+
+        The aggregation methods (sum, min, max, mean, count and distinct) act
+        on the whole column, however much of this has been iterated over.
+        These names are therefore not forwarded to the values like other
+        attributes are.
+    """
+
+    def __init__(self, db, column):
+        super(ColumnMonad, self).__init__(column.iter_values(db) )
+        self._db = db
+        self._column = column
+
+    @property
+    def database(self):
+        """ The database that the column is read from """
+        return self._db
+
+    @property
+    def column(self):
+        """ The column that this reads """
+        return self._column
+
+    def as_array(self, dtype=None):
+        """ Read the column into an ArrayMonad for vectorised evaluation
+
+            Requires NumPy
+        """
+        return ArrayMonad(self._column.as_array(self._db, dtype) )
+
+    def sum(self):
+        """ The sum of the values in the column """
+        return aggregate(self._db, self._column, "sum")
+
+    def min(self):
+        """ The smallest value in the column """
+        return aggregate(self._db, self._column, "min")
+
+    def max(self):
+        """ The largest value in the column """
+        return aggregate(self._db, self._column, "max")
+
+    def mean(self):
+        """ The mean of the values in the column """
+        return aggregate(self._db, self._column, "mean")
+
+    def count(self):
+        """ The number of values in the column """
+        return aggregate(self._db, self._column, "count")
+
+    def distinct(self):
+        """ A list of the distinct values in the column """
+        return aggregate(self._db, self._column, "distinct")
+
+    def _compare(self, op, other):
+        """ Make the comparison 'self op other'
+
+            Comparisons to other iterators are done elementwise as normal
+        """
+        if isinstance(other, (CollMonad, Iterator) ):
+            return self.call(comparison_ops[op], other)
+        return Comparison(self._db, self._column, op, other)
+
+    def _contained_in(self, rhs, cls):
+        if issubclass(Comparison, cls):
+            return self._compare("in", rhs)
+        return super(ColumnMonad, self)._contained_in(rhs, cls)
+
+    def __eq__(self, other):
+        return self._compare("eq", other)
+
+    def __ne__(self, other):
+        return self._compare("ne", other)
+
+    def __gt__(self, other):
+        return self._compare("gt", other)
+
+    def __ge__(self, other):
+        return self._compare("ge", other)
+
+    def __le__(self, other):
+        return self._compare("le", other)
+
+    def __lt__(self, other):
+        return self._compare("lt", other)
+
+class Expr(QueryMonad):
+    """ Base class for query expression nodes
+
+        Nothing is evaluated until the expression is iterated over
+    """
+
+    def __init__(self, db):
+        super(Expr, self).__init__(self._lazy_evaluate() )
+        self._db = db
+
+    @property
+    def database(self):
+        """ The database that the expression reads from """
+        return self._db
+
+    def _lazy_evaluate(self):
+        """ Generator that only evaluates the expression once it is needed """
+        for x in self._evaluate():
+            yield x
+
+    def _evaluate(self):
+        """ Evaluate the expression for every row, in the order of the rows """
+        predicate, columns = compile_predicate(self)
+        return map(predicate, *[c.iter_values(self._db) for c in columns])
+
+    def _can_combine(self, others):
+        """ Whether the others can be combined with this into a new node """
+        return all(
+                isinstance(o, Expr) and o.database is self._db for o in others)
+
+    def _combined_with(self, kind, others, cls):
+        if issubclass(And, cls) and self._can_combine(others):
+            if kind in ("and_", "all"):
+                return And(self, *others)
+            else:
+                return Or(self, *others)
+        return super(Expr, self)._combined_with(kind, others, cls)
+
+    def __and__(self, other):
+        if self._can_combine((other,) ):
+            return And(self, other)
+        return super(Expr, self).__and__(other)
+
+    def __or__(self, other):
+        if self._can_combine((other,) ):
+            return Or(self, other)
+        return super(Expr, self).__or__(other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def rank(self):
+        """ Estimate of how expensive this is to evaluate, relative to others """
+        return len(_op_rank)
+
+    def lookup(self):
+        """ Find the store indices of the rows for which this is True using the
+            database's indexes
+
+            Returns None if this is not possible
+        """
+        return None
+
+    @abc.abstractmethod
+    def source(self, columns, constants):
+        """ Python source for this expression
+
+            columns is a list of the columns read so far, if this reads a column
+            not in it then it should be added. The value of the nth column will
+            be available as the variable v{n}. constants is a list of values
+            referred to by the expression, the nth will be available as c{n}.
+        """
+        pass
+
+class Comparison(Expr):
+    """ The comparison of a column to a single value """
+
+    def __init__(self, db, column, op, value):
+        super(Comparison, self).__init__(db)
+        self._column = column
+        self._op = op
+        self._value = value
+
+    @property
+    def column(self):
+        """ The column being compared """
+        return self._column
+
+    @property
+    def op(self):
+        """ The name of the comparison operation """
+        return self._op
+
+    @property
+    def value(self):
+        """ The value that the column is compared to """
+        return self._value
+
+    def rank(self):
+        return _op_rank[self._op]
+
+    def lookup(self):
+        return self._db._lookup(self._column, self._op, self._value)
+
+    def source(self, columns, constants):
+        try:
+            v_idx = columns.index(self._column)
+        except ValueError:
+            v_idx = len(columns)
+            columns.append(self._column)
+        constants.append(self._value)
+        return "(v{0} {1} c{2})".format(
+                v_idx, _op_source[self._op], len(constants) - 1)
+
+class And(Expr):
+    """ True where all of its terms are True """
+
+    def __init__(self, *terms):
+        super(And, self).__init__(terms[0].database)
+        # Flatten nested nodes of the same type
+        self._terms = []
+        for term in terms:
+            if isinstance(term, And):
+                self._terms += term.terms
+            else:
+                self._terms.append(term)
+
+    @property
+    def terms(self):
+        """ The expressions combined by this """
+        return list(self._terms)
+
+    def lookup(self):
+        # Every term that can use an index cuts down the candidates, the
+        # intersection is built up starting from the smallest
+        found = [idx for idx in (t.lookup() for t in self._terms) if idx is not None]
+        if len(found) != len(self._terms):
+            return None
+        return _intersect(found)
+
+    def source(self, columns, constants):
+        terms = sorted(self._terms, key=lambda t: t.rank() )
+        return "({0})".format(" and ".join(
+            t.source(columns, constants) for t in terms) )
+
+class Or(Expr):
+    """ True where any of its terms are True """
+
+    def __init__(self, *terms):
+        super(Or, self).__init__(terms[0].database)
+        self._terms = []
+        for term in terms:
+            if isinstance(term, Or):
+                self._terms += term.terms
+            else:
+                self._terms.append(term)
+
+    @property
+    def terms(self):
+        """ The expressions combined by this """
+        return list(self._terms)
+
+    def lookup(self):
+        result = set()
+        for term in self._terms:
+            idx = term.lookup()
+            if idx is None:
+                return None
+            result.update(idx)
+        return result
+
+    def source(self, columns, constants):
+        terms = sorted(self._terms, key=lambda t: t.rank() )
+        return "({0})".format(" or ".join(
+            t.source(columns, constants) for t in terms) )
+
+class Not(Expr):
+    """ True where its term is False """
+
+    def __init__(self, term):
+        super(Not, self).__init__(term.database)
+        self._term = term
+
+    @property
+    def term(self):
+        """ The negated expression """
+        return self._term
+
+    def source(self, columns, constants):
+        return "(not {0})".format(self._term.source(columns, constants) )
+
+class Selection(QueryMonad):
+    """ ItrMonad over the rows selected from a database
+
+        The rows are only made as they are iterated over. Until then the
+        selection can be sorted and cut down by order_by and limit, which work
+        on the values held in the store, so that only the rows that are
+        returned are ever made.
+    """
+
+    def __init__(self, db, indices=None, ordered=False):
+        """ Create the selection
+
+            indices are the store indices of the selected rows, or None to
+            select all of them. ordered should be set if they are in the order
+            of the rows.
+        """
+        super(Selection, self).__init__(self._lazy_rows() )
+        self._db = db
+        self._indices = indices
+        self._ordered = ordered
+        self._order = None
+        self._limit = None
+
+    @property
+    def database(self):
+        """ The database that the rows are selected from """
+        return self._db
+
+    def _lazy_rows(self):
+        """ Generator that only finds the rows once they are needed """
+        for row in self._db._rows_from_indices(self._final_indices(), True):
+            yield row
+
+    def _derived(self):
+        """ Make a new selection of the same rows """
+        if self._order is None and self._limit is None:
+            return Selection(self._db, self._indices, self._ordered)
+        # Fix the current order so that it is kept by anything done to the
+        # new selection
+        return Selection(self._db, list(self._final_indices() ), True)
+
+    def order_by(self, column, descending=False):
+        """ Sort the selection by the values of a column
+
+            The column can be read from the database (e.g. db.energy) or be
+            given by name. A sorted index on the column is used if there is
+            one. Otherwise the sort is stable, so sorting by one column and
+            then another orders rows with equal values of the second by the
+            first.
+
+            Returns a new Selection
+        """
+        sel = self._derived()
+        sel._order = (_resolve_column(self._db, column), descending)
+        return sel
+
+    def limit(self, n_rows):
+        """ Keep at most the first n_rows rows
+
+            Following order_by this finds the top n_rows rows with a heap
+            rather than sorting the whole selection.
+
+            Returns a new Selection
+        """
+        if n_rows < 0:
+            raise ValueError("Cannot limit to {0} rows".format(n_rows) )
+        sel = Selection(self._db, self._indices, self._ordered)
+        sel._order = self._order
+        sel._limit = n_rows if self._limit is None else min(n_rows, self._limit)
+        return sel
+
+    def _final_indices(self):
+        """ Get the store indices of the rows to return, in order """
+        db = self._db
+        indices = self._indices
+        limit = self._limit
+        if self._order is None:
+            if indices is None:
+                indices = range(len(db) ) if db.is_sequential else iter(db._store)
+            elif db.is_sequential and not self._ordered:
+                indices = sorted(indices)
+            return indices if limit is None else islice(indices, limit)
+        column, descending = self._order
+        by_index = db._ordered_indices(column, descending)
+        if by_index is not None:
+            if indices is not None:
+                chosen = set(indices)
+                by_index = (idx for idx in by_index if idx in chosen)
+            return list(by_index if limit is None else islice(by_index, limit) )
+        indices = list(db._store if indices is None else indices)
+        key = _sort_key(db, column, indices)
+        if limit is None:
+            return sorted(indices, key=key, reverse=descending)
+        top = heapq.nlargest if descending else heapq.nsmallest
+        return top(limit, indices, key=key)
+
+def _sort_key(db, column, indices):
+    """ Get a function giving the value of a column from a store index
+
+        indices are the store indices that it will be called on. If these are
+        a large part of a sequential database then the whole column is read at
+        once.
+    """
+    if db.is_sequential and len(indices) * 4 > len(db):
+        return column.values(db).__getitem__
+    return partial(column.get, db)
+
+def _intersect(found):
+    """ Intersect several lists of store indices
+
+        The result is in the order of the shortest list
+    """
+    found = sorted(found, key=len)
+    if len(found) == 1:
+        return found[0]
+    others = set(found[1])
+    for idx in found[2:]:
+        others.intersection_update(idx)
+    return [idx for idx in found[0] if idx in others]
+
+def predicate_source(expr):
+    """ Get the source of the function made by compile_predicate
+
+        Returns the source, the list of constants that it refers to and the
+        list of columns that it reads. Unlike the function itself these can be
+        pickled, as long as the constants can.
+    """
+    columns = []
+    constants = []
+    body = expr.source(columns, constants)
+    args = ", ".join("v{0}".format(i) for i in range(len(columns) ) )
+    return "lambda {0}: {1}".format(args, body), constants, columns
+
+def compile_source(source, constants):
+    """ Compile the source returned by predicate_source into a function """
+    namespace = {"c{0}".format(i): c for (i, c) in enumerate(constants)}
+    return eval(source, namespace)
+
+def compile_predicate(expr):
+    """ Compile an expression into a single function
+
+        Returns the function and the list of columns that it reads. The
+        function takes the value of each column in a row as positional arguments
+        and returns whether the expression is True for that row.
+    """
+    source, constants, columns = predicate_source(expr)
+    return compile_source(source, constants), columns
+
+def select_indices(expr, executor=None):
+    """ Find the store indices of the rows selected by an expression
+
+        The store is given the chance to evaluate the expression itself first.
+        Otherwise the terms of the expression that can be resolved through the
+        database's indexes are used to find a set of candidate rows and the
+        remaining terms are only evaluated on those. If no index can be used the
+        whole compiled expression is evaluated over all the rows, split between
+        the workers of executor if one is given (see the parallel module).
+
+        Returns the indices and whether or not they are in the order of the
+        rows
+    """
+    db = expr.database
+    pushed = db._store.select_indices(expr)
+    if pushed is not None:
+        return pushed
+    terms = expr.terms if isinstance(expr, And) else [expr]
+    found = []
+    residual = []
+    for term in terms:
+        idx = term.lookup()
+        if idx is None:
+            residual.append(term)
+        else:
+            found.append(idx)
+    if not found and executor is not None:
+        source, constants, columns = predicate_source(expr)
+        positions = select_positions(db, source, constants, columns, executor)
+        if db.is_sequential:
+            return positions, True
+        keys = list(db._store)
+        return [keys[p] for p in positions], True
+    if not found:
+        predicate, columns = compile_predicate(expr)
+        return compress(
+                iter(db._store),
+                map(predicate, *[c.iter_values(db) for c in columns]) ), True
+    candidates = _intersect(found)
+    if residual:
+        predicate, columns = compile_predicate(
+                residual[0] if len(residual) == 1 else And(*residual) )
+        candidates = [
+                idx for idx in candidates
+                if predicate(*[c.get(db, idx) for c in columns])]
+    return candidates, False
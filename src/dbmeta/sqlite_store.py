@@ -0,0 +1,523 @@
+""" Store classes that hold their data in an SQLite database
+
+    The rows of a database are held in a table (named after the database class
+    by default) with one SQL column per database column. Each SQL column is
+    named by its column's key for the 'SQLite' store type and the values are
+    converted with the column's read_func and write_func for that store type.
+    Values that SQLite cannot hold directly (lists, dicts, etc.) therefore
+    need a write_func (and matching read_func) that converts them.
+
+    Nothing is loaded up front: getting or setting a value is a single query
+    on its row. The only thing held in memory is, for sequential stores, the
+    rowid of each row and, for associative stores, the number of rows.
+
+    Selections made with query expressions (see the query module) are
+    translated into the WHERE clause of a query as far as possible and only
+    the rest is evaluated in python, on the rows that the query returns. This
+    is only possible for comparisons on columns whose values are held in SQLite
+    exactly as they are compared, i.e. columns without a type conversion or
+    their own read_func/write_func.
+
+    Changes are made inside a transaction, which is committed by write.
+"""
+from builtins import range, str, zip
+from future.utils import PY3, iteritems, integer_types, string_types
+from .store import (
+        Store, SeqStore, AssocStore, MutableSeqStore, MutableAssocStore,
+        compact)
+from .column import (
+        IndexColumn, identity, read_identity, write_identity,
+        index_read_identity, index_write_identity)
+from .query import Comparison, And, Or, Not, compile_predicate
+from .index import is_collection
+from array import array
+import abc
+import bisect
+import sqlite3
+if PY3:
+    from collections.abc import Mapping
+else:
+    from collections import Mapping
+
+#: The name of the store type used when converting values
+store_type = "SQLite"
+
+#: The SQL operators for each named comparison
+_sql_ops = {"eq": "=", "lt": "<", "le": "<=", "gt": ">", "ge": ">="}
+
+#: Types of value that SQLite compares in the same way as python
+_sql_types = integer_types + (float, bytes) + string_types
+
+try:
+    _rowid_typecode = "q"
+    array(_rowid_typecode)
+except ValueError:
+    _rowid_typecode = "l"
+
+def _quote(name):
+    """ Quote an SQL identifier """
+    return '"{0}"'.format(str(name).replace('"', '""') )
+
+class SQLiteStore(Store):
+    """ Store that holds its data in an SQLite table """
+
+    def __init__(self, db_file, table=None, **kwargs):
+        """ Create the store
+
+            Parameters:
+                db_file: The SQLite database file (':memory:' for an in-memory
+                         database)
+                table: The name of the table holding the rows, by default the
+                       name of the database class
+        """
+        super(SQLiteStore, self).__init__(**kwargs)
+        # A thread safe store (see locking.thread_safe) serialises its own use
+        # of the connection
+        self._conn = sqlite3.connect(
+                db_file, check_same_thread=self._lock is None)
+        if table is None:
+            table = type(self._db).__name__
+        self._table_name = table
+        self._table = _quote(table)
+        self._keys = [c.key(store_type) for c in self._columns]
+        self._sql_columns = [_quote(k) for k in self._keys]
+        if self.is_mutable:
+            self._create_table()
+
+    def _key_definitions(self):
+        """ The definitions of any SQL columns identifying the rows """
+        return []
+
+    def _create_table(self):
+        """ Create the table (and indexes on indexed columns) if needed """
+        self._conn.execute("CREATE TABLE IF NOT EXISTS {0} ({1})".format(
+            self._table,
+            ", ".join(self._key_definitions() + self._sql_columns) ) )
+        for c, key in zip(self._columns, self._keys):
+            if c.index_cls is not None:
+                self._conn.execute(
+                        "CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})".format(
+                            _quote("{0}_{1}".format(self._table_name, key) ),
+                            self._table, _quote(key) ) )
+
+    def write(self):
+        """ Commit all changes made so far """
+        self._conn.commit()
+
+    def close(self):
+        """ Close the connection, any uncommitted changes are lost """
+        self._conn.close()
+
+    def _read_cell(self, col_idx, value):
+        """ Convert an SQL value into the stored value of a column """
+        return self._columns[col_idx].read_from(
+                {self._keys[col_idx]: value}, store_type)
+
+    def _write_cell(self, col_idx, value):
+        """ Convert the stored value of a column into an SQL value """
+        data = {}
+        self._columns[col_idx].write_to(value, data, store_type)
+        return data.get(self._keys[col_idx])
+
+    def _row_to_sql(self, tup):
+        """ Convert a stored row into a list of SQL values """
+        data = self._remote_from_tuple(tup, store_type)
+        return [data.get(k) for k in self._keys]
+
+    def _row_from_sql(self, record):
+        """ Convert a list of SQL values into a stored row """
+        return self._remote_to_tuple(dict(zip(self._keys, record) ), store_type)
+
+    @property
+    @abc.abstractmethod
+    def _row_sql(self):
+        """ The SQL column identifying a row """
+        pass
+
+    @abc.abstractmethod
+    def _row_param(self, row_idx):
+        """ The value of _row_sql for a row """
+        pass
+
+    @abc.abstractmethod
+    def _record_index(self, value):
+        """ Get the row index from a value of _row_sql """
+        pass
+
+    def __getitem__(self, idx_pair):
+        row_idx, col_idx = idx_pair
+        record = self._conn.execute(
+                "SELECT {0} FROM {1} WHERE {2} = ?".format(
+                    self._sql_columns[col_idx], self._table, self._row_sql),
+                (self._row_param(row_idx),) ).fetchone()
+        if record is None:
+            raise KeyError(row_idx)
+        return self._read_cell(col_idx, record[0])
+
+    def iter_column(self, col_idx):
+        cursor = self._conn.execute("SELECT {0} FROM {1} ORDER BY rowid".format(
+            self._sql_columns[col_idx], self._table) )
+        if self._columns[col_idx]._desc.read_func is read_identity:
+            return (record[0] for record in cursor)
+        return (self._read_cell(col_idx, record[0]) for record in cursor)
+
+    def _iter_rows(self):
+        """ Iterate over (row identifier, stored row) pairs in order """
+        cursor = self._conn.execute("SELECT {0}, {1} FROM {2} ORDER BY rowid".format(
+            self._row_sql, ", ".join(self._sql_columns), self._table) )
+        return ((record[0], self._row_from_sql(record[1:]) ) for record in cursor)
+
+    def _sql_column(self, column):
+        """ Get the SQL column whose values are exactly those compared for a
+            database column, or None if there isn't one
+        """
+        if isinstance(column, IndexColumn):
+            return None
+        desc = column._desc
+        if (column.type is not identity or
+                desc.read_func is not read_identity or
+                desc.write_func is not write_identity):
+            return None
+        return self._sql_columns[column.index]
+
+    def _where(self, expr):
+        """ Translate a query expression into an SQL condition
+
+            Returns the condition and its parameters, or None if the expression
+            cannot be translated
+        """
+        if isinstance(expr, Comparison):
+            return self._where_comparison(expr)
+        elif isinstance(expr, (And, Or) ):
+            parts = [self._where(t) for t in expr.terms]
+            if any(p is None for p in parts):
+                return None
+            joiner = " AND " if isinstance(expr, And) else " OR "
+            return (
+                    "({0})".format(joiner.join(p[0] for p in parts) ),
+                    [param for p in parts for param in p[1]])
+        elif isinstance(expr, Not):
+            part = self._where(expr.term)
+            if part is None:
+                return None
+            # A NULL result is False in python, so has to stay False here
+            return "(NOT coalesce({0}, 0))".format(part[0]), part[1]
+        return None
+
+    def _where_comparison(self, expr):
+        """ Translate a single comparison into an SQL condition """
+        sql_col = self._sql_column(expr.column)
+        if sql_col is None:
+            return None
+        op, value = expr.op, expr.value
+        if op == "in":
+            if not is_collection(value):
+                return None
+            values = list(value)
+            present = [v for v in values if v is not None]
+            if not all(isinstance(v, _sql_types) for v in present):
+                return None
+            parts = []
+            if present:
+                parts.append("{0} IN ({1})".format(
+                    sql_col, ", ".join("?" for _ in present) ) )
+            if len(present) != len(values):
+                parts.append("{0} IS NULL".format(sql_col) )
+            if not parts:
+                return "0", []
+            return "({0})".format(" OR ".join(parts) ), present
+        if value is None:
+            if op == "eq":
+                return "({0} IS NULL)".format(sql_col), []
+            elif op == "ne":
+                return "({0} IS NOT NULL)".format(sql_col), []
+            return None
+        if not isinstance(value, _sql_types):
+            return None
+        if op == "ne":
+            # NULL != value is True in python
+            return "({0} != ? OR {0} IS NULL)".format(sql_col), [value]
+        return "({0} {1} ?)".format(sql_col, _sql_ops[op]), [value]
+
+    def select_indices(self, expr):
+        """ Select rows with a query, see Store.select_indices
+
+            The terms of the expression that can be translated make up the
+            WHERE clause and the others are compiled into a predicate that is
+            applied to the rows that the query returns.
+        """
+        terms = expr.terms if isinstance(expr, And) else [expr]
+        clauses = []
+        params = []
+        residual = []
+        for term in terms:
+            where = self._where(term)
+            if where is None:
+                residual.append(term)
+            else:
+                clauses.append(where[0])
+                params += where[1]
+        if not clauses:
+            return None
+        if residual:
+            predicate, columns = compile_predicate(
+                    residual[0] if len(residual) == 1 else And(*residual) )
+        else:
+            predicate, columns = None, []
+        # Read the values needed by the predicate along with the rows
+        read = [c for c in columns if not isinstance(c, IndexColumn)]
+        cursor = self._conn.execute(
+                "SELECT {0} FROM {1} WHERE {2} ORDER BY rowid".format(
+                    ", ".join([self._row_sql] +
+                              [self._sql_columns[c.index] for c in read]),
+                    self._table, " AND ".join(clauses) ),
+                params)
+        if predicate is None:
+            return [self._record_index(record[0]) for record in cursor], True
+        positions = {c.name: pos for (pos, c) in enumerate(read, 1)}
+        indices = []
+        for record in cursor:
+            row_idx = self._record_index(record[0])
+            args = [
+                    c.get(self._db, row_idx) if isinstance(c, IndexColumn)
+                    else c.type(self._read_cell(c.index, record[positions[c.name]]) )
+                    for c in columns]
+            if predicate(*args):
+                indices.append(row_idx)
+        return indices, True
+
+class SQLiteSeqStore(SQLiteStore, SeqStore):
+    """ Sequential store that holds its data in an SQLite table
+
+        The rows are ordered by their rowids, which are kept in memory so that
+        row indices can be translated into them
+    """
+    def __init__(self, **kwargs):
+        """ Create the store """
+        self._rowids = array(_rowid_typecode)
+        super(SQLiteSeqStore, self).__init__(**kwargs)
+        self._load_rowids()
+
+    def _load_rowids(self):
+        """ Read the rowids of all rows from the table """
+        self._rowids = array(_rowid_typecode, (
+            record[0] for record in self._conn.execute(
+                "SELECT rowid FROM {0} ORDER BY rowid".format(self._table) ) ) )
+
+    def update(self):
+        """ Pick up rows added or removed through other connections
+
+            This will almost certainly mess up any referenced rows
+        """
+        self._load_rowids()
+        self._db._reset_indices()
+
+    @property
+    def _row_sql(self):
+        return "rowid"
+
+    def _row_param(self, row_idx):
+        return self._rowids[row_idx]
+
+    def _record_index(self, value):
+        return bisect.bisect_left(self._rowids, value)
+
+    def to_remote(self, store_type):
+        """ Convert the table to a tuple of dicts """
+        encode = self._encoder(store_type)
+        return tuple(encode(t) for (_, t) in self._iter_rows() )
+
+    def to_dict(self, store_type):
+        """ Sequential stores give their remote data as a sequence """
+        return self.to_remote(store_type)
+
+    def __len__(self):
+        return len(self._rowids)
+
+class MutableSQLiteSeqStore(SQLiteSeqStore, MutableSeqStore):
+    """ Mutable sequential store that holds its data in an SQLite table """
+
+    @property
+    def _insert(self):
+        """ The statement inserting a row """
+        return "INSERT INTO {0} ({1}) VALUES ({2})".format(
+                self._table, ", ".join(self._sql_columns),
+                ", ".join("?" for _ in self._sql_columns) )
+
+    def from_remote(self, data, store_type):
+        """ Replace the contents of the table with the supplied remote store
+            data
+        """
+        decode = self._decoder(store_type)
+        self._conn.execute("DELETE FROM {0}".format(self._table) )
+        self._conn.executemany(self._insert, (
+            self._row_to_sql(decode(d) ) for d in data) )
+        self._load_rowids()
+
+    def from_dict(self, data, store_type):
+        """ Sequential stores receive their remote data as a sequence """
+        self.from_remote(data, store_type)
+
+    def append(self, row_data):
+        cursor = self._conn.execute(
+                self._insert, self._row_to_sql(self._dict_to_tuple(row_data) ) )
+        self._rowids.append(cursor.lastrowid)
+
+    def extend(self, rows_data):
+        last = self._rowids[-1] if self._rowids else None
+        self._conn.executemany(self._insert, (
+            self._row_to_sql(t) for t in self._dicts_to_tuples(rows_data) ) )
+        # New rows always get higher rowids than any existing row
+        if last is None:
+            self._load_rowids()
+        else:
+            self._rowids.extend(record[0] for record in self._conn.execute(
+                "SELECT rowid FROM {0} WHERE rowid > ? ORDER BY rowid".format(
+                    self._table), (last,) ) )
+
+    def __setitem__(self, idx_pair, value):
+        row_idx, col_idx = idx_pair
+        self._conn.execute("UPDATE {0} SET {1} = ? WHERE rowid = ?".format(
+            self._table, self._sql_columns[col_idx]),
+            (self._write_cell(col_idx, value), self._rowids[row_idx]) )
+
+    def __delitem__(self, row_idx):
+        self._conn.execute(
+                "DELETE FROM {0} WHERE rowid = ?".format(self._table),
+                (self._rowids[row_idx],) )
+        del self._rowids[row_idx]
+        MutableSeqStore.__delitem__(self, row_idx)
+
+    def _compact(self, deleted):
+        self._conn.executemany(
+                "DELETE FROM {0} WHERE rowid = ?".format(self._table),
+                ((self._rowids[idx],) for idx in deleted) )
+        self._rowids = compact(self._rowids, deleted)
+
+class SQLiteAssocStore(SQLiteStore, AssocStore):
+    """ Associative store that holds its data in an SQLite table
+
+        The index of each row is held in an extra SQL column named after the
+        index column, which is the table's primary key. Rows are iterated over
+        in the order in which they were added.
+    """
+    def __init__(self, **kwargs):
+        """ Create the store """
+        super(SQLiteAssocStore, self).__init__(**kwargs)
+        self._load_len()
+
+    def _load_len(self):
+        """ Count the rows in the table """
+        self._len = self._conn.execute(
+                "SELECT COUNT(*) FROM {0}".format(self._table) ).fetchone()[0]
+
+    def update(self):
+        """ Pick up rows added or removed through other connections """
+        self._load_len()
+        self._db._reset_indices()
+
+    @property
+    def _row_sql(self):
+        return _quote(self._index_column.name)
+
+    def _key_definitions(self):
+        return ["{0} PRIMARY KEY".format(self._row_sql)]
+
+    def _row_param(self, row_idx):
+        return self._index_column.write_func(row_idx, store_type)
+
+    def _record_index(self, value):
+        return self._index_column.read_func(value, store_type)
+
+    def _sql_column(self, column):
+        if isinstance(column, IndexColumn):
+            if (column.type is not identity or
+                    column.read_func is not index_read_identity or
+                    column.write_func is not index_write_identity):
+                return None
+            return self._row_sql
+        return super(SQLiteAssocStore, self)._sql_column(column)
+
+    def to_dict(self, store_type):
+        """ Convert the table to a dict of dicts """
+        write_func = self._index_column.write_func
+        encode = self._encoder(store_type)
+        return {
+                write_func(self._record_index(key), store_type): encode(t)
+                for (key, t) in self._iter_rows()}
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        cursor = self._conn.execute("SELECT {0} FROM {1} ORDER BY rowid".format(
+            self._row_sql, self._table) )
+        return (self._record_index(record[0]) for record in cursor)
+
+    def __contains__(self, row_idx):
+        return self._conn.execute(
+                "SELECT 1 FROM {0} WHERE {1} = ?".format(
+                    self._table, self._row_sql),
+                (self._row_param(row_idx),) ).fetchone() is not None
+
+class MutableSQLiteAssocStore(SQLiteAssocStore, MutableAssocStore):
+    """ Mutable associative store that holds its data in an SQLite table """
+
+    @property
+    def _insert(self):
+        """ The statement inserting a row """
+        return "INSERT INTO {0} ({1}) VALUES ({2})".format(
+                self._table,
+                ", ".join([self._row_sql] + self._sql_columns),
+                ", ".join("?" for _ in range(len(self._sql_columns) + 1) ) )
+
+    def from_dict(self, data, store_type):
+        """ Replace the contents of the table with the supplied remote store
+            data
+
+            data can be a mapping or an iterable of (key, value) pairs
+        """
+        items = iteritems(data) if isinstance(data, Mapping) else data
+        read_func = self._index_column.read_func
+        decode = self._decoder(store_type)
+        self._conn.execute("DELETE FROM {0}".format(self._table) )
+        self._conn.executemany(self._insert, (
+            [self._row_param(read_func(k, store_type) )] +
+            self._row_to_sql(decode(v) )
+            for k, v in items) )
+        self._load_len()
+
+    def add(self, index, row_data):
+        if index in self:
+            raise KeyError(
+                    "Attempting to add pre-existing index {0}!".format(index) )
+        self._conn.execute(
+                self._insert,
+                [self._row_param(index)] +
+                self._row_to_sql(self._dict_to_tuple(row_data) ) )
+        self._len += 1
+
+    def add_many(self, items):
+        items = list(items)
+        self._check_new_indices(index for (index, _) in items)
+        self._conn.executemany(self._insert, (
+            [self._row_param(index)] + self._row_to_sql(t)
+            for (index, t) in zip(
+                (index for (index, _) in items),
+                self._dicts_to_tuples(row_data for (_, row_data) in items) ) ) )
+        self._len += len(items)
+
+    def __setitem__(self, idx_pair, value):
+        row_idx, col_idx = idx_pair
+        self._conn.execute("UPDATE {0} SET {1} = ? WHERE {2} = ?".format(
+            self._table, self._sql_columns[col_idx], self._row_sql),
+            (self._write_cell(col_idx, value), self._row_param(row_idx) ) )
+
+    def __delitem__(self, row_idx):
+        cursor = self._conn.execute(
+                "DELETE FROM {0} WHERE {1} = ?".format(
+                    self._table, self._row_sql),
+                (self._row_param(row_idx),) )
+        if cursor.rowcount == 0:
+            raise KeyError(row_idx)
+        self._len -= 1
@@ -19,14 +19,117 @@
     However, the index in an associative store holds meaningful information (and
     should uniquely identify the row). This store is most akin to a dict.
 """
-from builtins import object
+from builtins import object, range
 from future.utils import PY3, with_metaclass
 if PY3:
     from collections.abc import Sequence, Mapping
 else:
     from collections import Sequence, Mapping
+from contextlib import contextmanager
 import abc
+import bisect
 import json
+from operator import itemgetter
+from .column import read_identity
+from .locking import null_lock
+
+class IndexShift(Mapping):
+    """ Mapping that shifts every index in the range [start, stop) by offset
+
+        Used to describe the remapping of the row indices in a sequential store
+        without having to build an entry for every row that moves
+    """
+
+    def __init__(self, start, stop, offset):
+        self._range = range(start, stop)
+        self._offset = offset
+
+    def remap_all(self, indices):
+        """ Get a list of the given indices with each one in the mapping
+            replaced by its new index
+        """
+        start, stop, offset = self._range.start, self._range.stop, self._offset
+        return [idx + offset if start <= idx < stop else idx for idx in indices]
+
+    def __getitem__(self, idx):
+        if idx in self._range:
+            return idx + self._offset
+        raise KeyError(idx)
+
+    def __contains__(self, idx):
+        return idx in self._range
+
+    def __iter__(self):
+        return iter(self._range)
+
+    def __len__(self):
+        return len(self._range)
+
+class BulkIndexShift(Mapping):
+    """ Mapping describing the remapping of row indices after deleting several
+        rows from a sequential store
+
+        Each surviving row past the first deleted one moves down by the number
+        of deleted rows before it
+    """
+
+    def __init__(self, deleted, old_len):
+        """ Create the mapping
+
+            Parameters:
+                deleted: Sorted sequence of the deleted indices
+                old_len: The number of rows before the deletion
+        """
+        self._deleted = deleted
+        self._deleted_set = set(deleted)
+        self._old_len = old_len
+
+    def remap_all(self, indices):
+        """ Get a list of the given indices with each one in the mapping
+            replaced by its new index
+        """
+        deleted = self._deleted
+        if not deleted:
+            return list(indices)
+        contains = self.__contains__
+        left = bisect.bisect_left
+        return [idx - left(deleted, idx) if contains(idx) else idx
+                for idx in indices]
+
+    def __getitem__(self, idx):
+        if idx not in self:
+            raise KeyError(idx)
+        return idx - bisect.bisect_left(self._deleted, idx)
+
+    def __contains__(self, idx):
+        return bool(self._deleted) and (
+                self._deleted[0] < idx < self._old_len
+                and idx not in self._deleted_set)
+
+    def __iter__(self):
+        if not self._deleted:
+            return iter(() )
+        return (idx for idx in range(self._deleted[0] + 1, self._old_len)
+                if idx not in self._deleted_set)
+
+    def __len__(self):
+        if not self._deleted:
+            return 0
+        return self._old_len - self._deleted[0] - len(self._deleted)
+
+def compact(seq, deleted):
+    """ Copy a list or array, leaving out the positions in deleted
+
+        deleted must be sorted. The surviving stretches are copied as slices,
+        so this is a single pass over the data
+    """
+    out = seq[:0]
+    prev = 0
+    for idx in deleted:
+        out.extend(seq[prev:idx])
+        prev = idx + 1
+    out.extend(seq[prev:])
+    return out
 
 class Store(with_metaclass(abc.ABCMeta, object)):
     """ Base class for all store objects 
@@ -37,9 +140,64 @@ class Store(with_metaclass(abc.ABCMeta, object)):
         and then overridden with abstract methods in the mutable base classes
     """
 
+    #: The lock guarding the store's data. This is only set on the thread safe
+    #: store classes made by locking.thread_safe
+    _lock = None
+
+    #: The metrics that the store records into. This is only set on the
+    #: instrumented store classes made by metrics.instrumented
+    _metrics = None
+
     def __init__(self, db):
         self._db = db
 
+    def _count(self, name, n=1):
+        """ Add to a counter in the store's metrics, if it has any """
+        if self._metrics is not None:
+            self._metrics.count(name, n)
+
+    def _gauges(self):
+        """ Get a dict describing the current state of the store, reported by
+            the database's stats method
+        """
+        return {"rows": len(self)}
+
+    @contextmanager
+    def batch(self):
+        """ Context manager inside which the store may put off the work of
+            recording changes (beyond changing its data) until it exits
+
+            Stores that have such work should override this
+        """
+        yield
+
+    def savepoint(self):
+        """ Get a token describing the record the store keeps of its changes
+            (beyond its data, e.g. changes still to be written), which undoing
+            can go back to
+
+            The implementation here keeps no such record
+        """
+        return None
+
+    @contextmanager
+    def undoing(self, savepoint):
+        """ Context manager inside which all changes made since savepoint was
+            taken are undone, e.g. when rolling back a transaction
+
+            Stores whose record of their changes should go back to how it was
+            rather than record the undoing as more changes should override this
+        """
+        yield
+
+    def locked(self):
+        """ Context manager holding the store's write lock, if it has one
+
+            Several changes made inside this are seen by other threads all at
+            once
+        """
+        return null_lock if self._lock is None else self._lock.writing()
+
     @property
     def _columns(self):
         """ The columns in this store """
@@ -54,11 +212,83 @@ class Store(with_metaclass(abc.ABCMeta, object)):
         """
         return getattr(type(self._db), self._db._index_column)
 
+    def _dict_to_tuple(self, data):
+        """ Read a tuple from a dictionary """
+        return tuple(
+                read_identity(c.name, data, c._desc.default, None)
+                for c in self._columns)
+
+    def _dicts_to_tuples(self, rows):
+        """ Read tuples from many dictionaries
+
+            Rows holding every column are read with a single itemgetter call,
+            any others fall back to _dict_to_tuple
+        """
+        names = [c.name for c in self._columns]
+        if not names:
+            for _ in rows:
+                yield ()
+            return
+        getter = itemgetter(*names)
+        single = len(names) == 1
+        for data in rows:
+            try:
+                tup = getter(data)
+            except KeyError:
+                yield self._dict_to_tuple(data)
+                continue
+            yield (tup,) if single else tup
+
+    def _decoder(self, store_type):
+        """ Get the function reading a tuple from remote store data """
+        return self._db._row_codec(store_type)[0]
+
+    def _encoder(self, store_type):
+        """ Get the function converting a tuple to remote store data """
+        return self._db._row_codec(store_type)[1]
+
+    def _remote_to_tuple(self, data, store_type):
+        """ Read a tuple from remote store data """
+        return self._decoder(store_type)(data)
+
+    def _remote_from_tuple(self, tup, store_type):
+        """ Convert a tuple to a dictionary for sending to a remote store """
+        return self._encoder(store_type)(tup)
+
     @abc.abstractmethod
     def __getitem__(self, idx_pair):
         """ Retrieve a value corresponding to a row+index pair """
         pass
 
+    def iter_column(self, col_idx):
+        """ Iterate over all values in a column, in the order of the rows
+
+            The default implementation looks up each cell individually, stores
+            that can hand back a whole column more efficiently should override
+            this
+        """
+        return (self[row_idx, col_idx] for row_idx in self)
+
+    def column_values(self, col_idx):
+        """ Get all values in a column as a sequence, in the order of the rows
+
+            The returned sequence may be the store's own internal data so must
+            not be modified
+        """
+        return list(self.iter_column(col_idx) )
+
+    def select_indices(self, expr):
+        """ Find the indices of the rows selected by a query expression within
+            the store itself
+
+            Stores that can evaluate (parts of) expressions more efficiently
+            than reading their columns into python should override this. Returns
+            None if the store cannot help, in which case the expression is
+            evaluated as usual (see query.select_indices). Otherwise returns
+            the indices and whether or not they are in the order of the rows.
+        """
+        return None
+
     def __setitem__(self, idx_pair, value):
         """ Throw an error when trying to mutate an immutable object """
         raise ValueError("Attempting to modify immutable store!")
@@ -87,6 +317,10 @@ class SeqStore(Store):
     def is_mutable(self):
         return False
 
+    def __iter__(self):
+        """ Iterate over the row indices held in this store """
+        return iter(range(len(self) ) )
+
     def append(self, row_data):
         """ Throw an error when trying to mutate an immutable object """
         raise ValueError("Attempting to modify immutable store!")
@@ -104,7 +338,7 @@ class AssocStore(Store):
 
     @property
     def is_mutable(self):
-        return True
+        return False
 
     def add(self, index, row_data):
         """ Throw an error when trying to mutate an immutable object """
@@ -138,6 +372,15 @@ class MutableSeqStore(SeqStore):
         """
         pass
 
+    def extend(self, rows_data):
+        """ Add several new rows to the store
+
+            The implementation here just appends them one at a time, derived
+            classes should override this with something faster
+        """
+        for row_data in rows_data:
+            self.append(row_data)
+
     @abc.abstractmethod
     def __setitem__(self, idx_pair, value):
         """ Set a value corresponding to a row+index pair """
@@ -151,13 +394,37 @@ class MutableSeqStore(SeqStore):
             all rows past the deleted one and should be called in most derived
             implementations. Note that it should be called *after* the deletion
             has been done (it assumes that len returns the length after
-            deletion)
+            deletion). A negative row_idx counts from the end of the store as
+            it was before the deletion
         """
-        remap = {idx + 1: idx for idx in range(row_idx, len(self) )}
-        if not remap:
+        if row_idx < 0:
+            row_idx += len(self) + 1
+        if row_idx >= len(self):
             return
-        self._db._remap_indices(remap)
+        self._db._remap_indices(IndexShift(row_idx + 1, len(self) + 1, -1) )
+
+    def delete_many(self, row_indices):
+        """ Delete several rows at once
 
+            The data is compacted once (through _compact) and the indices of
+            the surviving rows remapped once, rather than once per row
+        """
+        deleted = sorted(set(row_indices) )
+        if not deleted:
+            return
+        old_len = len(self)
+        if deleted[0] < 0 or deleted[-1] >= old_len:
+            raise IndexError("Row indices out of range")
+        self._compact(deleted)
+        self._db._remap_indices(BulkIndexShift(deleted, old_len) )
+
+    @abc.abstractmethod
+    def _compact(self, deleted):
+        """ Remove the rows with the given (sorted, unique) indices
+
+            This should not remap any indices
+        """
+        pass
 
 class MutableAssocStore(AssocStore):
     """ Base class for mutable associative stores """
@@ -175,6 +442,30 @@ class MutableAssocStore(AssocStore):
         """
         pass
 
+    def add_many(self, items):
+        """ Add several new rows to this store
+
+            items should be an iterable of (index, row_data) pairs. If any of
+            the indices already exist (or are repeated) an error is thrown and
+            nothing is added.
+
+            The implementation here just adds them one at a time, derived
+            classes should override this with something faster
+        """
+        items = list(items)
+        self._check_new_indices(index for (index, _) in items)
+        for index, row_data in items:
+            self.add(index, row_data)
+
+    def _check_new_indices(self, indices):
+        """ Throw an error if any of the indices exist or are repeated """
+        seen = set()
+        for index in indices:
+            if index in self or index in seen:
+                raise KeyError(
+                        "Attempting to add pre-existing index {0}!".format(index) )
+            seen.add(index)
+
     @abc.abstractmethod
     def __setitem__(self, idx_pair, value):
         """ Set a value corresponding to a row+index pair """
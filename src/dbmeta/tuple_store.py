@@ -1,35 +1,90 @@
-from .store import Store, SeqStore, AssocStore, MutableSeqStore, MutableAssocStore
-from .column import read_identity
-from future.utils import iteritems
+from .store import (
+        Store, SeqStore, AssocStore, MutableSeqStore, MutableAssocStore,
+        compact)
+from builtins import object, zip
+from future.utils import PY3, iteritems, itervalues
+if PY3:
+    from collections.abc import Mapping
+else:
+    from collections import Mapping
+
+class _RemoteRow(object):
+    """ The remote data for a row that has not been converted yet """
+    __slots__ = ("data", "store_type")
+
+    def __init__(self, data, store_type):
+        self.data = data
+        self.store_type = store_type
 
 class TupleStore(Store):
     """ Store that stores data internally as namedtuples """
-    def __init__(self, data=None, store_type=None, **kwargs):
+    def __init__(self, data=None, store_type=None, lazy=False, **kwargs):
+        """ Create the store
+
+            If lazy is True then rows read from remote data are only converted
+            the first time that they are accessed. Until then the remote data
+            is held as it is, and is handed back unchanged by to_remote/to_dict
+            for the same store type. Any errors in the remote data are
+            therefore only raised once the row is accessed.
+        """
+        self._lazy = lazy
         super(TupleStore, self).__init__(**kwargs)
         if data is not None:
             self.from_dict(data, store_type)
 
-    def _dict_to_tuple(self, data):
-        """ Read a tuple from a dictionary """
-        return tuple(
-                read_identity(c.name, data, c._desc.default, None)
-                for c in self._columns)
-        
-
-    def _remote_to_tuple(self, data, store_type):
-        """ Read a tuple from remote store data """
-        return tuple(c.read_from(data, store_type) for c in self._columns)
-
-    def _remote_from_tuple(self, tup, store_type):
-        """ Convert a tuple to a dictionary for sending to a remote store """
-        data = {}
-        for c in self._columns:
-            c.write_to(tup[c.index], data, store_type)
-        return data
+    def _row_loader(self, store_type):
+        """ Get the function giving the internal representation of a row from
+            its remote data
+        """
+        if self._lazy:
+            return lambda data: _RemoteRow(data, store_type)
+        return self._decoder(store_type)
+
+    def _row(self, row_idx):
+        """ Get the tuple for a row, converting it if necessary """
+        row = self._data[row_idx]
+        if isinstance(row, _RemoteRow):
+            row = self._data[row_idx] = self._remote_to_tuple(
+                    row.data, row.store_type)
+        return row
+
+    def _cell(self, row, col_idx):
+        """ Get a value from an internal row without converting the rest of
+            the row
+        """
+        if isinstance(row, _RemoteRow):
+            return self._columns[col_idx].read_from(row.data, row.store_type)
+        return row[col_idx]
+
+    def _row_to_remote(self, row, store_type):
+        """ Convert an internal row to remote data
+
+            Unconverted rows read from the same store type are passed through
+        """
+        if isinstance(row, _RemoteRow):
+            if row.store_type == store_type:
+                return row.data
+            row = self._remote_to_tuple(row.data, row.store_type)
+        return self._remote_from_tuple(row, store_type)
+
+    def _rows_to_remote(self, rows, store_type):
+        """ Iterate over the remote data for many internal rows """
+        if not self._lazy:
+            return map(self._encoder(store_type), rows)
+        return (self._row_to_remote(row, store_type) for row in rows)
+
+    def _iter_cells(self, rows, col_idx):
+        """ Iterate over a column of the given internal rows
+
+            Unconverted rows are left unconverted, only the cell is read
+        """
+        if not self._lazy:
+            return (row[col_idx] for row in rows)
+        return (self._cell(row, col_idx) for row in rows)
 
     def __getitem__(self, idx_pair):
         row_idx, col_idx = idx_pair
-        return self._data[row_idx][col_idx]
+        return self._row(row_idx)[col_idx]
 
     def __len__(self):
         return len(self._data)
@@ -41,13 +96,24 @@ class TupleSeqStore(TupleStore, SeqStore):
         self._data = []
         super(TupleSeqStore, self).__init__(**kwargs)
 
+    def iter_column(self, col_idx):
+        return self._iter_cells(self._data, col_idx)
+
     def from_remote(self, data, store_type):
         """ Update the internal data store from the supplied remote store data """
-        self._data = [self._remote_to_tuple(d, store_type) for d in data]
+        self._data = list(map(self._row_loader(store_type), data) )
+
+    def from_dict(self, data, store_type):
+        """ Sequential stores receive their remote data as a sequence """
+        self.from_remote(data, store_type)
 
     def to_remote(self, store_type):
         """ Convert the internal data store to a tuple of dicts """
-        return tuple(self._remote_from_tuple(t, store_type) for t in self._data)
+        return tuple(self._rows_to_remote(self._data, store_type) )
+
+    def to_dict(self, store_type):
+        """ Sequential stores give their remote data as a sequence """
+        return self.to_remote(store_type)
 
 class MutableTupleSeqStore(TupleSeqStore, MutableSeqStore):
     """ Mutable sequential store that stores data internally as namedtuples """
@@ -55,16 +121,22 @@ class MutableTupleSeqStore(TupleSeqStore, MutableSeqStore):
     def append(self, row_data):
         self._data.append(self._dict_to_tuple(row_data))
 
+    def extend(self, rows_data):
+        self._data.extend(self._dicts_to_tuples(rows_data) )
+
     def __setitem__(self, idx_pair, value):
         row_idx, col_idx = idx_pair
         self._data[row_idx] = tuple(
                 value if i == col_idx else v
-                for (i, v) in enumerate(self._data[row_idx]))
+                for (i, v) in enumerate(self._row(row_idx) ) )
 
     def __delitem__(self, row_idx):
         del self._data[row_idx]
         MutableSeqStore.__delitem__(self, row_idx)
 
+    def _compact(self, deleted):
+        self._data = compact(self._data, deleted)
+
 class TupleAssocStore(TupleStore, AssocStore):
     """ Associative store that stores data internally as namedtuples """
     def __init__(self, **kwargs):
@@ -73,20 +145,30 @@ class TupleAssocStore(TupleStore, AssocStore):
         super(TupleAssocStore, self).__init__(**kwargs)
 
     def from_dict(self, data, store_type):
+        """ Update the internal data store from the supplied remote store data
+
+            data can be a mapping or an iterable of (key, value) pairs
+        """
+        items = iteritems(data) if isinstance(data, Mapping) else data
+        read_func = self._index_column.read_func
+        load = self._row_loader(store_type)
         self._data = {
-                self._index_column.read_func(k, store_type):
-                self._remote_to_tuple(v, store_type)
-                for k, v in iteritems(data)}
+                read_func(k, store_type): load(v) for k, v in items}
 
     def to_dict(self, store_type):
-        return {
-                self._index_column.write_func(k, store_type): \
-                        self._remote_from_tuple(t, store_type)
-                for k, t in iteritems(self._data)}
+        write_func = self._index_column.write_func
+        keys = list(self._data)
+        return dict(zip(
+            (write_func(k, store_type) for k in keys),
+            self._rows_to_remote(
+                (self._data[k] for k in keys), store_type) ) )
 
     def __iter__(self):
         return iter(self._data)
 
+    def iter_column(self, col_idx):
+        return self._iter_cells(itervalues(self._data), col_idx)
+
     def __contains__(self, row_idx):
         return row_idx in self._data
 
@@ -99,11 +181,18 @@ class MutableTupleAssocStore(TupleAssocStore, MutableAssocStore):
                     "Attempting to add pre-existing index {0}!".format(index) )
         self._data[index] = self._dict_to_tuple(row_data)
 
+    def add_many(self, items):
+        items = list(items)
+        self._check_new_indices(index for (index, _) in items)
+        self._data.update(zip(
+            (index for (index, _) in items),
+            self._dicts_to_tuples(row_data for (_, row_data) in items) ) )
+
     def __setitem__(self, idx_pair, value):
         row_idx, col_idx = idx_pair
         self._data[row_idx] = tuple(
                 value if i == col_idx else v
-                for (i, v) in enumerate(self._data[row_idx]))
+                for (i, v) in enumerate(self._row(row_idx) ) )
 
     def __delitem__(self, row_idx):
         del self._data[row_idx]
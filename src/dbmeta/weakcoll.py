@@ -1,13 +1,14 @@
 import weakref
-from future.utils import itervalues, iteritems
+from collections import OrderedDict
+from future.utils import itervalues
 
 class WeakColl(object):
     """ An iterable collection of weakrefs to objects
 
         When iterating over these the actual objects are returned if the refs
-        are still alive, otherwise the reference is removed from the list.
-
-        This is not particularly carefully optimised...
+        are still alive. Each reference removes itself from the collection
+        through its weakref callback when its object dies, so adding and
+        removing objects are both O(1).
     """
 
     def __init__(self):
@@ -15,18 +16,24 @@ class WeakColl(object):
         self._refs = {}
 
     def flush(self, r=None):
-        """ Remove any dead references """
-        self._refs = {id(r()): r for r in itervalues(self._refs) if r() is not None}
+        """ Remove any dead references
+
+            Dead references remove themselves, so this should only be needed if
+            a callback was somehow missed
+        """
+        dead = [k for (k, r) in list(self._refs.items() ) if r() is None]
+        for k in dead:
+            del self._refs[k]
 
     def __len__(self):
         """ Get the number of still living references """
-        self.flush()
         return len(self._refs)
 
     def __iter__(self):
         """ Iterate over any still living referenced objects """
-        self.flush()
-        return (r() for r in itervalues(self._refs))
+        # Take a snapshot so that objects dying during the iteration are safe
+        objs = [r() for r in list(itervalues(self._refs) )]
+        return (obj for obj in objs if obj is not None)
 
     def __contains__(self, obj):
         """ Is an object in the collection """
@@ -34,7 +41,7 @@ class WeakColl(object):
 
     def remove(self, obj, permissive=True):
         """ Remove all references to an object from the collection
-        
+
             A KeyError will only be raised if permissive is False
         """
         try:
@@ -45,18 +52,182 @@ class WeakColl(object):
 
     def rm_by_ref(self, r):
         """ Remove by the reference value.
-        
+
             This should only be used by the weakref callback.
         """
-        try:
-            obj_id = next(k for (k, v) in iteritems(self._refs) if v is r)
-        except StopIteration:
-            return
-        del self._refs[obj_id]
+        # The object may already have been removed by hand, in which case the
+        # ID may since have been reused
+        if self._refs.get(r.key) is r:
+            del self._refs[r.key]
 
     def append(self, obj):
         """ Add an object to the collection (pass the actual object in here, not
             a weakref)
         """
         if obj not in self:
-            self._refs[id(obj)] = weakref.ref(obj, self.rm_by_ref)
+            self._refs[id(obj)] = weakref.KeyedRef(obj, self.rm_by_ref, id(obj) )
+
+class RowRegistry(object):
+    """ Weak collection of the live rows of a database, bucketed by row index
+
+        This behaves like a WeakColl of rows but also allows finding the rows
+        with a given index and changing row indices while only touching the
+        rows that are affected.
+
+        Rows must only have their _index changed through remap.
+    """
+
+    def __init__(self):
+        # Mapping of row index to a dict of object ID to reference
+        self._buckets = {}
+        # Mapping of object ID to the index of its bucket
+        self._indices = {}
+
+    def __len__(self):
+        """ Get the number of still living rows """
+        return len(self._indices)
+
+    def __iter__(self):
+        """ Iterate over the still living rows """
+        refs = [r for b in list(itervalues(self._buckets) ) for r in list(itervalues(b) )]
+        rows = [r() for r in refs]
+        return (row for row in rows if row is not None)
+
+    def __contains__(self, row):
+        """ Is a row in the collection """
+        return id(row) in self._indices
+
+    def get(self, index):
+        """ Get a live row with the given index, or None if there are none """
+        try:
+            bucket = self._buckets[index]
+        except KeyError:
+            return None
+        for ref in list(itervalues(bucket) ):
+            row = ref()
+            if row is not None:
+                return row
+        return None
+
+    def rows_at(self, index):
+        """ Get the live rows with the given index """
+        try:
+            refs = list(itervalues(self._buckets[index]) )
+        except KeyError:
+            return []
+        return [row for row in (r() for r in refs) if row is not None]
+
+    def append(self, row):
+        """ Add a row to the collection (pass the actual row in here, not a
+            weakref)
+        """
+        key = id(row)
+        if key in self._indices:
+            return
+        ref = weakref.KeyedRef(row, self.rm_by_ref, key)
+        try:
+            self._buckets[row._index][key] = ref
+        except KeyError:
+            self._buckets[row._index] = {key: ref}
+        self._indices[key] = row._index
+
+    def _discard(self, key, ref=None):
+        """ Remove the entry for an object ID
+
+            If ref is given, only remove the entry if it holds that reference
+        """
+        try:
+            index = self._indices[key]
+        except KeyError:
+            return False
+        bucket = self._buckets.get(index, {})
+        if ref is not None and bucket.get(key, ref) is not ref:
+            return False
+        bucket.pop(key, None)
+        if not bucket:
+            self._buckets.pop(index, None)
+        del self._indices[key]
+        return True
+
+    def remove(self, row, permissive=True):
+        """ Remove a row from the collection
+
+            A KeyError will only be raised if permissive is False
+        """
+        if not self._discard(id(row) ) and not permissive:
+            raise KeyError(row)
+
+    def rm_by_ref(self, r):
+        """ Remove by the reference value.
+
+            This should only be used by the weakref callback.
+        """
+        self._discard(r.key, r)
+
+    def remap(self, remap):
+        """ Reassign row indices
+
+            remap should be a mapping of old index to new index. Only the rows
+            whose indices are in remap are touched.
+        """
+        if len(remap) < len(self._buckets):
+            moving = [idx for idx in remap if idx in self._buckets]
+        else:
+            moving = [idx for idx in self._buckets if idx in remap]
+        # Build the new buckets before changing anything. The moving rows are
+        # held until the end, so none of them can die part of the way through
+        # and have their weakref callbacks find the registry half changed
+        moved = {}
+        rows = []
+        for idx in moving:
+            new_idx = remap[idx]
+            for key, ref in list(self._buckets[idx].items() ):
+                row = ref()
+                if row is not None:
+                    moved.setdefault(new_idx, {})[key] = ref
+                    rows.append( (key, row, new_idx) )
+        # Dead rows left in the old buckets are dropped with them
+        for idx in moving:
+            for key in list(self._buckets.pop(idx, () ) ):
+                self._indices.pop(key, None)
+        for new_idx, bucket in moved.items():
+            self._buckets.setdefault(new_idx, {}).update(bucket)
+        for key, row, new_idx in rows:
+            row._index = new_idx
+            self._indices[key] = new_idx
+
+class LRUCache(object):
+    """ Holds strong references to the most recently used objects
+
+        This is used to keep recently used rows alive, so that they can be
+        found again in a RowRegistry rather than recreated
+    """
+
+    def __init__(self, size):
+        self._size = size
+        # Mapping of object IDs to the objects, least recently used first
+        self._objs = OrderedDict()
+
+    @property
+    def size(self):
+        """ The maximum number of objects held """
+        return self._size
+
+    def __len__(self):
+        return len(self._objs)
+
+    def touch(self, obj):
+        """ Mark an object as the most recently used, adding it if necessary """
+        key = id(obj)
+        self._objs.pop(key, None)
+        self._objs[key] = obj
+        if len(self._objs) > self._size:
+            self._objs.popitem(last=False)
+
+    def remove(self, obj):
+        """ Stop holding an object """
+        self._objs.pop(id(obj), None)
+
+    def clear(self):
+        """ Stop holding all objects """
+        self._objs.clear()
@@ -0,0 +1,29 @@
+""" Database classes shared between the tests
+
+    Each takes a function making its store from the database, by default a
+    mutable tuple store. Any other keyword arguments are passed on to the
+    database
+"""
+from dbmeta.database import SeqDatabase, AssocDatabase
+from dbmeta.column import ColumnDesc, IndexColumnDesc
+from dbmeta.tuple_store import MutableTupleSeqStore, MutableTupleAssocStore
+
+class Runs(SeqDatabase):
+    run = ColumnDesc(index="sorted")
+    energy = ColumnDesc(default=None)
+    tag = ColumnDesc(index="hash")
+
+    def __init__(self, make_store=None, **kwargs):
+        super(Runs, self).__init__(
+                MutableTupleSeqStore(db=self) if make_store is None
+                else make_store(self), **kwargs)
+
+class Files(AssocDatabase):
+    name = IndexColumnDesc()
+    size = ColumnDesc(index="sorted")
+    kind = ColumnDesc(index="hash", default=None)
+
+    def __init__(self, make_store=None, **kwargs):
+        super(Files, self).__init__(
+                MutableTupleAssocStore(db=self) if make_store is None
+                else make_store(self), **kwargs)
@@ -0,0 +1,109 @@
+from __future__ import division
+import unittest
+from .databases import Runs, Files
+
+_rows = [
+        {"run": 3, "energy": 1.0, "tag": "b"},
+        {"run": 1, "energy": 2.0, "tag": "a"},
+        {"run": 3, "energy": 4.0, "tag": "c"},
+        {"run": 2, "energy": 8.0, "tag": "a"},
+        {"run": 1, "energy": 16.0, "tag": "b"},
+        ]
+
+def _build_indices(db):
+    list(db.select(db.run == 1) )
+    list(db.select(db.tag == "a") )
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Runs()
+        self.db.extend(_rows)
+
+    def check_aggregations(self):
+        db = self.db
+        self.assertEqual(db.energy.sum(), 31.0)
+        self.assertEqual(db.energy.mean(), 31.0 / 5)
+        self.assertEqual(db.run.min(), 1)
+        self.assertEqual(db.run.max(), 3)
+        self.assertEqual(db.run.count(), 5)
+        self.assertEqual(db.run.distinct(), [3, 1, 2])
+        self.assertEqual(db.tag.distinct(), ["b", "a", "c"])
+
+    def test_scan(self):
+        self.check_aggregations()
+
+    def test_index(self):
+        _build_indices(self.db)
+        self.assertEqual(sorted(self.db._indices), ["run", "tag"])
+        self.check_aggregations()
+
+    def test_index_follows_changes(self):
+        _build_indices(self.db)
+        self.db[0].run = 7
+        del self.db[1]
+        self.assertEqual(self.db.run.max(), 7)
+        self.assertEqual(self.db.run.min(), 1)
+        self.assertEqual(self.db.run.distinct(), [7, 3, 2, 1])
+
+    def test_empty(self):
+        db = Runs()
+        self.assertEqual(db.energy.sum(), 0)
+        self.assertEqual(db.energy.count(), 0)
+        self.assertEqual(db.energy.distinct(), [])
+        self.assertRaises(ValueError, db.energy.mean)
+        self.assertRaises(ValueError, db.energy.max)
+
+    def test_associative(self):
+        db = Files()
+        db.add_many([
+            {"name": "x", "size": 3, "kind": "txt"},
+            {"name": "y", "size": 5, "kind": "bin"},
+            {"name": "z", "size": 7, "kind": "txt"}])
+        self.assertEqual(db.size.sum(), 15)
+        self.assertEqual(db.name.count(), 3)
+        self.assertEqual(sorted(db.kind.distinct() ), ["bin", "txt"])
+
+class TestGroupBy(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Runs()
+        self.db.extend(_rows)
+
+    def check_groups(self):
+        db = self.db
+        groups = db.group_by(db.run).agg(
+                n="count", total=(db.energy, "sum"), top=("energy", max),
+                tags=(db.tag, "distinct"), avg=(db.energy, "mean") )
+        self.assertEqual(list(groups), [3, 1, 2])
+        self.assertEqual(groups[3], {
+            "n": 2, "total": 5.0, "top": 4.0, "tags": ["b", "c"], "avg": 2.5})
+        self.assertEqual(groups[1], {
+            "n": 2, "total": 18.0, "top": 16.0, "tags": ["a", "b"], "avg": 9.0})
+        self.assertEqual(groups[2], {
+            "n": 1, "total": 8.0, "top": 8.0, "tags": ["a"], "avg": 8.0})
+        self.assertEqual(list(db.group_by("tag").count().items() ),
+                         [("b", 2), ("a", 2), ("c", 1)])
+
+    def test_scan(self):
+        self.check_groups()
+
+    def test_index(self):
+        _build_indices(self.db)
+        self.check_groups()
+
+    def test_several_columns(self):
+        counts = self.db.group_by(self.db.run, "tag").count()
+        self.assertEqual(list(counts.items() ), [
+            ((3, "b"), 1), ((1, "a"), 1), ((3, "c"), 1), ((2, "a"), 1),
+            ((1, "b"), 1)])
+
+    def test_errors(self):
+        db = self.db
+        self.assertRaises(ValueError, db.group_by)
+        self.assertRaises(
+                ValueError, db.group_by(db.run).agg, x=(db.energy, "median") )
+        self.assertRaises(ValueError, db.group_by(db.run).agg, x="sum")
+
+if __name__ == "__main__":
+    unittest.main()
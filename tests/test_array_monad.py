@@ -0,0 +1,123 @@
+import unittest
+from dbmeta.array_monad import ArrayMonad
+from dbmeta.coll_monad import CollMonad, TupleMonad
+from .databases import Runs, Files
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+@unittest.skipUnless(np, "NumPy is not installed")
+class TestArrayMonad(unittest.TestCase):
+
+    def test_operators(self):
+        arr = ArrayMonad([1, 2, 3, 4])
+        self.assertIsInstance(arr + 1, ArrayMonad)
+        self.assertEqual(list(arr + 1), [2, 3, 4, 5])
+        self.assertEqual(list(10 - arr), [9, 8, 7, 6])
+        self.assertEqual(list(arr * arr), [1, 4, 9, 16])
+        self.assertEqual(list(arr / 2), [0.5, 1, 1.5, 2])
+        self.assertEqual(list(1 / arr), [1, 0.5, 1. / 3, 0.25])
+        self.assertEqual(list(arr // 2), [0, 1, 1, 2])
+        self.assertEqual(list(arr % 3), [1, 2, 0, 1])
+        self.assertEqual(list(arr ** 2), [1, 4, 9, 16])
+        # Reflected forms, with the plain value on the left
+        self.assertIsInstance(2 ** arr, ArrayMonad)
+        self.assertEqual(list(2 ** arr), [2, 4, 8, 16])
+        self.assertEqual(list(7 // arr), [7, 3, 2, 1])
+        self.assertEqual(list(7 % arr), [0, 1, 1, 3])
+        self.assertEqual(list(abs(-arr) ), [1, 2, 3, 4])
+        # Other iterators are read into arrays
+        self.assertEqual(list(arr + TupleMonad( (1, 1, 2, 2) ) ), [2, 3, 5, 6])
+
+    def test_comparisons(self):
+        arr = ArrayMonad([1, 2, 3, 4])
+        self.assertIsInstance(arr > 2, ArrayMonad)
+        self.assertEqual(list(arr > 2), [False, False, True, True])
+        self.assertEqual(list(arr >= 2), [False, True, True, True])
+        self.assertEqual(list(arr < 2), [True, False, False, False])
+        self.assertEqual(list(arr <= 2), [True, True, False, False])
+        self.assertEqual(list(arr == 2), [False, True, False, False])
+        self.assertEqual(list(arr != 2), [True, False, True, True])
+        self.assertEqual(list(~(arr == 2) ), [True, False, True, True])
+        self.assertEqual(
+                list( (arr < 2) | (arr > 3) ), [True, False, False, True])
+        self.assertEqual(
+                list( (arr > 1) & (arr < 4) ), [False, True, True, False])
+        mask = [True, True, False, True]
+        self.assertIsInstance(mask & (arr > 1), ArrayMonad)
+        self.assertEqual(list(mask & (arr > 1) ), [False, True, False, True])
+        self.assertEqual(list(mask | (arr > 2) ), [True, True, True, True])
+        self.assertEqual(list(False | (arr > 2) ), [False, False, True, True])
+
+    def test_logical(self):
+        arr = ArrayMonad([1, 2, 3, 4])
+        self.assertEqual(
+                list(CollMonad.in_(arr, [2, 4, 5]) ), [False, True, False, True])
+        result = CollMonad.and_(arr > 1, arr < 4)
+        self.assertIsInstance(result, ArrayMonad)
+        self.assertEqual(list(result), [False, True, True, False])
+        result = CollMonad.or_(arr < 2, arr > 3)
+        self.assertIsInstance(result, ArrayMonad)
+        self.assertEqual(list(result), [True, False, False, True])
+        self.assertEqual(
+                list(CollMonad.all(arr > 1, arr < 4, arr != 3) ),
+                [False, True, False, False])
+
+    def test_select(self):
+        arr = ArrayMonad([1, 2, 3, 4])
+        self.assertEqual(list(arr.select(arr > 2) ), [3, 4])
+        self.assertEqual(list(arr.select([True, False, True, False]) ), [1, 3])
+
+@unittest.skipUnless(np, "NumPy is not installed")
+class TestArraySelect(unittest.TestCase):
+
+    def setUp(self):
+        self.runs = Runs()
+        for i in range(6):
+            self.runs.append(run=i, energy=0.5 * i, tag="t{0}".format(i % 2) )
+        self.files = Files()
+        for i in range(4):
+            self.files.add(name="f{0}".format(i), size=i * 10)
+
+    def test_as_array(self):
+        energy = self.runs.energy.as_array()
+        self.assertIsInstance(energy, ArrayMonad)
+        self.assertEqual(energy.array.tolist(), [0.5 * i for i in range(6)])
+        self.assertEqual(
+                self.runs.run.as_array(dtype="float").array.dtype, np.float64)
+        arrays = self.runs.columns_as_arrays()
+        self.assertEqual(sorted(arrays), ["energy", "run", "tag"])
+        self.assertEqual(list(arrays["run"]), list(range(6) ) )
+        self.assertEqual(
+                sorted(self.runs.columns_as_arrays("tag") ), ["tag"])
+
+    def test_select_seq(self):
+        db = self.runs
+        energy = db.energy.as_array()
+        tag = db.tag.as_array()
+        mask = (energy > 0.5) & (tag == "t1")
+        self.assertEqual([row.run for row in db.select(mask)], [3, 5])
+        # Plain NumPy arrays are also treated as masks
+        self.assertEqual(
+                [row.run for row in db.select(mask.array)], [3, 5])
+        self.assertEqual(
+                [row.run for row in db.select(CollMonad.in_(tag, ["t0"]) )],
+                [0, 2, 4])
+        self.assertEqual(list(db.select(energy > 100) ), [])
+
+    def test_select_assoc(self):
+        db = self.files
+        size = db.size.as_array()
+        self.assertEqual(
+                sorted(row.name for row in db.select(
+                    CollMonad.or_(size < 10, size > 20) ) ),
+                ["f0", "f3"])
+
+    def test_mask_length(self):
+        mask = np.array([True, False])
+        self.assertRaises(ValueError, self.runs.select, mask)
+        self.assertRaises(ValueError, self.files.select, ArrayMonad(mask) )
+
+if __name__ == "__main__":
+    unittest.main()
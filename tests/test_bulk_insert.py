@@ -0,0 +1,101 @@
+import unittest
+from dbmeta.database import SeqDatabase, AssocDatabase
+from dbmeta.column import ColumnDesc, IndexColumnDesc
+from dbmeta.tuple_store import MutableTupleSeqStore, MutableTupleAssocStore
+from .databases import Runs, Files
+
+class Points(SeqDatabase):
+    """ Holds its values as strings in the store """
+    x = ColumnDesc(type=float, store_type=str)
+    label = ColumnDesc(default="")
+
+    def __init__(self):
+        super(Points, self).__init__(MutableTupleSeqStore(db=self) )
+
+class Numbered(AssocDatabase):
+    """ Holds its keys as strings in the store """
+    number = IndexColumnDesc(type=int, store_type=str)
+    x = ColumnDesc(type=float, store_type=str)
+
+    def __init__(self):
+        super(Numbered, self).__init__(MutableTupleAssocStore(db=self) )
+
+class TestExtend(unittest.TestCase):
+
+    def test_return_rows(self):
+        db = Runs()
+        db.append(run=0, tag="a")
+        self.assertIsNone(db.extend([{"run": 1, "tag": "b"}]) )
+        rows = db.extend(
+                [{"run": 2, "tag": "a"}, {"run": 3, "tag": "b"}],
+                return_rows=True)
+        self.assertEqual([row._index for row in rows], [2, 3])
+        self.assertEqual([row.run for row in rows], [2, 3])
+        self.assertEqual(db.extend([], return_rows=True), [])
+        # Rows can be given by any iterable, they are only read once
+        db.extend( ({"run": i, "tag": "c"} for i in range(4, 6) ) )
+        self.assertEqual(list(db.run), list(range(6) ) )
+
+    def test_conversion(self):
+        db = Points()
+        db.extend([{"x": 1.5, "label": "a"}, {"x": 2}])
+        self.assertEqual(db._store[0, 0], "1.5")
+        self.assertEqual(db._store[1, 0], "2")
+        self.assertEqual(list(db.x), [1.5, 2.0])
+        self.assertEqual(list(db.label), ["a", ""])
+        # The dicts provided are not changed
+        data = {"x": 3}
+        db.extend([data])
+        self.assertEqual(data, {"x": 3})
+
+    def test_bad_rows(self):
+        db = Points()
+        db.append(x=0)
+        self.assertRaises(KeyError, db.extend, [{"x": 1}, {"label": "a"}])
+        self.assertRaises(KeyError, db.extend, [{"x": 1, "y": 2}])
+        self.assertEqual(len(db), 1)
+
+class TestAddMany(unittest.TestCase):
+
+    def test_return_rows(self):
+        db = Files()
+        rows = db.add_many(
+                [{"name": "x", "size": 1}, {"name": "y", "size": 2}],
+                return_rows=True)
+        self.assertEqual([row.name for row in rows], ["x", "y"])
+        self.assertIsNone(db.add_many([{"name": "z", "size": 3}]) )
+        self.assertEqual(sorted(db), ["x", "y", "z"])
+
+    def test_conversion(self):
+        db = Numbered()
+        db.add_many([{"number": 1, "x": 0.5}, {"number": 2, "x": 3}])
+        self.assertEqual(sorted(db._store), ["1", "2"])
+        self.assertEqual(db._store["2", 0], "3")
+        self.assertEqual(db[2].x, 3.0)
+        self.assertEqual(sorted(db), [1, 2])
+
+    def test_duplicate_keys(self):
+        db = Files()
+        db.add(name="x", size=1)
+        self.assertEqual([row.name for row in db.select(db.size > 0)], ["x"])
+        # Repeated within the new rows
+        self.assertRaises(
+                KeyError, db.add_many,
+                [{"name": "y", "size": 2}, {"name": "y", "size": 3}])
+        # Already in the database
+        self.assertRaises(
+                KeyError, db.add_many,
+                [{"name": "z", "size": 4}, {"name": "x", "size": 5}])
+        self.assertEqual(list(db), ["x"])
+        self.assertEqual(db["x"].size, 1)
+        self.assertEqual([row.name for row in db.select(db.size > 0)], ["x"])
+
+    def test_converted_duplicate(self):
+        db = Numbered()
+        db.add(number=1, x=0)
+        self.assertRaises(
+                KeyError, db.add_many, [{"number": "1", "x": 2}])
+        self.assertEqual(len(db), 1)
+
+if __name__ == "__main__":
+    unittest.main()
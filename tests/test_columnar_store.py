@@ -0,0 +1,155 @@
+import unittest
+from array import array
+from collections import OrderedDict
+from dbmeta.columnar_store import (
+        ColumnarSeqStore, ColumnarAssocStore, MutableColumnarSeqStore,
+        MutableColumnarAssocStore)
+from dbmeta.database import SeqDatabase, AssocDatabase
+from dbmeta.column import ColumnDesc, IndexColumnDesc
+
+class Runs(SeqDatabase):
+    run = ColumnDesc()
+    energy = ColumnDesc(default=None)
+    tag = ColumnDesc()
+
+    def __init__(self, make_store):
+        super(Runs, self).__init__(make_store(self) )
+
+class Files(AssocDatabase):
+    name = IndexColumnDesc()
+    size = ColumnDesc()
+    kind = ColumnDesc(default=None)
+
+    def __init__(self, make_store):
+        super(Files, self).__init__(make_store(self) )
+
+_runs = [{"run": i, "energy": 0.5 * i, "tag": "t{0}".format(i % 2)}
+         for i in range(5)]
+_files = {"f{0}".format(i): {"size": 10 * i, "kind": "k{0}".format(i % 2)}
+          for i in range(5)}
+
+def _index(db, name):
+    return next(c.index for c in db._columns if c.name == name)
+
+class TestColumnarSeqStore(unittest.TestCase):
+
+    def make_db(self, store_cls=MutableColumnarSeqStore, **kwargs):
+        return Runs(lambda db: store_cls(
+            data=_runs, store_type=None, db=db, **kwargs) )
+
+    def test_round_trip(self):
+        for store_cls in (ColumnarSeqStore, MutableColumnarSeqStore):
+            db = self.make_db(store_cls)
+            self.assertEqual(len(db), 5)
+            self.assertEqual(db._store.to_remote(None), tuple(_runs) )
+            db._store.from_remote(_runs[:2], None)
+            self.assertEqual(len(db), 2)
+            self.assertEqual(db._store.to_remote(None), tuple(_runs[:2]) )
+
+    def test_columns(self):
+        db = self.make_db()
+        col_idx = _index(db, "run")
+        self.assertEqual(list(db._store.iter_column(col_idx) ), list(range(5) ) )
+        self.assertEqual(list(db._store._data[col_idx]), list(range(5) ) )
+        self.assertEqual(list(db.energy), [0.5 * i for i in range(5)])
+
+    def test_typecodes(self):
+        db = self.make_db(typecodes={"run": "l", "energy": "d"})
+        store = db._store
+        self.assertEqual(
+                store._data[_index(db, "run")], array('l', range(5) ) )
+        self.assertIsInstance(store._data[_index(db, "tag")], list)
+        db.append(run=5, energy=2.5, tag="t1")
+        db[0].energy = 7
+        self.assertEqual(
+                store._data[_index(db, "energy")],
+                array('d', [7, 0.5, 1, 1.5, 2, 2.5]) )
+        del db[1]
+        self.assertEqual(list(db.run), [0, 2, 3, 4, 5])
+        self.assertEqual(store.to_remote(None)[1], _runs[2])
+
+    def test_bad_array_value(self):
+        # The energy column defaults to None, which a 'd' array cannot hold
+        db = self.make_db(typecodes={"run": "l", "energy": "d"})
+        self.assertRaises(TypeError, db.append, run=5, tag="t1")
+        self.assertRaises(
+                TypeError, db.extend,
+                [{"run": 5, "energy": 1.0, "tag": "t0"}, {"run": 6, "tag": "t1"}])
+        # Nothing is left behind in the columns that accepted their values
+        self.assertEqual(len(db), 5)
+        self.assertEqual(
+                [len(column) for column in db._store._data], [5, 5, 5])
+        db.append(run=5, energy=1.0, tag="t1")
+        self.assertEqual(list(db.run), list(range(6) ) )
+
+    def test_missing_value(self):
+        db = self.make_db(typecodes={"run": "l"})
+        self.assertRaises(KeyError, db.append, tag="t1")
+        self.assertEqual(len(db), 5)
+
+class TestColumnarAssocStore(unittest.TestCase):
+
+    def make_db(self, store_cls=MutableColumnarAssocStore, **kwargs):
+        return Files(lambda db: store_cls(
+            data=_files, store_type=None, db=db, **kwargs) )
+
+    def test_round_trip(self):
+        for store_cls in (ColumnarAssocStore, MutableColumnarAssocStore):
+            db = self.make_db(store_cls)
+            self.assertEqual(len(db), 5)
+            self.assertEqual(db._store.to_dict(None), _files)
+            # Rows are read in the order given
+            db._store.from_dict(
+                    OrderedDict([("b", _files["f1"]), ("a", _files["f2"])]),
+                    None)
+            self.assertEqual(list(db._store), ["b", "a"])
+            self.assertEqual(db["a"].size, 20)
+
+    def test_typecodes(self):
+        db = self.make_db(typecodes={"size": "q"})
+        self.assertEqual(
+                sorted(db._store.iter_column(_index(db, "size") ) ),
+                [0, 10, 20, 30, 40])
+        self.assertIsInstance(
+                db._store._data[_index(db, "size")], array)
+        self.assertRaises(TypeError, db.add, name="g", size=None)
+        self.assertNotIn("g", db._store)
+        self.assertEqual(
+                [len(column) for column in db._store._data], [5, 5])
+
+    def test_delete_swaps_last(self):
+        db = self.make_db(typecodes={"size": "q"})
+        store = db._store
+        first, last = store._keys[0], store._keys[-1]
+        del db[first]
+        # The last row takes the deleted row's slot
+        self.assertEqual(store._keys[0], last)
+        self.assertEqual(len(store._keys), 4)
+        self.assertNotIn(first, db._store)
+        for name in store:
+            self.assertEqual(db[name].size, _files[name]["size"])
+            self.assertEqual(db[name].kind, _files[name]["kind"])
+        self.assertEqual(
+                {name: store._keys[pos] for name, pos in store._positions.items()},
+                {name: name for name in store})
+        # Deleting the last row moves nothing
+        del db[store._keys[-1]]
+        self.assertEqual(len(db), 3)
+        self.assertEqual(
+                sorted(db.size), sorted(_files[name]["size"] for name in store) )
+
+    def test_add_many(self):
+        db = self.make_db(typecodes={"size": "q"})
+        db.add_many([{"name": "g0", "size": 1}, {"name": "g1", "size": 2}])
+        self.assertEqual(list(db._store)[-2:], ["g0", "g1"])
+        self.assertEqual(db["g1"].size, 2)
+        self.assertIsNone(db["g0"].kind)
+        self.assertRaises(
+                TypeError, db.add_many,
+                [{"name": "h0", "size": 3}, {"name": "h1", "size": None}])
+        self.assertEqual(len(db), 7)
+        self.assertEqual(
+                [len(column) for column in db._store._data], [7, 7])
+
+if __name__ == "__main__":
+    unittest.main()
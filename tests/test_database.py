@@ -0,0 +1,193 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from dbmeta.tuple_store import MutableTupleSeqStore, MutableTupleAssocStore
+from dbmeta.json_store import MutableJSONSeqStore, MutableJSONAssocStore
+from .databases import Runs, Files
+
+class Rollback(Exception):
+    pass
+
+class TransactionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def json_file(self, data):
+        db_file = os.path.join(self.tmp_dir, "db.json")
+        with open(db_file, 'w') as fp:
+            json.dump(data, fp)
+        return db_file
+
+    def rolled_back(self, db, changes):
+        """ Make changes inside a transaction that is then rolled back """
+        with self.assertRaises(Rollback):
+            with db.transaction():
+                changes(db)
+                raise Rollback()
+
+class TestSeqTransaction(TransactionTestCase):
+
+    def each_db(self):
+        rows = [{"run": i, "tag": "t{0}".format(i % 2)} for i in range(5)]
+        db = Runs(lambda db: MutableTupleSeqStore(db=db) )
+        db.extend(rows)
+        yield db
+        db_file = self.json_file(rows)
+        yield Runs(lambda db: MutableJSONSeqStore(db_file=db_file, db=db) )
+
+    def check_unchanged(self, db):
+        self.assertEqual(list(db.run), [0, 1, 2, 3, 4])
+        self.assertEqual(list(db.tag), ["t0", "t1", "t0", "t1", "t0"])
+        self.assertEqual([r.run for r in db.select(db.run >= 3)], [3, 4])
+        self.assertEqual([r.run for r in db.select(db.tag == "t1")], [1, 3])
+        if isinstance(db._store, MutableJSONSeqStore):
+            self.assertEqual(db._store._pending_patches(), [])
+
+    def test_set(self):
+        for db in self.each_db():
+            # Build the indexes so that they are rolled back too
+            self.check_unchanged(db)
+            def changes(db):
+                db[0].run = 10
+                db[0].run = 11
+                db[1].tag = "x"
+            self.rolled_back(db, changes)
+            self.check_unchanged(db)
+
+    def test_append(self):
+        for db in self.each_db():
+            self.check_unchanged(db)
+            def changes(db):
+                db.append(run=5, tag="t1")
+                db.extend([{"run": 6, "tag": "t0"}, {"run": 7, "tag": "t1"}])
+                db[5].run = 8
+                db[0].run = 9
+            self.rolled_back(db, changes)
+            self.check_unchanged(db)
+
+    def test_delete(self):
+        for db in self.each_db():
+            self.check_unchanged(db)
+            rows = list(db)
+            def changes(db):
+                del db[1]
+                del db[-1]
+                db.delete_many([0, 2])
+                # Deletions wait until the end, so nothing moves
+                self.assertEqual(len(db), 5)
+                db[3].run = 13
+            self.rolled_back(db, changes)
+            self.check_unchanged(db)
+            self.assertEqual([r.run for r in rows], [0, 1, 2, 3, 4])
+
+    def test_mixed(self):
+        for db in self.each_db():
+            self.check_unchanged(db)
+            def changes(db):
+                db[2].tag = "x"
+                db.append(run=5, tag="t1")
+                del db[2]
+                db[2].tag = "y"
+                with db.transaction():
+                    db.append(run=6, tag="t0")
+            self.rolled_back(db, changes)
+            self.check_unchanged(db)
+
+    def test_commit(self):
+        for db in self.each_db():
+            self.check_unchanged(db)
+            with db.transaction():
+                db[0].run = 10
+                db.append(run=5, tag="t1")
+                del db[1]
+                self.assertEqual(len(db), 6)
+            self.assertEqual(list(db.run), [10, 2, 3, 4, 5])
+            self.assertEqual([r.run for r in db.select(db.tag == "t1")], [3, 5])
+            if isinstance(db._store, MutableJSONSeqStore):
+                db._store.write()
+                self.assertEqual(
+                        list(Runs(lambda d: MutableJSONSeqStore(
+                            db_file=db._store._db_file, db=d) ).run),
+                        [10, 2, 3, 4, 5])
+
+    def test_earlier_changes_kept(self):
+        for db in self.each_db():
+            db[0].run = 10
+            self.rolled_back(db, lambda db: setattr(db[0], "run", 0) )
+            self.assertEqual(db[0].run, 10)
+            if isinstance(db._store, MutableJSONSeqStore):
+                self.assertEqual(db._store._pending_patches(), [
+                    {"op": "replace", "path": "/0/run", "value": 10}])
+
+    def test_written_inside(self):
+        db_file = self.json_file([{"run": 0, "energy": None, "tag": "t0"}])
+        db = Runs(lambda db: MutableJSONSeqStore(db_file=db_file, db=db) )
+        def changes(db):
+            db[0].run = 10
+            db._store.write()
+        self.rolled_back(db, changes)
+        # The change is already on disk, so undoing it is a change too
+        self.assertEqual(db._store._pending_patches(), [
+            {"op": "replace", "path": "/0/run", "value": 0}])
+        db._store.write()
+        with open(db_file, 'r') as fp:
+            self.assertEqual(json.load(fp), [{"run": 0, "energy": None, "tag": "t0"}])
+
+class TestAssocTransaction(TransactionTestCase):
+
+    def each_db(self):
+        rows = {"f{0}".format(i): {"size": i} for i in range(4)}
+        db = Files(lambda db: MutableTupleAssocStore(db=db) )
+        db.add_many([dict(data, name=name) for name, data in rows.items()])
+        yield db
+        db_file = self.json_file(rows)
+        yield Files(lambda db: MutableJSONAssocStore(db_file=db_file, db=db) )
+
+    def check_unchanged(self, db):
+        self.assertEqual(sorted(db), ["f0", "f1", "f2", "f3"])
+        self.assertEqual([db[name].size for name in sorted(db)], [0, 1, 2, 3])
+        self.assertEqual(
+                sorted(r.name for r in db.select(db.size >= 2) ), ["f2", "f3"])
+        if isinstance(db._store, MutableJSONAssocStore):
+            self.assertEqual(db._store._pending_patches(), [])
+
+    def test_set(self):
+        for db in self.each_db():
+            self.check_unchanged(db)
+            def changes(db):
+                db["f0"].size = 10
+                db["f0"].size = 11
+                db["f3"].size = 0
+            self.rolled_back(db, changes)
+            self.check_unchanged(db)
+
+    def test_add(self):
+        for db in self.each_db():
+            self.check_unchanged(db)
+            def changes(db):
+                db.add(name="g0", size=5)
+                db.add_many([{"name": "g1", "size": 6}, {"name": "g2", "size": 7}])
+                db["g1"].size = 8
+            self.rolled_back(db, changes)
+            self.check_unchanged(db)
+            self.assertNotIn("g0", db)
+
+    def test_delete(self):
+        for db in self.each_db():
+            self.check_unchanged(db)
+            def changes(db):
+                db["f1"].size = 10
+                del db["f1"]
+                del db["f2"]
+                db.add(name="f2", size=20)
+            self.rolled_back(db, changes)
+            self.check_unchanged(db)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import gc
+import weakref
+from .databases import Runs, Files
+
+class TestIdentityMap(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Runs(identity_map=True, row_cache_size=3)
+        for i in range(6):
+            self.db.append(run=i, tag="t{0}".format(i % 2) )
+
+    def test_same_row(self):
+        db = self.db
+        self.assertIs(db[2], db[2])
+        row = db[4]
+        self.assertIs(db[-2], row)
+        self.assertIs(next(iter(db.select(db.run == 4) ) ), row)
+        self.assertIs(db.select_one(db.run == 4), row)
+        self.assertIs(list(db.order_by(db.run, descending=True) )[1], row)
+        self.assertIs(list(db)[4], row)
+        self.assertIsNot(db[3], row)
+
+    def test_new_rows(self):
+        db = self.db
+        row = db.append(run=6, tag="t0")
+        self.assertIs(db[6], row)
+        rows = db.extend([{"run": 7, "tag": "t1"}], return_rows=True)
+        self.assertIs(db[7], rows[0])
+        row = Runs._row_cls.create(db, run=8, tag="t0")
+        self.assertIs(db[8], row)
+
+    def test_no_identity_map(self):
+        db = Runs()
+        db.append(run=0, tag="t0")
+        self.assertIsNot(db[0], db[0])
+        self.assertEqual(db[0]._index, db[0]._index)
+
+    def test_cache_evicts(self):
+        db = self.db
+        db.clear_row_cache()
+        first = weakref.ref(db[0])
+        for idx in (1, 2):
+            db[idx]
+        gc.collect()
+        # The three most recent rows are held
+        self.assertIsNotNone(first() )
+        self.assertIs(db[0], first() )
+        db[3]
+        db[4]
+        db[5]
+        gc.collect()
+        self.assertIsNone(first() )
+        self.assertEqual(len(db._row_cache), 3)
+        db.clear_row_cache()
+        self.assertEqual(len(db._row_cache), 0)
+
+    def test_delete(self):
+        db = self.db
+        rows = [db[idx] for idx in range(6)]
+        del db[2]
+        # The deleted row is forgotten and the later rows are remapped
+        self.assertNotIn(rows[2], db._references)
+        self.assertNotIn(rows[2], db._row_cache._objs.values() )
+        self.assertIs(db[2], rows[3])
+        self.assertEqual(rows[3].run, 3)
+        self.assertIsNot(db[1], rows[2])
+        self.assertEqual([db[idx].run for idx in range(5)], [0, 1, 3, 4, 5])
+        db.delete_many([0, 4])
+        self.assertIs(db[0], rows[1])
+        self.assertEqual([row.run for row in db], [1, 3, 4])
+
+class TestAssocIdentityMap(unittest.TestCase):
+
+    def test_same_row(self):
+        db = Files(identity_map=True)
+        row = db.add(name="x", size=1)
+        db.add_many([{"name": "y", "size": 2}])
+        self.assertIs(db["x"], row)
+        self.assertIs(db.select_one(db.size == 1), row)
+        self.assertIs(Files._row_cls.create(db, name="z", size=3), db["z"])
+        del db["x"]
+        self.assertNotIn(row, db._references)
+        self.assertEqual(
+                sorted(r.name for r in db.select(db.size > 0) ), ["y", "z"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+import unittest
+from future.utils import PY3
+from dbmeta.coll_monad import CollMonad
+from dbmeta.index import ColumnIndex, HashIndex, SortedIndex, remap_rows
+from dbmeta.store import IndexShift
+from .databases import Runs, Files
+
+_rows = [
+        {"run": 3, "tag": "b"},
+        {"run": 1, "tag": "a"},
+        {"run": 4, "tag": "c"},
+        {"run": 2, "tag": "a"},
+        {"run": 5, "tag": "b"},
+        ]
+
+def _select(db, expr):
+    return sorted(row._index for row in db.select(expr) )
+
+def _scan(db, pred):
+    return [idx for idx, row in enumerate(db) if pred(row)]
+
+def _fill(db, rows=_rows):
+    for row in rows:
+        db.append(**row)
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Runs()
+        _fill(self.db)
+
+    def check(self):
+        """ Compare the indexed selections with scans """
+        db = self.db
+        self.assertEqual(_select(db, db.run == 3), _scan(db, lambda r: r.run == 3) )
+        self.assertEqual(_select(db, db.run < 3), _scan(db, lambda r: r.run < 3) )
+        self.assertEqual(_select(db, db.run <= 3), _scan(db, lambda r: r.run <= 3) )
+        self.assertEqual(_select(db, db.run > 3), _scan(db, lambda r: r.run > 3) )
+        self.assertEqual(_select(db, db.run >= 3), _scan(db, lambda r: r.run >= 3) )
+        self.assertEqual(
+                _select(db, CollMonad.in_(db.run, [1, 5, 9]) ),
+                _scan(db, lambda r: r.run in (1, 5, 9) ) )
+        self.assertEqual(
+                _select(db, db.tag == "a"), _scan(db, lambda r: r.tag == "a") )
+        self.assertEqual(
+                _select(db, CollMonad.in_(db.tag, ["b", "c"]) ),
+                _scan(db, lambda r: r.tag in ("b", "c") ) )
+        self.assertEqual(sorted(db._indices), ["run", "tag"])
+
+    def test_lookups(self):
+        self.check()
+        self.assertIsInstance(self.db._indices["run"], SortedIndex)
+        self.assertIsInstance(self.db._indices["tag"], HashIndex)
+
+    def test_set(self):
+        self.check()
+        self.db[0].run = 9
+        self.db[1].tag = "z"
+        self.check()
+
+    def test_append(self):
+        self.check()
+        self.db.append(run=0, tag="a")
+        self.db.append(run=3, tag="d")
+        self.check()
+
+    def test_extend(self):
+        self.check()
+        # New values fall between, before and level with the held ones
+        self.db.extend([
+            {"run": 2, "tag": "a"}, {"run": 0, "tag": "d"},
+            {"run": 9, "tag": "b"}])
+        self.check()
+        self.assertEqual(_select(self.db, self.db.run == 2), [3, 5])
+        self.db.extend([{"run": None, "tag": None}, {"run": 11, "tag": "a"}])
+        self.assertEqual(_select(self.db, self.db.run == None), [8])
+        self.assertEqual(_select(self.db, self.db.tag == None), [8])
+        self.assertEqual(self.db._indices["run"].bounds(), None)
+        del self.db[8]
+        self.check()
+        self.assertEqual(self.db._indices["run"].bounds(), (0, 11) )
+
+    def test_extend_unorderable(self):
+        self.check()
+        self.db.extend([{"run": 6, "tag": "a"}, {"run": "x", "tag": "a"}])
+        if PY3:
+            self.assertNotIn("run", self.db._indices)
+        self.assertEqual(_select(self.db, self.db.run == "x"), [6])
+        self.assertEqual(_select(self.db, self.db.tag == "a"), [1, 3, 5, 6])
+
+    def test_delete(self):
+        self.check()
+        del self.db[1]
+        self.check()
+        # Deleting shifts the later rows down, which remaps the indexes
+        self.assertEqual(_select(self.db, self.db.run == 5), [3])
+        self.db.delete_many([0, 2])
+        self.check()
+
+    def test_delete_negative(self):
+        self.check()
+        del self.db[-1]
+        self.assertEqual(len(self.db), 4)
+        self.check()
+        self.assertEqual(_select(self.db, self.db.run == 5), [])
+        self.assertRaises(IndexError, self.db.__delitem__, -5)
+        self.assertRaises(IndexError, self.db.__delitem__, 4)
+
+    def test_delete_row(self):
+        self.check()
+        del self.db[self.db[2]]
+        self.check()
+        self.assertEqual(_select(self.db, self.db.run == 4), [])
+
+    def test_none(self):
+        self.db.append(run=None, tag=None)
+        self.assertEqual(_select(self.db, self.db.run == None), [5])
+        self.assertEqual(_select(self.db, self.db.tag == None), [5])
+        self.assertEqual(_select(self.db, self.db.run > 3), [2, 4])
+        self.db[5].run = 7
+        self.assertEqual(_select(self.db, self.db.run == None), [])
+        self.assertEqual(_select(self.db, self.db.run > 3), [2, 4, 5])
+        self.assertEqual(self.db.run.max(), 7)
+
+    def test_unorderable(self):
+        # Mixed types can't be held in a sorted index in python 3, the column
+        # is scanned
+        self.db.append(run="x", tag="a")
+        self.assertEqual(_select(self.db, self.db.run == "x"), [5])
+        self.assertEqual(_select(self.db, self.db.run == 3), [0])
+        if PY3:
+            self.assertNotIn("run", self.db._indices)
+        # An index that's already built is dropped
+        db = Runs()
+        _fill(db)
+        self.assertEqual(_select(db, db.run == 3), [0])
+        self.assertIn("run", db._indices)
+        db[1].run = "x"
+        if PY3:
+            self.assertNotIn("run", db._indices)
+        self.assertEqual(_select(db, db.run == "x"), [1])
+
+    def test_unhashable(self):
+        self.check()
+        self.db.append(run=6, tag=["a"])
+        self.assertNotIn("tag", self.db._indices)
+        self.assertEqual(_select(self.db, self.db.tag == ["a"]), [5])
+        self.assertEqual(_select(self.db, self.db.tag == "a"), [1, 3])
+
+    def test_abstract(self):
+        self.assertRaises(TypeError, ColumnIndex, Runs.run)
+
+class TestRemap(unittest.TestCase):
+
+    def make_index(self, index_cls, n=10):
+        index = index_cls(Runs.run)
+        for idx in range(n):
+            index.add(idx % 3, idx)
+        return index
+
+    def test_remap_rows(self):
+        self.assertEqual(remap_rows({1: 0, 4: 2}, [4, 3, 1]), [2, 3, 0])
+        self.assertEqual(
+                remap_rows(IndexShift(2, 5, -1), [5, 4, 1, 2]), [5, 3, 1, 1])
+
+    def test_hash(self):
+        index = self.make_index(HashIndex)
+        index.remove(1, 4)
+        index.remap(IndexShift(5, 10, -1) )
+        self.assertEqual(
+                index._rows, {0: {0, 3, 5, 8}, 1: {1, 6}, 2: {2, 4, 7}})
+        self.assertEqual(
+                index._values, dict(enumerate([0, 1, 2, 0, 2, 0, 1, 2, 0]) ))
+
+    def test_hash_small_remap(self):
+        # Only the rows in the remap are touched, including ones moving to the
+        # old index of another
+        index = self.make_index(HashIndex, 20)
+        index.remap({3: 19, 19: 3, 50: 51})
+        self.assertEqual(index._values[3], 1)
+        self.assertEqual(index._values[19], 0)
+        self.assertEqual(sorted(index.lookup("eq", 1) ),
+                         [1, 3, 4, 7, 10, 13, 16])
+        self.assertNotIn(51, index._values)
+        index.remap({})
+        self.assertEqual(len(index._values), 20)
+
+    def test_sorted(self):
+        index = self.make_index(SortedIndex)
+        index.add(None, 10)
+        index.remove(1, 4)
+        index.remap(IndexShift(5, 11, -1) )
+        self.assertEqual(sorted(index.lookup("eq", 0) ), [0, 3, 5, 8])
+        self.assertEqual(sorted(index.lookup("eq", 1) ), [1, 6])
+        self.assertEqual(index.lookup("eq", None), [9])
+        # Nothing moves in an empty remap
+        index.remap(IndexShift(0, 0, -1) )
+        self.assertEqual(sorted(index.lookup("eq", 2) ), [2, 4, 7])
+
+    def test_sorted_add_many(self):
+        index = self.make_index(SortedIndex, 6)
+        index.add_many([1, None, 0, 5], [6, 7, 8, 9])
+        self.assertEqual(index._values, [0, 0, 0, 1, 1, 1, 2, 2, 5])
+        # Rows already held come before new rows with the same value
+        self.assertEqual(index._rows, [0, 3, 8, 1, 4, 6, 2, 5, 9])
+        self.assertEqual(index._none_rows, [7])
+        index.add_many([6, 7], [10, 11])
+        self.assertEqual(index._rows[-3:], [9, 10, 11])
+        index.add_many([None, 3], [12, 13])
+        self.assertEqual(index.lookup("eq", 3), [13])
+        self.assertEqual(index._none_rows, [7, 12])
+
+class TestAssocIndex(unittest.TestCase):
+
+    def test_lookups(self):
+        db = Files()
+        db.add(name="x", size=3)
+        db.add(name="y", size=5)
+        db.add(name="z", size=7)
+        self.assertEqual(
+                sorted(row.name for row in db.select(db.size > 4) ), ["y", "z"])
+        db["y"].size = 1
+        del db["z"]
+        db.add(name="w", size=9)
+        self.assertEqual(
+                sorted(row.name for row in db.select(db.size > 2) ), ["w", "x"])
+
+    def test_add_many(self):
+        db = Files()
+        db.add(name="x", size=3, kind="a")
+        self.assertEqual(
+                [row.name for row in db.select(db.size > 0) ], ["x"])
+        self.assertEqual(
+                [row.name for row in db.select(db.kind == "a") ], ["x"])
+        db.add_many([
+            {"name": "y", "size": 1, "kind": "a"},
+            {"name": "z", "size": 5}])
+        self.assertEqual(
+                [row.name for row in db.order_by("size")], ["y", "x", "z"])
+        self.assertEqual(
+                sorted(row.name for row in db.select(db.kind == "a") ),
+                ["x", "y"])
+        self.assertEqual(
+                [row.name for row in db.select(db.kind == None) ], ["z"])
+
+if __name__ == "__main__":
+    unittest.main()
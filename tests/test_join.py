@@ -0,0 +1,154 @@
+import unittest
+from dbmeta import join as join_module
+from dbmeta.database import SeqDatabase
+from dbmeta.column import ColumnDesc
+from dbmeta.tuple_store import MutableTupleSeqStore
+from .databases import Runs, Files
+
+class Weights(SeqDatabase):
+    run = ColumnDesc(index="hash")
+    name = ColumnDesc(default=None)
+
+    def __init__(self):
+        super(Weights, self).__init__(MutableTupleSeqStore(db=self) )
+
+#: The run of each row in the left database, the right database's are below
+_left_runs = [1, 2, 2, 3, None, 5]
+_right_runs = [2, 1, 2, None, 4]
+
+def _pairs(result):
+    """ The (left, right) store indices of each pair, right is None for an
+        unmatched row
+    """
+    return sorted(
+            (left._index, None if right is None else right._index)
+            for left, right in result)
+
+class TestJoin(unittest.TestCase):
+
+    def setUp(self):
+        self.left = Runs()
+        self.left.extend([
+            {"run": run, "tag": "f{0}".format(i % 3)}
+            for i, run in enumerate(_left_runs)])
+        self.right = Weights()
+        self.right.extend([
+            {"run": run, "name": "n{0}".format(i)}
+            for i, run in enumerate(_right_runs)])
+        self.strategies = []
+        for name in ("_probe", "_probe_right", "_store_finder"):
+            self.spy(name)
+
+    def spy(self, name):
+        """ Record the strategies that the join uses """
+        func = getattr(join_module, name)
+        def wrapper(*args, **kwargs):
+            self.strategies.append(name)
+            return func(*args, **kwargs)
+        setattr(join_module, name, wrapper)
+        self.addCleanup(setattr, join_module, name, func)
+
+    def expected(self, how):
+        pairs = [
+                (lidx, ridx)
+                for lidx, lrun in enumerate(_left_runs)
+                for ridx, rrun in enumerate(_right_runs) if lrun == rrun]
+        if how == "left":
+            matched = set(lidx for lidx, _ in pairs)
+            pairs += [
+                    (lidx, None) for lidx in range(len(_left_runs) )
+                    if lidx not in matched]
+        return sorted(pairs)
+
+    def test_hash_right(self):
+        # The left database is larger, the hash table is built on the right
+        for how in ("inner", "left"):
+            del self.strategies[:]
+            result = self.left.join(
+                    self.right, on=(self.left.run, self.right.run), how=how)
+            self.assertEqual(_pairs(result), self.expected(how) )
+            self.assertEqual(self.strategies, ["_probe"])
+        self.assertEqual(self.right._indices, {})
+
+    def test_hash_left(self):
+        # The left database is smaller, the hash table is built on it
+        self.right.extend([{"run": 8}, {"run": 9}])
+        for how in ("inner", "left"):
+            del self.strategies[:]
+            result = list(self.left.join(self.right, on="run", how=how) )
+            self.assertEqual(_pairs(result), self.expected(how) )
+            self.assertEqual(self.strategies, ["_probe_right"])
+            if how == "left":
+                # Unmatched rows come last
+                self.assertEqual(
+                        [left._index for left, right in result[-2:]], [3, 5])
+
+    def test_index(self):
+        right = self.right
+        self.assertEqual(len(list(right.select(right.run == 2) ) ), 2)
+        self.assertIn("run", right._indices)
+        for how in ("inner", "left"):
+            del self.strategies[:]
+            result = self.left.join(right, on="run", how=how)
+            self.assertEqual(_pairs(result), self.expected(how) )
+            self.assertEqual(self.strategies, ["_probe"])
+
+    def test_order(self):
+        # Probing the right database keeps the order of the left rows
+        result = list(self.left.join(self.right, on="run", how="left") )
+        self.assertEqual(
+                [left._index for left, _ in result], [0, 1, 1, 2, 2, 3, 4, 5])
+        self.assertEqual(result[1][0].run, 2)
+        self.assertEqual(
+                [right.name for _, right in result[1:3]], ["n0", "n2"])
+        self.assertIsNone(result[5][1])
+
+    def test_none_keys(self):
+        # None is joined to None like any other value, whichever way the rows
+        # are found
+        for make_index in (False, True):
+            if make_index:
+                list(self.right.select(self.right.run == None) )
+            pairs = _pairs(self.left.join(self.right, on="run") )
+            self.assertIn( (4, 3), pairs)
+
+    def test_assoc(self):
+        files = Files()
+        files.add_many([
+            {"name": "f0", "size": 1}, {"name": "f1", "size": 2},
+            {"name": "x", "size": 3}])
+        for how in ("inner", "left"):
+            del self.strategies[:]
+            result = list(self.left.join(
+                files, on=(self.left.tag, "name"), how=how) )
+            self.assertEqual(self.strategies, ["_store_finder", "_probe"])
+            self.assertEqual(
+                    [(left._index, right.name) for left, right in result
+                     if right is not None],
+                    [(0, "f0"), (1, "f1"), (3, "f0"), (4, "f1")])
+            self.assertEqual(
+                    [left._index for left, right in result if right is None],
+                    [2, 5] if how == "left" else [])
+        # Values that can't be converted to the key type match nothing
+        files.add(name="3", size=4)
+        self.assertEqual(
+                _pairs(self.left.join(files, on=(self.left.run, "name") ) ),
+                [])
+
+    def test_assoc_left(self):
+        files = Files()
+        files.add_many([
+            {"name": "a", "size": 2}, {"name": "b", "size": 5},
+            {"name": "c", "size": 2}])
+        result = files.join(self.left, on=("size", self.left.run), how="left")
+        self.assertEqual(
+                sorted( (left.name, right and right._index)
+                        for left, right in result),
+                [("a", 1), ("a", 2), ("b", 5), ("c", 1), ("c", 2)])
+
+    def test_bad_how(self):
+        self.assertRaises(
+                ValueError, self.left.join, self.right, on="run", how="outer")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,393 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from dbmeta.database import SeqDatabase
+from dbmeta.column import ColumnDesc
+from dbmeta import json_store
+from dbmeta.json_store import MutableJSONSeqStore
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+def write_opt(value, key, data, store_type):
+    if value is not None:
+        data[key] = value
+
+class Entries(SeqDatabase):
+    name = ColumnDesc()
+    energy = ColumnDesc(write_func=write_opt)
+
+    def __init__(self, db_file, **kwargs):
+        super(Entries, self).__init__(
+                MutableJSONSeqStore(db_file=db_file, db=self, **kwargs) )
+
+class JSONTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        self.dump([{"name": "r{0}".format(i), "energy": i} for i in range(4)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def dump(self, data):
+        with open(self.db_file, 'w') as fp:
+            json.dump(data, fp)
+
+    def load(self):
+        with open(self.db_file, 'r') as fp:
+            return json.load(fp)
+
+class TestCoalesce(JSONTestCase):
+
+    def test_repeated_sets(self):
+        db = Entries(self.db_file)
+        for i in range(100):
+            db[1].name = "n{0}".format(i)
+        self.assertEqual(db._store._pending_patches(), [
+            {"op": "replace", "path": "/1/name", "value": "n99"}])
+        # Repeated changes reuse their positions
+        self.assertEqual(len(db._store._patches), 1)
+
+    def test_separate_cells(self):
+        db = Entries(self.db_file)
+        db[0].name = "a"
+        db[1].energy = 10
+        db[0].name = "b"
+        self.assertEqual(db._store._pending_patches(), [
+            {"op": "replace", "path": "/0/name", "value": "b"},
+            {"op": "replace", "path": "/1/energy", "value": 10}])
+
+    def test_remove_key(self):
+        db = Entries(self.db_file)
+        db[2].energy = None
+        db[2].energy = 5
+        db[2].energy = None
+        self.assertEqual(db._store._pending_patches(), [
+            {"op": "remove", "path": "/2/energy"}])
+
+    def test_set_and_revert(self):
+        db = Entries(self.db_file)
+        db[1].name = "x"
+        db[1].name = "r1"
+        self.assertEqual(db._store._pending_patches(), [
+            {"op": "replace", "path": "/1/name", "value": "r1"}])
+        # Another process changes the same cell
+        data = self.load()
+        data[1]["name"] = "other"
+        self.dump(data)
+        db._store.write()
+        self.assertEqual(self.load()[1]["name"], "r1")
+        self.assertEqual(db[1].name, "r1")
+
+    def test_rollback(self):
+        db = Entries(self.db_file)
+        try:
+            with db.transaction():
+                db[1].name = "x"
+                # Adding a row records the changes made so far
+                db.append(name="new", energy=1)
+                db[1].name = "y"
+                raise KeyError()
+        except KeyError:
+            pass
+        self.assertEqual(db[1].name, "r1")
+        self.assertEqual(db._store._pending_patches(), [])
+
+    def test_unchanged(self):
+        db = Entries(self.db_file)
+        db[1].name = "r1"
+        self.assertEqual(db._store._pending_patches(), [])
+
+    def test_added_row(self):
+        db = Entries(self.db_file)
+        row = db.append(name="new", energy=1)
+        row.name = "newer"
+        row.energy = None
+        self.assertEqual(db._store._pending_patches(), [
+            {"op": "add", "path": "/-", "value": {"name": "newer"}}])
+
+    def test_delete(self):
+        db = Entries(self.db_file)
+        db[3].name = "x"
+        db.append(name="new", energy=1)
+        del db[4]
+        del db[3]
+        # The row that was never written is dropped from the additions
+        patches = db._store._pending_patches()
+        self.assertEqual(patches[-1], {"op": "remove", "path": "/3"})
+        self.assertFalse(any(op["op"] == "add" for op in patches) )
+        db._store.write()
+        self.assertEqual([r["name"] for r in self.load()], ["r0", "r1", "r2"])
+
+class TestJournal(JSONTestCase):
+
+    def setUp(self):
+        super(TestJournal, self).setUp()
+        self.journal_file = self.db_file + ".jsonpatch"
+
+    def open(self, **kwargs):
+        return Entries(self.db_file, journal=True, **kwargs)
+
+    def read_journal(self):
+        with open(self.journal_file, 'r') as fp:
+            return fp.read().splitlines()
+
+    def test_append(self):
+        db = self.open()
+        db[0].name = "a"
+        db._store.write()
+        db[1].energy = 10
+        db.append(name="new", energy=None)
+        db._store.write()
+        # The database file is untouched, the changes are in the journal
+        self.assertEqual([r["name"] for r in self.load()], ["r0", "r1", "r2", "r3"])
+        lines = self.read_journal()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[1]), [
+            {"op": "replace", "path": "/0/name", "value": "a"}])
+        self.assertEqual(db._store._journal_ops, 3)
+
+    def test_replay(self):
+        db = self.open()
+        db[0].name = "a"
+        db.append(name="new", energy=5)
+        db._store.write()
+        del db[2]
+        db._store.write()
+        expected = list(zip(db.name, db.energy) )
+        reopened = self.open()
+        self.assertEqual(list(zip(reopened.name, reopened.energy) ), expected)
+        # A store without a journal doesn't see the changes
+        self.assertEqual(list(Entries(self.db_file).name), ["r0", "r1", "r2", "r3"])
+
+    def test_merge(self):
+        db = self.open(journal_max_ops=2)
+        db[0].name = "a"
+        db._store.write()
+        self.assertTrue(os.path.exists(self.journal_file) )
+        db[1].name = "b"
+        db[2].name = "c"
+        db._store.write()
+        # Past the limit, the journal is merged into the database file
+        self.assertFalse(os.path.exists(self.journal_file) )
+        self.assertEqual(
+                [r["name"] for r in self.load()], ["a", "b", "c", "r3"])
+        self.assertEqual(db._store._journal_ops, 0)
+        db[3].name = "d"
+        db._store.write()
+        self.assertEqual(len(self.read_journal() ), 2)
+        self.assertEqual(list(self.open().name), ["a", "b", "c", "d"])
+
+    def test_interrupted_merge(self):
+        db = self.open(journal_max_ops=1)
+        db[0].name = "a"
+        db._store.write()
+        db[1].name = "b"
+        db[2].name = "c"
+        # Crash after the new database file is written but before it replaces
+        # the old one
+        replace = json_store._replace
+        def crash(src, dst):
+            raise KeyboardInterrupt()
+        json_store._replace = crash
+        try:
+            self.assertRaises(KeyboardInterrupt, db._store.write)
+        finally:
+            json_store._replace = replace
+        self.assertEqual(
+                [r["name"] for r in self.load()], ["r0", "r1", "r2", "r3"])
+        self.assertEqual(
+                [f for f in os.listdir(self.tmp_dir) if f.endswith(".tmp")], [])
+        # Replaying the journal restores everything that was written
+        self.assertEqual(list(self.open().name), ["a", "r1", "r2", "r3"])
+
+    def test_interrupted_journal_removal(self):
+        db = self.open()
+        db[0].name = "a"
+        db._store.write()
+        journal = self.read_journal()
+        # Crash after the merged database file is written but before the
+        # journal is removed
+        data = self.load()
+        data[0]["name"] = "a"
+        self.dump(data)
+        with open(self.journal_file, 'w') as fp:
+            fp.write("\n".join(journal) + "\n")
+        # The journal is for the old database file so it is ignored
+        db = self.open()
+        self.assertEqual(list(db.name), ["a", "r1", "r2", "r3"])
+        self.assertFalse(db._store._journal_ok)
+        db[1].name = "b"
+        db._store.write()
+        self.assertFalse(os.path.exists(self.journal_file) )
+        self.assertEqual(
+                [r["name"] for r in self.load()], ["a", "b", "r2", "r3"])
+
+    def test_truncated_entry(self):
+        db = self.open()
+        db[0].name = "a"
+        db._store.write()
+        # Crash part of the way through appending to the journal
+        with open(self.journal_file, 'a') as fp:
+            fp.write('[{"op": "replace", "path": "/1/na')
+        db = self.open()
+        self.assertEqual(list(db.name), ["a", "r1", "r2", "r3"])
+        # The journal can't be appended to, so the next write merges it
+        db[2].name = "c"
+        db._store.write()
+        self.assertFalse(os.path.exists(self.journal_file) )
+        self.assertEqual(
+                [r["name"] for r in self.load()], ["a", "r1", "c", "r3"])
+
+    def test_update(self):
+        db = self.open()
+        other = self.open()
+        db[0].name = "a"
+        db._store.write()
+        other._store.update()
+        self.assertEqual(other[0].name, "a")
+        other[1].name = "b"
+        other._store.write()
+        db._store.update()
+        self.assertEqual(list(db.name), ["a", "b", "r2", "r3"])
+
+class FailingEncoder(json.JSONEncoder):
+    """ Fails part of the way through writing a document """
+
+    def iterencode(self, o, _one_shot=False):
+        chunks = super(FailingEncoder, self).iterencode(o, _one_shot)
+        for i, chunk in enumerate(chunks):
+            if i == 5:
+                raise ValueError("Failed to write")
+            yield chunk
+
+class TestWrite(JSONTestCase):
+
+    def tmp_files(self):
+        return [f for f in os.listdir(self.tmp_dir) if f.endswith(".tmp")]
+
+    def patch(self, module, name, func):
+        """ Replace a module attribute for the rest of the test """
+        old = getattr(module, name)
+        setattr(module, name, func)
+        self.addCleanup(setattr, module, name, old)
+        return old
+
+    def test_replace(self):
+        db = Entries(self.db_file)
+        db[0].name = "a"
+        calls = []
+        def replace(src, dst):
+            # The new file is complete before it is moved over the old one
+            with open(src, 'r') as fp:
+                calls.append( (src, dst, json.load(fp)[0]["name"]) )
+            self.assertEqual(self.load()[0]["name"], "r0")
+            old_replace(src, dst)
+        old_replace = self.patch(json_store, "_replace", replace)
+        db._store.write()
+        self.assertEqual(len(calls), 1)
+        src, dst, name = calls[0]
+        self.assertEqual(dst, self.db_file)
+        self.assertEqual(os.path.dirname(src), self.tmp_dir)
+        self.assertEqual(name, "a")
+        self.assertEqual(self.load()[0]["name"], "a")
+        self.assertEqual(self.tmp_files(), [])
+
+    def test_failed_dump(self):
+        db = Entries(self.db_file)
+        db[0].name = "a"
+        self.assertRaises(ValueError, db._store.write, cls=FailingEncoder)
+        self.assertEqual(self.tmp_files(), [])
+        self.assertEqual(
+                [r["name"] for r in self.load()], ["r0", "r1", "r2", "r3"])
+
+    @unittest.skipUnless(fcntl, "fcntl is not available")
+    def test_lock_file(self):
+        lock_file = self.db_file + ".lock"
+        db = Entries(self.db_file, lock=False)
+        db[0].name = "b"
+        db._store.write()
+        self.assertFalse(os.path.exists(lock_file) )
+        db = Entries(self.db_file)
+        db[0].name = "a"
+        held = []
+        def replace(src, dst):
+            # Another process can't take the lock while the file is written
+            fd = os.open(lock_file, os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                held.append(False)
+            except (IOError, OSError):
+                held.append(True)
+            finally:
+                os.close(fd)
+            old_replace(src, dst)
+        old_replace = self.patch(json_store, "_replace", replace)
+        db._store.write()
+        self.assertEqual(held, [True])
+        self.assertTrue(os.path.exists(lock_file) )
+        self.assertIsNone(db._store._lock_fd)
+
+    def test_fsync(self):
+        self.assertRaises(ValueError, Entries, self.db_file, fsync="always")
+        synced = []
+        old_fsync = self.patch(
+                os, "fsync", lambda fd: synced.append(fd) or old_fsync(fd) )
+        for policy, n_syncs in (("never", 0), ("data", 1), ("full", 2) ):
+            del synced[:]
+            kwargs = {} if policy == "data" else {"fsync": policy}
+            db = Entries(self.db_file, **kwargs)
+            db[0].name = policy
+            db._store.write()
+            self.assertEqual(len(synced), n_syncs)
+            self.assertEqual(self.load()[0]["name"], policy)
+
+    def test_fsync_journal(self):
+        synced = []
+        old_fsync = self.patch(
+                os, "fsync", lambda fd: synced.append(fd) or old_fsync(fd) )
+        # By default every append to the journal is flushed
+        db = Entries(self.db_file, journal=True)
+        for name in ("a", "b"):
+            db[0].name = name
+            db._store.write()
+        self.assertEqual(len(synced), 2)
+        self.assertTrue(os.path.exists(self.db_file + ".jsonpatch") )
+        del synced[:]
+        db = Entries(self.db_file, journal=True, fsync="never")
+        db[0].name = "c"
+        db._store.write()
+        self.assertEqual(synced, [])
+        self.assertEqual(Entries(self.db_file, journal=True)[0].name, "c")
+
+class TestVerifyHash(JSONTestCase):
+
+    def setUp(self):
+        super(TestVerifyHash, self).setUp()
+        # Leave more than one read's worth after the end of the document
+        with open(self.db_file, 'a') as fp:
+            fp.write("\n" + " " * (1 << 17) + "\n")
+
+    def test_touched(self):
+        db = Entries(self.db_file, verify_hash=True)
+        st = os.stat(self.db_file)
+        os.utime(self.db_file, (st.st_atime, st.st_mtime + 10) )
+        self.assertTrue(db._store._file_unchanged() )
+
+    def test_trailing_change(self):
+        db = Entries(self.db_file, verify_hash=True)
+        st = os.stat(self.db_file)
+        with open(self.db_file, 'rb+') as fp:
+            fp.seek(-2, os.SEEK_END)
+            fp.write(b"\t\n")
+        # Hide the change from the file's metadata
+        os.utime(self.db_file, (st.st_atime, st.st_mtime) )
+        self.assertFalse(db._store._file_unchanged() )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+import io
+import json
+from future.utils import text_type
+from dbmeta.json_stream import iter_json_array, iter_json_object, iter_json_rows
+
+#: Chunk sizes to read with, the small ones split values across chunks
+_chunk_sizes = (1, 2, 3, 7, 64, 1 << 16)
+
+_arrays = [
+        '[]',
+        ' [ ] ',
+        '[1]',
+        '[12345, -0.5, 1e10, 6.02E-23, 0, -7]',
+        '[true, false, null, "null"]',
+        '["a\\"b", "back\\\\slash", "line\\nbreak\\ttab", "\\/", "\\b\\f\\r"]',
+        '["\\u00e9t\\u00e9", "\\ud83d\\ude00", "\\u0000"]',
+        '["été", "日本語", "😀"]',
+        '["[not, an array]", "{\\"not\\": an object}", ",]}:"]',
+        '[[1, [2, [3, []]]], {"a": {"b": [{"c": null}]}}, {}]',
+        '[{"name": "r0", "tags": ["x", "y"], "energy": 1.5},\n'
+        ' {"name": "r1", "tags": [], "energy": null}]',
+        '[\n  1 ,\n\t2\r\n,3 ]',
+        ]
+
+_objects = [
+        '{}',
+        '{"a": 1}',
+        '{"k1": {"name": "r0", "v": [1, 2]}, "k2": {"name": "r1", "v": []}}',
+        '{"\\"quoted\\"": "x", "é": "y", "\\u00e9\\n": [true, null]}',
+        '{ "a" : 1 , "b" :\n{"c": {"d": "}"}} }',
+        '{"dup": 1, "dup": 2}',
+        ]
+
+def _read(func, text, chunk_size):
+    return list(func(io.StringIO(text_type(text) ), chunk_size) )
+
+class _Pairs(list):
+    """ The (key, value) pairs of a decoded object """
+
+def _object_pairs(text):
+    """ Decode the pairs of the object at the top of a document with json.loads,
+        keeping any repeated keys
+    """
+    def as_dicts(value):
+        if isinstance(value, _Pairs):
+            return {k: as_dicts(v) for k, v in value}
+        elif isinstance(value, list):
+            return [as_dicts(v) for v in value]
+        return value
+    return [(k, as_dicts(v) ) for k, v in json.loads(
+        text, object_pairs_hook=_Pairs)]
+
+class TestJSONStream(unittest.TestCase):
+
+    def test_arrays(self):
+        for text in _arrays:
+            expected = json.loads(text)
+            for chunk_size in _chunk_sizes:
+                self.assertEqual(
+                        _read(iter_json_array, text, chunk_size), expected,
+                        (text, chunk_size) )
+                self.assertEqual(
+                        _read(iter_json_rows, text, chunk_size), expected,
+                        (text, chunk_size) )
+
+    def test_objects(self):
+        for text in _objects:
+            expected = _object_pairs(text)
+            for chunk_size in _chunk_sizes:
+                self.assertEqual(
+                        _read(iter_json_object, text, chunk_size), expected,
+                        (text, chunk_size) )
+                self.assertEqual(
+                        _read(iter_json_rows, text, chunk_size), expected,
+                        (text, chunk_size) )
+
+    def test_large_value(self):
+        # A value much larger than a chunk
+        text = json.dumps([{"data": "x" * 5000, "n": list(range(1000) )}, 1])
+        self.assertEqual(_read(iter_json_array, text, 16), json.loads(text) )
+
+    def test_numbers_at_chunk_ends(self):
+        # A number cut short by the end of a chunk still decodes, so must not
+        # be taken as complete
+        values = [123456789, -98765.4321, 1.5e-300, 10 ** 20]
+        text = json.dumps(values)
+        for chunk_size in range(1, len(text) + 1):
+            self.assertEqual(_read(iter_json_array, text, chunk_size), values)
+
+    def test_truncated(self):
+        for text in _arrays[2:] + _objects[1:]:
+            func = iter_json_array if text.startswith("[") else iter_json_object
+            for end in range(len(text.rstrip() ) ):
+                for chunk_size in (1, 5, 1 << 16):
+                    self.assertRaises(
+                            ValueError, _read, func, text[:end], chunk_size)
+                    self.assertRaises(
+                            ValueError, _read, iter_json_rows, text[:end],
+                            chunk_size)
+
+    def test_invalid(self):
+        for text in ('{"a": 1}', '"a"', '1', ''):
+            self.assertRaises(ValueError, _read, iter_json_array, text, 4)
+        for text in ('[1]', '{1: 2}', '{"a" 1}', '{"a": 1 "b": 2}'):
+            self.assertRaises(ValueError, _read, iter_json_object, text, 4)
+        for text in ('"a"', '1', 'null', ''):
+            self.assertRaises(ValueError, _read, iter_json_rows, text, 4)
+        self.assertRaises(ValueError, _read, iter_json_array, '[1 2]', 4)
+        self.assertRaises(ValueError, _read, iter_json_array, '[1,]', 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+import unittest
+import threading
+import time
+from dbmeta.database import SeqDatabase
+from dbmeta.column import ColumnDesc
+from dbmeta.locking import RWLock, thread_safe
+from dbmeta.tuple_store import MutableTupleSeqStore
+
+#: How long to wait for something that should happen
+_timeout = 5
+#: How long to wait for something that shouldn't happen
+_pause = 0.1
+
+class _Holder(threading.Thread):
+    """ Thread that takes a lock, holds it until told to release it and then
+        releases it
+    """
+
+    def __init__(self, acquire, release, order=None, name=None):
+        super(_Holder, self).__init__()
+        self.daemon = True
+        self._acquire = acquire
+        self._release = release
+        self._order = order
+        self._name = name
+        self.acquired = threading.Event()
+        self.finish = threading.Event()
+
+    def run(self):
+        self._acquire()
+        if self._order is not None:
+            self._order.append(self._name)
+        self.acquired.set()
+        self.finish.wait(_timeout)
+        self._release()
+
+    def stop(self):
+        self.finish.set()
+        self.join(_timeout)
+
+def _reader(lock, **kwargs):
+    holder = _Holder(lock.acquire_read, lock.release_read, **kwargs)
+    holder.start()
+    return holder
+
+def _writer(lock, **kwargs):
+    holder = _Holder(lock.acquire_write, lock.release_write, **kwargs)
+    holder.start()
+    return holder
+
+def _wait_for(condition):
+    """ Wait until a condition is True """
+    end = time.time() + _timeout
+    while not condition():
+        if time.time() > end:
+            raise AssertionError("Timed out")
+        time.sleep(0.001)
+
+class TestRWLock(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = RWLock()
+        self.holders = []
+
+    def tearDown(self):
+        for holder in self.holders:
+            holder.stop()
+
+    def reader(self, **kwargs):
+        holder = _reader(self.lock, **kwargs)
+        self.holders.append(holder)
+        return holder
+
+    def writer(self, **kwargs):
+        holder = _writer(self.lock, **kwargs)
+        self.holders.append(holder)
+        return holder
+
+    def test_shared_readers(self):
+        r1 = self.reader()
+        r2 = self.reader()
+        self.assertTrue(r1.acquired.wait(_timeout) )
+        self.assertTrue(r2.acquired.wait(_timeout) )
+
+    def test_writer_excludes_readers(self):
+        w = self.writer()
+        self.assertTrue(w.acquired.wait(_timeout) )
+        r = self.reader()
+        self.assertFalse(r.acquired.wait(_pause) )
+        w.stop()
+        self.assertTrue(r.acquired.wait(_timeout) )
+
+    def test_readers_exclude_writer(self):
+        r1 = self.reader()
+        r2 = self.reader()
+        self.assertTrue(r1.acquired.wait(_timeout) )
+        self.assertTrue(r2.acquired.wait(_timeout) )
+        w = self.writer()
+        self.assertFalse(w.acquired.wait(_pause) )
+        r1.stop()
+        self.assertFalse(w.acquired.wait(_pause) )
+        r2.stop()
+        self.assertTrue(w.acquired.wait(_timeout) )
+
+    def test_writers_exclusive(self):
+        w1 = self.writer()
+        self.assertTrue(w1.acquired.wait(_timeout) )
+        w2 = self.writer()
+        self.assertFalse(w2.acquired.wait(_pause) )
+        w1.stop()
+        self.assertTrue(w2.acquired.wait(_timeout) )
+
+    def test_writer_preference(self):
+        order = []
+        r1 = self.reader(order=order, name="r1")
+        self.assertTrue(r1.acquired.wait(_timeout) )
+        w = self.writer(order=order, name="w")
+        _wait_for(lambda: self.lock._waiting_writers == 1)
+        # A new reader waits behind the waiting writer
+        r2 = self.reader(order=order, name="r2")
+        self.assertFalse(r2.acquired.wait(_pause) )
+        r1.stop()
+        self.assertTrue(w.acquired.wait(_timeout) )
+        self.assertFalse(r2.acquired.wait(_pause) )
+        w.stop()
+        self.assertTrue(r2.acquired.wait(_timeout) )
+        self.assertEqual(order, ["r1", "w", "r2"])
+
+    def test_reentrant_read_with_waiting_writer(self):
+        # A thread already reading can read again even though a writer is
+        # waiting, otherwise it would deadlock
+        lock = self.lock
+        lock.acquire_read()
+        try:
+            w = self.writer()
+            _wait_for(lambda: lock._waiting_writers == 1)
+            lock.acquire_read()
+            lock.release_read()
+            self.assertFalse(w.acquired.wait(_pause) )
+        finally:
+            lock.release_read()
+        self.assertTrue(w.acquired.wait(_timeout) )
+
+    def test_reentrant(self):
+        lock = self.lock
+        with lock.writing():
+            with lock.writing():
+                with lock.reading():
+                    pass
+            # Still held after the inner ones are released
+            r = self.reader()
+            self.assertFalse(r.acquired.wait(_pause) )
+        self.assertTrue(r.acquired.wait(_timeout) )
+        r.stop()
+        with lock.reading():
+            with lock.reading():
+                pass
+            w = self.writer()
+            self.assertFalse(w.acquired.wait(_pause) )
+        self.assertTrue(w.acquired.wait(_timeout) )
+
+    def test_upgrade(self):
+        with self.lock.reading():
+            self.assertRaises(RuntimeError, self.lock.acquire_write)
+        # The failed attempt leaves the lock usable
+        with self.lock.writing():
+            pass
+
+    def test_release_unheld(self):
+        self.assertRaises(RuntimeError, self.lock.release_write)
+        w = self.writer()
+        self.assertTrue(w.acquired.wait(_timeout) )
+        self.assertRaises(RuntimeError, self.lock.release_write)
+
+class Counts(SeqDatabase):
+    n = ColumnDesc()
+    m = ColumnDesc()
+
+    def __init__(self):
+        super(Counts, self).__init__(
+                thread_safe(MutableTupleSeqStore)(db=self) )
+
+def _run_threads(target, n_threads=8):
+    threads = [threading.Thread(target=target) for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(_timeout * 4)
+
+class TestThreadSafe(unittest.TestCase):
+
+    def test_class(self):
+        cls = thread_safe(MutableTupleSeqStore)
+        self.assertTrue(issubclass(cls, MutableTupleSeqStore) )
+        self.assertIs(thread_safe(MutableTupleSeqStore), cls)
+        self.assertIs(thread_safe(cls), cls)
+        self.assertIsInstance(Counts()._store._lock, RWLock)
+        self.assertIsNone(MutableTupleSeqStore(db=None)._lock)
+
+    def test_appends(self):
+        db = Counts()
+        def append():
+            for i in range(200):
+                db.append(n=i, m=0)
+        _run_threads(append)
+        self.assertEqual(len(db), 1600)
+        self.assertEqual(sorted(db.n), sorted(list(range(200) ) * 8) )
+
+    def test_locked(self):
+        db = Counts()
+        db.append(n=0, m=0)
+        def increment():
+            for _ in range(200):
+                with db.locked():
+                    row = db[0]
+                    row.n += 1
+                    row.m -= 1
+        _run_threads(increment)
+        self.assertEqual( (db[0].n, db[0].m), (1600, -1600) )
+
+    def test_snapshot(self):
+        db = Counts()
+        db.extend([{"n": i, "m": i} for i in range(100)])
+        values = db._store.iter_column(0)
+        column = db._store.column_values(0)
+        db.extend([{"n": i, "m": i} for i in range(100)])
+        # Iterators and columns handed out earlier don't see the changes
+        self.assertEqual(list(values), list(range(100) ) )
+        self.assertEqual(list(column), list(range(100) ) )
+
+    def test_readers_and_writers(self):
+        db = Counts()
+        db.extend([{"n": 0, "m": 0} for _ in range(10)])
+        errors = []
+        def write():
+            for _ in range(50):
+                with db.locked():
+                    for row in db:
+                        row.n += 1
+                        row.m -= 1
+        def read():
+            for _ in range(50):
+                with db.locked():
+                    pairs = [(row.n, row.m) for row in db]
+                if any(n != -m for n, m in pairs):
+                    errors.append(pairs)
+        threads = [threading.Thread(target=write) for _ in range(2)]
+        threads += [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(_timeout * 4)
+        self.assertEqual(errors, [])
+        self.assertEqual(list(db.n), [100] * 10)
+
+if __name__ == "__main__":
+    unittest.main()
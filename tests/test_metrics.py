@@ -0,0 +1,218 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from dbmeta.metrics import Metrics, instrumented
+from dbmeta.json_store import MutableJSONSeqStore
+from dbmeta.tuple_store import MutableTupleSeqStore, MutableTupleAssocStore
+from .databases import Runs, Files
+
+class Sink(object):
+    """ Records everything reported to it """
+
+    def __init__(self):
+        self.reported = []
+
+    def __call__(self, kind, name, value):
+        self.reported.append( (kind, name, value) )
+
+    def counted(self, name):
+        return sum(
+                v for k, n, v in self.reported if (k, n) == ("counter", name) )
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counters(self):
+        metrics = Metrics()
+        metrics.count("a")
+        metrics.count("a", 3)
+        metrics.count("b", 2)
+        self.assertEqual(metrics.snapshot()["counters"], {"a": 4, "b": 2})
+
+    def test_timers(self):
+        metrics = Metrics()
+        metrics.record("t", 2.)
+        metrics.record("t", 1.)
+        with metrics.timer("u"):
+            pass
+        # Times are recorded even if an exception is raised
+        with self.assertRaises(KeyError):
+            with metrics.timer("u"):
+                raise KeyError()
+        timers = metrics.snapshot()["timers"]
+        self.assertEqual(timers["t"], {"count": 2, "total": 3., "max": 2.})
+        self.assertEqual(timers["u"]["count"], 2)
+        self.assertGreaterEqual(timers["u"]["max"], 0)
+        # The snapshot is a copy
+        metrics.record("t", 1.)
+        self.assertEqual(timers["t"]["count"], 2)
+
+    def test_sinks(self):
+        sink = Sink()
+        other = Sink()
+        metrics = Metrics(sinks=[sink])
+        metrics.count("a", 2)
+        metrics.add_sink(other)
+        metrics.record("t", 0.5)
+        metrics.remove_sink(sink)
+        metrics.count("b")
+        self.assertEqual(
+                sink.reported, [("counter", "a", 2), ("timer", "t", 0.5)])
+        self.assertEqual(
+                other.reported, [("timer", "t", 0.5), ("counter", "b", 1)])
+
+    def test_reset(self):
+        metrics = Metrics()
+        metrics.count("a")
+        metrics.record("t", 1.)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {"counters": {}, "timers": {}})
+        metrics.count("a")
+        self.assertEqual(metrics.snapshot()["counters"], {"a": 1})
+
+class TestInstrumented(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = Sink()
+        self.metrics = Metrics(sinks=[self.sink])
+        self.db = Runs(lambda db: instrumented(MutableTupleSeqStore)(
+            db=db, metrics=self.metrics) )
+        self.db.extend([
+            {"run": i, "energy": 10 * i, "tag": "t{0}".format(i % 2)}
+            for i in range(5)])
+
+    def counters(self):
+        return self.db.stats()["counters"]
+
+    def test_class(self):
+        cls = instrumented(MutableTupleSeqStore)
+        self.assertIs(instrumented(MutableTupleSeqStore), cls)
+        self.assertIs(instrumented(cls), cls)
+        self.assertTrue(issubclass(cls, MutableTupleSeqStore) )
+        self.assertIs(self.db._store._metrics, self.metrics)
+        # A store made without metrics gets its own
+        self.assertIsInstance(cls(db=Runs() )._metrics, Metrics)
+
+    def test_counters(self):
+        db = self.db
+        self.assertEqual(self.counters()["rows_added"], 5)
+        self.metrics.reset()
+        row = db[1]
+        self.assertEqual(row.energy, 10)
+        self.assertEqual(row.run, 1)
+        self.assertEqual(self.counters()["rows_built"], 1)
+        self.assertEqual(self.counters()["cell_reads"], 2)
+        row.energy = 5
+        db.append(run=5, tag="t0")
+        del db[0]
+        db.delete_many([0, 1])
+        counters = self.counters()
+        self.assertEqual(counters["cell_writes"], 1)
+        self.assertEqual(counters["rows_added"], 1)
+        self.assertEqual(counters["rows_deleted"], 3)
+        # Everything counted is passed to the sink
+        self.assertEqual(self.sink.counted("rows_deleted"), 3)
+
+    def test_rows_built(self):
+        db = self.db
+        self.metrics.reset()
+        self.assertEqual(len(list(db.select(db.energy > 15) ) ), 3)
+        counters = self.counters()
+        self.assertEqual(counters["rows_built"], 3)
+        self.assertEqual(counters["selects"], 1)
+        # Iterating over a column neither makes rows nor reads single cells
+        self.assertEqual(sum(db.energy), 100)
+        self.assertEqual(self.counters()["rows_built"], 3)
+        self.assertNotIn("cell_reads", self.counters() )
+
+    def test_index_build(self):
+        db = self.db
+        list(db.select(db.tag == "t0") )
+        list(db.select(db.tag == "t1") )
+        self.assertEqual(self.db.stats()["timers"]["index_build"]["count"], 1)
+        self.assertEqual(self.db.stats()["gauges"]["indices"], ["tag"])
+
+    def test_transactions(self):
+        db = self.db
+        with db.transaction():
+            db[0].energy = 1
+        with self.assertRaises(ValueError):
+            with db.transaction():
+                db[0].energy = 2
+                raise ValueError()
+        counters = self.counters()
+        self.assertEqual(counters["transactions"], 2)
+        self.assertEqual(counters["rollbacks"], 1)
+        self.assertEqual(db[0].energy, 1)
+
+    def test_gauges(self):
+        db = self.db
+        rows = list(db)
+        gauges = db.stats()["gauges"]
+        self.assertEqual(gauges["rows"], 5)
+        self.assertEqual(gauges["live_rows"], len(rows) )
+
+    def test_assoc(self):
+        db = Files(lambda db: instrumented(MutableTupleAssocStore)(db=db) )
+        db.add(name="a", size=1)
+        db.add_many([{"name": "b", "size": 2}, {"name": "c", "size": 3}])
+        del db["a"]
+        counters = db.stats()["counters"]
+        self.assertEqual(counters["rows_added"], 3)
+        self.assertEqual(counters["rows_deleted"], 1)
+
+class TestUninstrumented(unittest.TestCase):
+
+    def test_nothing_recorded(self):
+        db = Runs()
+        db.extend([{"run": i, "tag": "t"} for i in range(3)])
+        self.assertIsNone(db._store._metrics)
+        db[0].energy = 1
+        list(db.select(db.tag == "t") )
+        stats = db.stats()
+        self.assertEqual(stats["counters"], {})
+        self.assertEqual(stats["timers"], {})
+        self.assertEqual(stats["gauges"]["rows"], 3)
+        self.assertEqual(stats["gauges"]["indices"], ["tag"])
+
+class TestJSON(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        with open(self.db_file, 'w') as fp:
+            json.dump(
+                    [{"run": i, "energy": i, "tag": "t"} for i in range(4)], fp)
+        self.metrics = Metrics()
+        self.db = Runs(lambda db: instrumented(MutableJSONSeqStore)(
+            db=db, db_file=self.db_file, metrics=self.metrics) )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load(self):
+        stats = self.db.stats()
+        self.assertEqual(
+                stats["counters"]["bytes_read"],
+                os.path.getsize(self.db_file) )
+        self.assertEqual(stats["timers"]["load"]["count"], 1)
+        self.assertEqual(stats["gauges"]["pending_patches"], 0)
+
+    def test_write(self):
+        db = self.db
+        db[0].energy = 5
+        db.append(run=4, tag="u")
+        stats = db.stats()
+        self.assertEqual(stats["counters"]["patches_queued"], 2)
+        self.assertEqual(stats["gauges"]["pending_patches"], 2)
+        db._store.write()
+        stats = db.stats()
+        self.assertEqual(
+                stats["counters"]["bytes_written"],
+                os.path.getsize(self.db_file) )
+        self.assertEqual(stats["timers"]["write"]["count"], 1)
+        self.assertEqual(stats["gauges"]["pending_patches"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+import os
+import shutil
+import tempfile
+from dbmeta.database import SeqDatabase
+from dbmeta.column import ColumnDesc
+from dbmeta.tuple_store import MutableTupleSeqStore
+from dbmeta.mmap_store import write_mmap, MmapStore, MmapSeqStore, MmapAssocStore
+from .databases import Files
+
+class Kinds(SeqDatabase):
+    i = ColumnDesc()
+    x = ColumnDesc()
+    b = ColumnDesc()
+    s = ColumnDesc()
+    y = ColumnDesc()
+    j = ColumnDesc()
+
+    def __init__(self, make_store=None):
+        super(Kinds, self).__init__(
+                MutableTupleSeqStore(db=self) if make_store is None
+                else make_store(self) )
+
+#: The names of the columns of Kinds
+_columns = ["i", "x", "b", "s", "y", "j"]
+
+def _row(k):
+    return {
+            "i": k - 20,
+            "x": k * 0.5,
+            "b": k % 2 == 0,
+            "s": "né{0}".format(k),
+            "y": b"\x00\xff" * (k % 3),
+            "j": [k, {"a": k}] if k % 3 else 2.5}
+
+class MmapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.bin")
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def open(self, db_cls, store_cls):
+        def make_store(db):
+            store = store_cls(db_file=self.db_file, db=db)
+            self.stores.append(store)
+            return store
+        return db_cls(make_store)
+
+class TestMmapSeq(MmapTestCase):
+
+    def round_trip(self, rows):
+        src = Kinds()
+        src.extend(rows)
+        write_mmap(self.db_file, src._store)
+        db = self.open(Kinds, MmapSeqStore)
+        self.assertEqual(len(db), len(src) )
+        for column in src._store._columns:
+            c = column.name
+            expected = list(getattr(src, c) )
+            self.assertEqual(list(getattr(db, c) ), expected, c)
+            self.assertEqual(
+                    list(db._store.column_values(column.index) ), expected, c)
+            self.assertEqual([getattr(row, c) for row in db], expected, c)
+        return db
+
+    def test_kinds(self):
+        self.round_trip([_row(k) for k in range(50)])
+
+    def test_nulls(self):
+        rows = [_row(k) for k in range(30)]
+        for k, row in enumerate(rows):
+            for idx, c in enumerate(_columns):
+                if (k + idx) % 4 == 0:
+                    row[c] = None
+        self.round_trip(rows)
+
+    def test_all_null(self):
+        self.round_trip([{c: None for c in _columns} for _ in range(3)])
+
+    def test_empty(self):
+        db = self.round_trip([])
+        self.assertEqual(list(db), [])
+
+    def test_extreme_values(self):
+        rows = [_row(k) for k in range(3)]
+        rows[0]["i"] = -(1 << 63)
+        rows[1]["i"] = (1 << 63) - 1
+        # Too large for the int layout, so held as JSON
+        rows[2]["x"] = 1 << 70
+        self.round_trip(rows)
+
+    def test_tuple_values(self):
+        src = Kinds()
+        src.extend([_row(k) for k in range(3)])
+        for row, value in zip(src, [(1, (2, "x") ), None, {"a": (3,)}]):
+            row.j = value
+        write_mmap(self.db_file, src._store)
+        db = self.open(Kinds, MmapSeqStore)
+        self.assertEqual(list(db.j), [(1, (2, "x") ), None, {"a": (3,)}])
+        # Lists are kept as lists if the column holds any
+        src[1].j = [4]
+        write_mmap(self.db_file, src._store)
+        db = self.open(Kinds, MmapSeqStore)
+        self.assertEqual(list(db.j), [[1, [2, "x"]], [4], {"a": [3]}])
+
+    def test_lookups(self):
+        db = self.round_trip([_row(k) for k in range(10)])
+        self.assertEqual(db[-1].i, -11)
+        self.assertEqual(db[3].s, "né3")
+        self.assertEqual([row.i for row in db.select(db.x > 3)], [-13, -12, -11])
+        self.assertRaises(IndexError, db._store.__getitem__, (10, 0) )
+
+    def test_close(self):
+        db = self.round_trip([_row(k) for k in range(10)])
+        values = db._store.column_values(Kinds.i.index)
+        it = iter(db._store.iter_column(Kinds.x.index) )
+        next(it)
+        # Values already read don't hold on to the mapping
+        store = self.stores.pop()
+        store.close()
+        self.assertEqual(list(values), list(range(-20, -10) ) )
+
+    def test_immutable(self):
+        db = self.round_trip([_row(k) for k in range(3)])
+        self.assertFalse(db._store.is_mutable)
+        with self.assertRaises(ValueError):
+            db[0].i = 3
+
+    def test_bad_file(self):
+        with open(self.db_file, 'wb') as fp:
+            fp.write(b"not a database file")
+        self.assertRaises(ValueError, Kinds, lambda db: MmapSeqStore(
+            db_file=self.db_file, db=db) )
+
+    def test_abstract(self):
+        class NoPosition(MmapStore):
+            pass
+        write_mmap(self.db_file, Kinds()._store)
+        self.assertRaises(
+                TypeError, NoPosition, db_file=self.db_file, db=Kinds() )
+
+class TestMmapAssoc(MmapTestCase):
+
+    def round_trip(self, rows):
+        src = Files()
+        src.add_many(rows)
+        write_mmap(self.db_file, src._store)
+        db = self.open(Files, MmapAssocStore)
+        self.assertEqual(sorted(db, key=repr), sorted(src, key=repr) )
+        for name in src:
+            self.assertIn(name, db)
+            self.assertEqual(db[name].size, src[name].size)
+        return db
+
+    def test_sorted(self):
+        db = self.round_trip(
+                [{"name": "f{0:03}".format(k), "size": k} for k in range(40, 0, -1)])
+        self.assertTrue(db._store._sorted)
+        self.assertNotIn("f000", db)
+        self.assertNotIn(3, db)
+        self.assertRaises(KeyError, db._store.__getitem__, ("zz", 0) )
+
+    def test_unsortable(self):
+        db = self.round_trip([
+            {"name": 1, "size": 1}, {"name": "x", "size": None},
+            {"name": 2.5, "size": 3}])
+        self.assertEqual(db["x"].size, None)
+        self.assertNotIn("y", db)
+
+    def test_tuple_keys(self):
+        db = self.round_trip([
+            {"name": (1, "a"), "size": 1}, {"name": ("b",), "size": 2},
+            {"name": 2, "size": 3}])
+        self.assertFalse(db._store._sorted)
+        self.assertIn( (1, "a"), db)
+        self.assertEqual(db[("b",)].size, 2)
+        self.assertNotIn( (1, "b"), db)
+        self.assertNotIn([1, "a"], db)
+        # Keys that can be sorted are searched for in the file
+        db = self.round_trip([
+            {"name": (k % 3, "f{0}".format(k) ), "size": k} for k in range(9)])
+        self.assertTrue(db._store._sorted)
+        self.assertEqual(db[(2, "f5")].size, 5)
+        self.assertNotIn( (2, "f4"), db)
+        self.assertNotIn(3, db)
+
+    def test_sequential_file(self):
+        src = Kinds()
+        src.extend([_row(k) for k in range(3)])
+        write_mmap(self.db_file, src._store)
+        self.assertRaises(ValueError, Files, lambda db: MmapAssocStore(
+            db_file=self.db_file, db=db) )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from dbmeta.coll_monad import CollMonad, ItrMonad, TupleMonad
+from dbmeta.parallel import select_positions, apply_chunks
+from dbmeta.query import predicate_source
+from .databases import Runs, Files
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = ThreadPoolExecutor = None
+
+def scale(x, factor=1):
+    return x * factor
+
+@unittest.skipUnless(ThreadPoolExecutor, "concurrent.futures is not available")
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Runs()
+        self.db.extend([
+            {"run": i, "energy": (7 * i) % 10, "tag": "t{0}".format(i % 3)}
+            for i in range(10)])
+        self.executor = ThreadPoolExecutor(max_workers=3)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def serial(self, expr):
+        return [row.run for row in self.db.select(expr)]
+
+    def test_select_positions(self):
+        db = self.db
+        expr = (db.energy > 3) & (db.tag != "t1")
+        source, constants, columns = predicate_source(expr)
+        expected = self.serial(expr)
+        # Including chunk sizes that don't divide the number of rows
+        for chunk_size in (None, 1, 3, 4, 10, 25):
+            self.assertEqual(
+                    select_positions(
+                        db, source, constants, columns, self.executor,
+                        chunk_size),
+                    expected)
+
+    def test_constant(self):
+        for value, expected in ( (True, list(range(10) ) ), (False, []) ):
+            self.assertEqual(
+                    select_positions(
+                        self.db, "lambda : c0", [value], [], self.executor),
+                    expected)
+
+    def test_select(self):
+        db = self.db
+        expr = db.energy >= 5
+        rows = list(db.select(expr, executor=self.executor) )
+        self.assertEqual([row.run for row in rows], self.serial(expr) )
+        self.assertEqual([row._index for row in rows], self.serial(expr) )
+        # Terms resolved through an index are not sent to the executor
+        self.assertEqual(
+                [row.run for row in db.select(
+                    (db.run < 5) & (db.energy > 3), executor=self.executor)],
+                self.serial( (db.run < 5) & (db.energy > 3) ) )
+
+    def test_select_assoc(self):
+        db = Files()
+        db.add_many([
+            {"name": "f{0}".format(i), "size": i % 4} for i in range(9)])
+        # Not resolved through the index on size
+        expr = db.size != 2
+        self.assertEqual(
+                [row.name for row in db.select(expr, executor=self.executor)],
+                [row.name for row in db.select(expr)])
+
+    def test_apply_chunks(self):
+        args = [(i, {"factor": 2}) for i in range(10)]
+        for chunk_size in (None, 1, 3, 20):
+            self.assertEqual(
+                    apply_chunks(scale, args, self.executor, chunk_size),
+                    [2 * i for i in range(10)])
+        self.assertEqual(apply_chunks(scale, [], self.executor), [])
+
+    def test_apply_parallel(self):
+        values = TupleMonad(range(10) )
+        result = TupleMonad.apply_parallel(
+                scale, values, factor=3, executor=self.executor, chunk_size=4)
+        self.assertIsInstance(result, TupleMonad)
+        self.assertEqual(list(result), [3 * i for i in range(10)])
+        result = ItrMonad.apply_parallel(
+                scale, values, values, executor=self.executor)
+        self.assertEqual(list(result), [i * i for i in range(10)])
+        self.assertRaises(
+                ValueError, CollMonad.apply_parallel, scale, 1,
+                executor=self.executor)
+
+    def test_processes(self):
+        db = self.db
+        expr = (db.energy > 3) | (db.tag == "t1")
+        self.assertEqual(
+                [row.run for row in db.select(expr, workers=2)],
+                self.serial(expr) )
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            self.assertEqual(
+                    list(ItrMonad.apply_parallel(
+                        scale, db.energy, factor=2, executor=pool) ),
+                    [2 * e for e in db.energy])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from dbmeta.coll_monad import CollMonad
+from dbmeta.query import (
+        Comparison, And, Or, Not, compile_predicate)
+from .databases import Runs
+
+def _source(expr):
+    """ The source, constants and columns of an expression's predicate """
+    columns = []
+    constants = []
+    return expr.source(columns, constants), constants, columns
+
+class Threshold(object):
+    """ Value with no literal in python source """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value < other
+
+    def __gt__(self, other):
+        return self.value > other
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Runs()
+        for i in range(9):
+            self.db.append(run=i, tag="t{0}".format(i % 3) )
+
+    def test_comparison(self):
+        db = self.db
+        expr = db.run >= 4
+        self.assertIsInstance(expr, Comparison)
+        self.assertEqual(expr.op, "ge")
+        self.assertEqual(expr.value, 4)
+        self.assertIs(expr.column, Runs.run)
+        self.assertEqual(list(expr), [r >= 4 for r in range(9)])
+        self.assertEqual(list(db.run != 4), [r != 4 for r in range(9)])
+        self.assertEqual(
+                list(CollMonad.in_(db.tag, ["t0", "t2"]) ),
+                [r % 3 != 1 for r in range(9)])
+
+    def test_combine(self):
+        db = self.db
+        expr = (db.run > 2) & (db.tag == "t1") & (db.run < 8)
+        self.assertIsInstance(expr, And)
+        # Nested nodes of the same type are flattened
+        self.assertEqual(len(expr.terms), 3)
+        self.assertEqual(list(expr), [r in (4, 7) for r in range(9)])
+        expr = (db.run < 1) | (db.run > 7) | (db.tag == "t1")
+        self.assertIsInstance(expr, Or)
+        self.assertEqual(len(expr.terms), 3)
+        self.assertEqual(
+                list(expr), [r in (0, 1, 4, 7, 8) for r in range(9)])
+        expr = CollMonad.or_(db.run == 0, (db.run == 1) & (db.tag == "t1") )
+        self.assertIsInstance(expr, Or)
+        self.assertEqual(list(expr), [r < 2 for r in range(9)])
+
+    def test_not(self):
+        db = self.db
+        expr = ~( (db.run < 3) | (db.tag == "t0") )
+        self.assertIsInstance(expr, Not)
+        self.assertIsInstance(expr.term, Or)
+        self.assertEqual(list(expr), [r in (4, 5, 7, 8) for r in range(9)])
+        self.assertEqual(
+                sorted(row.run for row in db.select(expr) ), [4, 5, 7, 8])
+        self.assertEqual(list(~~(db.run == 3) ), [r == 3 for r in range(9)])
+
+    def test_rank(self):
+        db = self.db
+        expr = (db.run != 3) & (db.run > 1) & CollMonad.in_(db.tag, ["t0"]) & (
+                db.run == 6)
+        source, constants, columns = _source(expr)
+        # The most selective comparisons are evaluated first
+        self.assertEqual(
+                source,
+                "((v0 == c0) and (v1 in c1) and (v0 > c2) and (v0 != c3))")
+        self.assertEqual(constants, [6, ["t0"], 1, 3])
+        self.assertEqual(columns, [Runs.run, Runs.tag])
+        self.assertEqual(list(expr), [r == 6 for r in range(9)])
+
+    def test_compile(self):
+        db = self.db
+        predicate, columns = compile_predicate(
+                (db.tag == "t1") | ~(db.run < 5) )
+        self.assertEqual(columns, [Runs.tag, Runs.run])
+        self.assertTrue(predicate("t1", 0) )
+        self.assertTrue(predicate("t0", 5) )
+        self.assertFalse(predicate("t0", 4) )
+
+    def test_constants(self):
+        db = self.db
+        low = Threshold(2)
+        values = {"t0", "t1"}
+        expr = (db.run > low) & CollMonad.in_(db.tag, values)
+        source, constants, columns = _source(expr)
+        # Values are referred to by name rather than written into the source
+        self.assertNotIn("Threshold", source)
+        self.assertNotIn("t0", source)
+        self.assertIs(constants[0], values)
+        self.assertIs(constants[1], low)
+        self.assertEqual(columns, [Runs.tag, Runs.run])
+        predicate, _ = compile_predicate(expr)
+        self.assertTrue(predicate("t0", 3) )
+        self.assertFalse(predicate("t0", 2) )
+        self.assertFalse(predicate("t2", 3) )
+        self.assertEqual(
+                [row.run for row in db.select(expr)], [3, 4, 6, 7])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from dbmeta.database import SeqDatabase
+from dbmeta.column import ColumnDesc, reader, writer, make_row_codec
+from dbmeta.tuple_store import MutableTupleSeqStore
+
+@reader
+def read_csv(value, source):
+    return tuple(value.split(",") ) if source == "csv" else tuple(value)
+
+@writer
+def write_csv(value, target):
+    return ",".join(value) if target == "csv" else list(value)
+
+class Samples(SeqDatabase):
+    plain = ColumnDesc()
+    renamed = ColumnDesc(key={"csv": "Renamed", None: "renamed"})
+    optional = ColumnDesc(default=0)
+    parts = ColumnDesc(read_func=read_csv, write_func=write_csv, default="")
+    scaled = ColumnDesc(type=float, store_type=str)
+
+    def __init__(self):
+        super(Samples, self).__init__(MutableTupleSeqStore(db=self) )
+
+class MoreSamples(Samples):
+    extra = ColumnDesc(default=None)
+
+_remote = {
+        None: [
+            {"plain": 1, "renamed": "a", "optional": 2, "parts": ["x", "y"],
+             "scaled": "1.5"},
+            {"plain": 2, "renamed": "b", "scaled": "3"}],
+        "csv": [
+            {"plain": 1, "Renamed": "a", "optional": 2, "parts": "x,y",
+             "scaled": "1.5"},
+            {"plain": 2, "Renamed": "b", "scaled": "3"}],
+        }
+
+class TestRowCodec(unittest.TestCase):
+
+    def by_column(self, data, store_type):
+        """ Read a row one column at a time """
+        return tuple(c.read_from(data, store_type) for c in Samples._columns)
+
+    def write_by_column(self, tup, store_type):
+        data = {}
+        for c in Samples._columns:
+            c.write_to(tup[c.index], data, store_type)
+        return data
+
+    def test_matches_columns(self):
+        for store_type, rows in _remote.items():
+            decode, encode = make_row_codec(Samples._columns, store_type)
+            for data in rows:
+                tup = decode(data)
+                self.assertEqual(tup, self.by_column(data, store_type) )
+                self.assertEqual(
+                        encode(tup), self.write_by_column(tup, store_type) )
+
+    def test_values(self):
+        decode, encode = make_row_codec(Samples._columns, "csv")
+        # Defaults fill missing keys, custom functions are called and the
+        # values are left in their stored form
+        self.assertEqual(decode(_remote["csv"][1]), (2, "b", 0, ("",), "3") )
+        self.assertEqual(decode(_remote["csv"][0])[3], ("x", "y") )
+        self.assertEqual(
+                encode( (1, "a", 2, ("x", "y"), "1.5") ), _remote["csv"][0])
+        self.assertEqual(
+                make_row_codec(Samples._columns, None)[1](
+                    (1, "a", 2, ("x", "y"), "1.5") ),
+                _remote[None][0])
+
+    def test_missing(self):
+        decode, _ = make_row_codec(Samples._columns, None)
+        self.assertRaises(KeyError, decode, {"renamed": "a", "scaled": "1"})
+
+    def test_store_round_trip(self):
+        db = Samples()
+        db._store.from_remote(_remote["csv"], "csv")
+        self.assertEqual(list(db.scaled), [1.5, 3.0])
+        self.assertEqual(db[0].parts, ("x", "y") )
+        self.assertEqual(db._store.to_remote("csv")[0], _remote["csv"][0])
+
+    def test_cached(self):
+        codec = Samples._row_codec("csv")
+        self.assertIs(Samples._row_codec("csv"), codec)
+        self.assertIsNot(Samples._row_codec(None), codec)
+        # Subclasses have their own columns so make their own codecs
+        sub_codec = MoreSamples._row_codec("csv")
+        self.assertIsNot(sub_codec, codec)
+        self.assertEqual(len(sub_codec[0](_remote["csv"][1]) ), 6)
+        self.assertIs(Samples._row_codec("csv"), codec)
+        self.assertIsNot(
+                MoreSamples.__dict__["_row_codecs"],
+                Samples.__dict__["_row_codecs"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import heapq
+from dbmeta import query
+from dbmeta.weakcoll import RowRegistry
+from .databases import Runs, Files
+
+_energies = [5, 3, 8, 3, 9, 1, 7, 3]
+
+class CountingHeapq(object):
+    """ Stands in for the heapq module, counting the top-k searches made """
+
+    def __init__(self):
+        self.calls = 0
+
+    def nsmallest(self, *args, **kwargs):
+        self.calls += 1
+        return heapq.nsmallest(*args, **kwargs)
+
+    def nlargest(self, *args, **kwargs):
+        self.calls += 1
+        return heapq.nlargest(*args, **kwargs)
+
+class CountingRegistry(RowRegistry):
+    """ Counts the rows made, each of which adds itself to the registry """
+
+    def __init__(self):
+        super(CountingRegistry, self).__init__()
+        self.n_rows = 0
+
+    def append(self, row):
+        self.n_rows += 1
+        super(CountingRegistry, self).append(row)
+
+class TestSelection(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Runs()
+        self.db._references = CountingRegistry()
+        self.db.extend([
+            {"run": 10 - i, "energy": e, "tag": "t{0}".format(i % 2)}
+            for i, e in enumerate(_energies)])
+        self.heapq = CountingHeapq()
+        self.addCleanup(setattr, query, "heapq", query.heapq)
+        query.heapq = self.heapq
+
+    def rows_built(self):
+        return self.db._references.n_rows
+
+    def expected(self, descending=False, rows=None):
+        """ The indices of the rows in order of energy """
+        rows = range(len(_energies) ) if rows is None else rows
+        return sorted(rows, key=lambda i: _energies[i], reverse=descending)
+
+    def test_order(self):
+        db = self.db
+        self.assertEqual(
+                [r._index for r in db.order_by(db.energy)], self.expected() )
+        self.assertEqual(
+                [r._index for r in db.order_by("energy", descending=True)],
+                self.expected(True) )
+        # Equal values keep the order of the rows
+        self.assertEqual(
+                [r._index for r in db.order_by(db.energy) if r.energy == 3],
+                [1, 3, 7])
+
+    def test_selected(self):
+        db = self.db
+        sel = db.select(db.tag == "t0").order_by(db.energy, descending=True)
+        self.assertEqual(
+                [r._index for r in sel], self.expected(True, [0, 2, 4, 6]) )
+
+    def test_limit(self):
+        db = self.db
+        built = self.rows_built()
+        rows = list(db.order_by(db.energy).limit(3) )
+        self.assertEqual([r._index for r in rows], self.expected()[:3])
+        # Only the returned rows are made, found with a heap
+        self.assertEqual(self.rows_built() - built, 3)
+        self.assertEqual(self.heapq.calls, 1)
+        rows = list(db.select(db.energy > 2).order_by(
+            db.energy, descending=True).limit(2) )
+        self.assertEqual([r.energy for r in rows], [9, 8])
+        self.assertEqual(self.heapq.calls, 2)
+
+    def test_limit_unordered(self):
+        db = self.db
+        self.assertEqual(
+                [r._index for r in db.select(db.tag == "t1").limit(2)], [1, 3])
+        self.assertEqual(list(db.select(db.tag == "t1").limit(0) ), [])
+        # Limits only ever cut the selection down further
+        self.assertEqual(
+                len(list(db.order_by(db.energy).limit(2).limit(5) ) ), 2)
+        self.assertRaises(ValueError, db.order_by(db.energy).limit, -1)
+
+    def test_sorted_index(self):
+        db = self.db
+        def no_sort(*args):
+            raise AssertionError("Rows sorted rather than read from the index")
+        self.addCleanup(setattr, query, "_sort_key", query._sort_key)
+        query._sort_key = no_sort
+        self.assertEqual(
+                [r.run for r in db.order_by(db.run)], list(range(3, 11) ) )
+        self.assertIn("run", db._indices)
+        built = self.rows_built()
+        self.assertEqual(
+                [r.run for r in db.order_by(db.run, descending=True).limit(2)],
+                [10, 9])
+        self.assertEqual(self.rows_built() - built, 2)
+        self.assertEqual(
+                [r.run for r in db.select(db.tag == "t1").order_by(db.run)],
+                [3, 5, 7, 9])
+        self.assertEqual(self.heapq.calls, 0)
+
+    def test_reorder(self):
+        db = self.db
+        # Ordering by one column then another keeps the first order for ties
+        sel = db.order_by(db.run).order_by(db.energy)
+        self.assertEqual([r.run for r in sel if r.energy == 3], [3, 7, 9])
+        # A limit is applied before any later ordering
+        sel = db.order_by(db.energy).limit(3).order_by(db.run)
+        self.assertEqual([r.run for r in sel], [5, 7, 9])
+
+    def test_assoc(self):
+        db = Files()
+        db.add_many([
+            {"name": "f{0}".format(i), "size": e}
+            for i, e in enumerate(_energies)])
+        self.assertEqual(
+                [r.size for r in db.order_by(db.size).limit(4)], [1, 3, 3, 3])
+        self.assertEqual(
+                [r.name for r in db.select(db.size > 6).order_by("size")],
+                ["f6", "f2", "f4"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import unittest
+import os
+import shutil
+import tempfile
+from dbmeta.database import SeqDatabase
+from dbmeta.column import ColumnDesc
+from dbmeta.coll_monad import CollMonad
+from dbmeta.sqlite_store import (
+        SQLiteStore, MutableSQLiteSeqStore, MutableSQLiteAssocStore)
+from .databases import Files
+
+def write_plain(value, key, data, store_type):
+    data[key] = value
+
+class Cells(SeqDatabase):
+    a = ColumnDesc(index="sorted")
+    s = ColumnDesc()
+    b = ColumnDesc()
+    # Not translated into SQL as it has its own write_func
+    c = ColumnDesc(write_func=write_plain)
+
+    def __init__(self):
+        super(Cells, self).__init__(
+                MutableSQLiteSeqStore(db_file=":memory:", db=self) )
+
+_rows = [
+        {"a": 1, "s": "x", "b": 0, "c": 3},
+        {"a": None, "s": "y", "b": 1, "c": 2},
+        {"a": 3, "s": None, "b": 2, "c": 3},
+        {"a": 2, "s": "x", "b": 3, "c": 1},
+        {"a": None, "s": "z", "b": 4, "c": 3},
+        {"a": 3, "s": None, "b": 5, "c": 0},
+        ]
+
+#: Expressions that are translated into SQL
+_pushed = [
+        lambda db: db.a == 3,
+        lambda db: db.a == None,
+        lambda db: db.a != 3,
+        lambda db: db.a != None,
+        lambda db: db.s == "x",
+        lambda db: db.s != "x",
+        lambda db: CollMonad.in_(db.a, [1, 3]),
+        lambda db: CollMonad.in_(db.a, [None, 2]),
+        lambda db: CollMonad.in_(db.s, [None]),
+        lambda db: CollMonad.in_(db.a, []),
+        lambda db: db.b > 2,
+        lambda db: db.b <= 2,
+        lambda db: ~(db.a == 3),
+        lambda db: ~(db.s != None),
+        lambda db: ~CollMonad.in_(db.s, ["x", None]),
+        lambda db: (db.a == 3) & (db.s != "x"),
+        lambda db: (db.a == 1) | (db.s == None),
+        lambda db: ~((db.a != 1) & (db.b >= 1) ),
+        ]
+
+#: Expressions that are at least partly evaluated in python
+_residual = [
+        lambda db: db.c == 3,
+        lambda db: (db.b > 1) & (db.c == 3),
+        lambda db: (db.a != None) & (db.c != 3),
+        lambda db: (db.s == "x") | (db.c == 0),
+        ]
+
+class TestPushdown(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Cells()
+        self.db.extend(_rows)
+
+    def check(self, make_expr):
+        db = self.db
+        selected = [row._index for row in db.select(make_expr(db) )]
+        evaluated = [idx for idx, v in enumerate(make_expr(db) ) if v]
+        self.assertEqual(selected, evaluated)
+        # Also check the query made on the store, as the database may have
+        # used its own index instead
+        pushed = db._store.select_indices(make_expr(db) )
+        if pushed is not None:
+            self.assertEqual(pushed[0], evaluated)
+
+    def test_pushed(self):
+        for make_expr in _pushed:
+            self.assertIsNotNone(self.db._store._where(make_expr(self.db) ) )
+            self.check(make_expr)
+
+    def test_residual(self):
+        for make_expr in _residual:
+            self.check(make_expr)
+        self.assertIsNone(self.db._store._where(self.db.c == 3) )
+
+    def test_changes(self):
+        db = self.db
+        db[0].a = None
+        db[1].a = 3
+        db.append(a=3, s="w", b=6, c=3)
+        del db[2]
+        for make_expr in _pushed + _residual:
+            self.check(make_expr)
+
+    def test_associative(self):
+        db = Files(lambda db: MutableSQLiteAssocStore(db_file=":memory:", db=db) )
+        db.add_many([
+            {"name": "x", "size": 3},
+            {"name": "y", "size": None},
+            {"name": "z", "size": 7}])
+        self.assertEqual(
+                sorted(r.name for r in db.select(db.size != 3) ), ["y", "z"])
+        self.assertEqual([r.name for r in db.select(db.size == None)], ["y"])
+        self.assertEqual(
+                sorted(r.name for r in db.select(CollMonad.in_(db.size, [3, 7]) ) ),
+                ["x", "z"])
+
+    def test_abstract(self):
+        class NoRows(SQLiteStore):
+            pass
+        self.assertRaises(TypeError, NoRows, db_file=":memory:", db=self.db)
+
+class TestAssocLength(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_db(self):
+        return Files(
+                lambda db: MutableSQLiteAssocStore(db_file=self.db_file, db=db) )
+
+    def count(self, db):
+        return db._store._conn.execute(
+                "SELECT COUNT(*) FROM Files").fetchone()[0]
+
+    def test_changes(self):
+        db = self.make_db()
+        self.assertEqual(len(db), 0)
+        db.add(name="x", size=1)
+        db.add_many([{"name": "y", "size": 2}, {"name": "z", "size": 3}])
+        self.assertEqual(len(db), 3)
+        del db["y"]
+        self.assertEqual(len(db), 2)
+        # Failed changes leave the count alone
+        self.assertRaises(KeyError, db.add, name="x", size=4)
+        self.assertRaises(
+                KeyError, db.add_many,
+                [{"name": "w", "size": 4}, {"name": "z", "size": 5}])
+        self.assertRaises(KeyError, db._store.__delitem__, "y")
+        self.assertEqual(len(db), self.count(db) )
+        db._store.from_dict({"a": {"size": 1}}, None)
+        self.assertEqual(len(db), 1)
+
+    def test_reopen(self):
+        db = self.make_db()
+        db.add_many([{"name": "x", "size": 1}, {"name": "y", "size": 2}])
+        db._store.write()
+        other = self.make_db()
+        self.assertEqual(len(other), 2)
+        # Changes made through another connection are picked up by update
+        other.add(name="z", size=3)
+        other._store.write()
+        self.assertEqual(len(db), 2)
+        db._store.update()
+        self.assertEqual(len(db), 3)
+        self.assertEqual(
+                sorted(r.name for r in db.select(db.size > 1) ), ["y", "z"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+from array import array
+from dbmeta.store import BulkIndexShift, IndexShift, MutableSeqStore, compact
+from dbmeta.tuple_store import MutableTupleSeqStore
+from dbmeta.columnar_store import MutableColumnarSeqStore
+from dbmeta.sqlite_store import MutableSQLiteSeqStore
+from .databases import Runs
+
+class TestIndexShift(unittest.TestCase):
+
+    def test_shift(self):
+        shift = IndexShift(3, 6, -1)
+        self.assertEqual(dict(shift), {3: 2, 4: 3, 5: 4})
+        self.assertNotIn(6, shift)
+        self.assertRaises(KeyError, shift.__getitem__, 2)
+
+    def test_bulk(self):
+        shift = BulkIndexShift([1, 4, 5], 8)
+        expected = {2: 1, 3: 2, 6: 3, 7: 4}
+        self.assertEqual(dict(shift), expected)
+        self.assertEqual(len(shift), len(expected) )
+        for idx in (0, 1, 4, 5, 8):
+            self.assertNotIn(idx, shift)
+            self.assertRaises(KeyError, shift.__getitem__, idx)
+
+    def test_bulk_matches_single(self):
+        # Deleting several rows at once moves the others to the same places as
+        # deleting them one at a time, from the highest down
+        deleted = [0, 2, 3, 7, 9]
+        positions = list(range(10) )
+        for idx in reversed(deleted):
+            del positions[idx]
+        shift = BulkIndexShift(deleted, 10)
+        for new, old in enumerate(positions):
+            self.assertEqual(shift.get(old, old), new)
+
+    def test_remap_all(self):
+        for shift in (IndexShift(3, 6, -1), IndexShift(2, 2, 1),
+                      BulkIndexShift([1, 4, 5], 8), BulkIndexShift([], 3) ):
+            indices = [7, 0, 3, 2, 6, 4, 9]
+            self.assertEqual(
+                    shift.remap_all(indices),
+                    [shift[idx] if idx in shift else idx for idx in indices])
+
+    def test_bulk_empty(self):
+        shift = BulkIndexShift([], 5)
+        self.assertEqual(len(shift), 0)
+        self.assertEqual(list(shift), [])
+        self.assertNotIn(2, shift)
+
+    def test_compact(self):
+        self.assertEqual(compact(list(range(6) ), [0, 2, 5]), [1, 3, 4])
+        self.assertEqual(compact(array('l', range(4) ), [1]), array('l', [0, 2, 3]) )
+        self.assertEqual(compact([1, 2], []), [1, 2])
+
+    def test_compact_abstract(self):
+        class NoCompact(MutableTupleSeqStore):
+            _compact = MutableSeqStore._compact
+        self.assertRaises(TypeError, NoCompact, db=None)
+
+def _store_makers():
+    return [
+            lambda db: MutableTupleSeqStore(db=db),
+            lambda db: MutableColumnarSeqStore(db=db),
+            lambda db: MutableSQLiteSeqStore(db_file=":memory:", db=db)]
+
+class TestDeleteMany(unittest.TestCase):
+
+    def each_db(self, n=10):
+        for make_store in _store_makers():
+            db = Runs(make_store)
+            for i in range(n):
+                db.append(run=i, tag="t{0}".format(i % 3) )
+            yield db
+
+    def test_delete_many(self):
+        for db in self.each_db():
+            rows = [db[i] for i in range(10)]
+            # The indexes are built before deleting so that they are updated
+            self.assertEqual(len(list(db.select(db.run > 4) ) ), 5)
+            self.assertEqual(len(list(db.select(db.tag == "t0") ) ), 4)
+            db.delete_many([db[8], 1, -1, 4, 1])
+            self.assertEqual(list(db.run), [0, 2, 3, 5, 6, 7])
+            # Rows that survive follow their data, the others are dropped
+            self.assertEqual([r._index for r in rows if r in db._references],
+                             [0, 1, 2, 3, 4, 5])
+            self.assertEqual(rows[5]._index, 3)
+            self.assertEqual(
+                    [r.run for r in db.select(db.run > 4)], [5, 6, 7])
+            self.assertEqual([r.run for r in db.select(db.tag == "t0")], [0, 3, 6])
+            db.delete_many([])
+            self.assertEqual(len(db), 6)
+            self.assertRaises(IndexError, db.delete_many, [6])
+            self.assertEqual(len(db), 6)
+
+    def test_delete_negative(self):
+        for db in self.each_db(4):
+            rows = [db[i] for i in range(4)]
+            # Deleting the last row through the store moves no other rows
+            del db._store[-1]
+            self.assertEqual([r._index for r in rows[:3]], [0, 1, 2])
+            self.assertEqual([r.run for r in rows[:3]], [0, 1, 2])
+            del db._store[-3]
+            self.assertEqual([r._index for r in rows[1:3]], [0, 1])
+            self.assertEqual(list(db.run), [1, 2])
+            self.assertRaises(IndexError, db._store.__delitem__, -3)
+
+    def test_delete_all(self):
+        for db in self.each_db():
+            self.assertEqual(len(list(db.select(db.run > 4) ) ), 5)
+            db.delete_many(range(10) )
+            self.assertEqual(len(db), 0)
+            self.assertEqual(list(db.select(db.run > 4) ), [])
+
+    def test_defer_deletes(self):
+        for db in self.each_db():
+            self.assertEqual(len(list(db.select(db.run < 3) ) ), 3)
+            with db.defer_deletes():
+                for row in db:
+                    if row.run % 2:
+                        del db[row]
+                # Nothing moves until the end
+                self.assertEqual(len(db), 10)
+                with db.defer_deletes():
+                    del db[0]
+                self.assertEqual(len(db), 10)
+            self.assertEqual(list(db.run), [2, 4, 6, 8])
+            self.assertEqual([r.run for r in db.select(db.run < 5)], [2, 4])
+
+    def test_defer_deletes_error(self):
+        for db in self.each_db(4):
+            try:
+                with db.defer_deletes():
+                    del db[1]
+                    raise KeyError()
+            except KeyError:
+                pass
+            # The marked rows are still deleted
+            self.assertEqual(list(db.run), [0, 2, 3])
+
+if __name__ == "__main__":
+    unittest.main()
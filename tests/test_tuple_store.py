@@ -0,0 +1,114 @@
+import unittest
+from dbmeta.database import SeqDatabase, AssocDatabase
+from dbmeta.column import ColumnDesc, IndexColumnDesc
+from dbmeta.tuple_store import (
+        MutableTupleSeqStore, MutableTupleAssocStore, _RemoteRow)
+
+class Readings(SeqDatabase):
+    """ Names its columns differently in 'upper' stores """
+    run = ColumnDesc(key={"upper": "RUN", None: "run"})
+    value = ColumnDesc(key={"upper": "VALUE", None: "value"})
+
+    def __init__(self, data, store_cls=MutableTupleSeqStore):
+        super(Readings, self).__init__(store_cls(
+            data=data, store_type="upper", lazy=True, db=self) )
+
+class Named(AssocDatabase):
+    name = IndexColumnDesc()
+    value = ColumnDesc(key={"upper": "VALUE", None: "value"})
+
+    def __init__(self, data):
+        super(Named, self).__init__(MutableTupleAssocStore(
+            data=data, store_type="upper", lazy=True, db=self) )
+
+class CountingStore(MutableTupleSeqStore):
+    """ Counts the rows that it converts """
+    n_converted = 0
+
+    def _remote_to_tuple(self, data, store_type):
+        self.n_converted += 1
+        return super(CountingStore, self)._remote_to_tuple(data, store_type)
+
+def _remote(n=4):
+    return [{"RUN": i, "VALUE": 10 * i} for i in range(n)]
+
+class TestLazy(unittest.TestCase):
+
+    def test_pass_through(self):
+        data = _remote()
+        db = Readings(data)
+        remote = db._store.to_remote("upper")
+        for old, new in zip(data, remote):
+            self.assertIs(old, new)
+        self.assertTrue(
+                all(isinstance(row, _RemoteRow) for row in db._store._data) )
+
+    def test_other_store_type(self):
+        data = _remote()
+        db = Readings(data)
+        self.assertEqual(
+                db._store.to_remote(None),
+                tuple({"run": i, "value": 10 * i} for i in range(4) ) )
+        # Only the converted rows are changed
+        db[1].value = 5
+        remote = db._store.to_remote("upper")
+        self.assertIs(remote[0], data[0])
+        self.assertIsNot(remote[1], data[1])
+        self.assertEqual(remote[1], {"RUN": 1, "VALUE": 5})
+
+    def test_convert_once(self):
+        db = Readings(_remote(), CountingStore)
+        store = db._store
+        self.assertEqual(store.n_converted, 0)
+        self.assertEqual(db[2].value, 20)
+        self.assertEqual(store.n_converted, 1)
+        row = store._data[2]
+        self.assertIsInstance(row, tuple)
+        self.assertEqual(db[2].run, 2)
+        self.assertIs(store._data[2], row)
+        self.assertEqual(store.n_converted, 1)
+        self.assertIsInstance(store._data[1], _RemoteRow)
+
+    def test_iter_column(self):
+        db = Readings(_remote() )
+        self.assertEqual(list(db.value), [0, 10, 20, 30])
+        self.assertTrue(
+                all(isinstance(row, _RemoteRow) for row in db._store._data) )
+        # Selecting reads the cells, only the selected rows are converted
+        rows = list(db.select(db.value > 15) )
+        self.assertEqual(
+                [isinstance(row, _RemoteRow) for row in db._store._data],
+                [True, True, True, True])
+        self.assertEqual([r.run for r in rows], [2, 3])
+        self.assertEqual(
+                [isinstance(row, _RemoteRow) for row in db._store._data],
+                [True, True, False, False])
+
+    def test_errors_deferred(self):
+        # A row missing a column is only found out when it is converted
+        db = Readings([{"RUN": 0, "VALUE": 1}, {"RUN": 1}])
+        self.assertEqual(db[0].value, 1)
+        self.assertRaises(KeyError, lambda: db[1].value)
+
+    def test_changes(self):
+        db = Readings(_remote() )
+        db.append(run=4, value=40)
+        del db[0]
+        self.assertEqual(list(db.run), [1, 2, 3, 4])
+        db.delete_many([0, 2])
+        self.assertEqual(
+                db._store.to_remote("upper"),
+                ({"RUN": 2, "VALUE": 20}, {"RUN": 4, "VALUE": 40}) )
+
+    def test_assoc(self):
+        data = {"a": {"VALUE": 1}, "b": {"VALUE": 2}}
+        db = Named(data)
+        self.assertIs(db._store.to_dict("upper")["a"], data["a"])
+        self.assertEqual(sorted(db.value), [1, 2])
+        self.assertEqual(db["b"].value, 2)
+        self.assertIsInstance(db._store._data["a"], _RemoteRow)
+        self.assertIsInstance(db._store._data["b"], tuple)
+        self.assertEqual(db._store.to_dict(None)["b"], {"value": 2})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import gc
+import weakref
+from dbmeta.weakcoll import RowRegistry
+
+class _Row(object):
+    """ Stands in for a database row, calling on_move when its index is set
+        after it has been registered
+    """
+
+    def __init__(self, index):
+        self.on_move = None
+        self._index = index
+
+    def __setattr__(self, name, value):
+        super(_Row, self).__setattr__(name, value)
+        if name == "_index" and self.on_move is not None:
+            self.on_move()
+
+class TestRowRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = RowRegistry()
+        self.rows = [_Row(idx) for idx in range(6)]
+        for row in self.rows:
+            self.registry.append(row)
+
+    def check_consistent(self):
+        registry = self.registry
+        keys = set()
+        for idx, bucket in registry._buckets.items():
+            self.assertTrue(bucket)
+            for key in bucket:
+                self.assertEqual(registry._indices[key], idx)
+            keys.update(bucket)
+        self.assertEqual(keys, set(registry._indices) )
+        for row in self.rows:
+            self.assertIn(row, registry.rows_at(row._index) )
+
+    def test_remap(self):
+        self.registry.remap({1: 0, 3: 1, 5: 2})
+        self.assertEqual([row._index for row in self.rows], [0, 0, 2, 1, 4, 2])
+        self.assertEqual(len(self.registry.rows_at(0) ), 2)
+        self.assertEqual(self.registry.rows_at(3), [])
+        self.rows = [self.rows[1], self.rows[3], self.rows[5], self.rows[4]]
+        gc.collect()
+        self.check_consistent()
+
+    def test_dead_rows(self):
+        del self.rows[3]
+        del self.rows[0]
+        gc.collect()
+        self.registry.remap({1: 0, 2: 1, 4: 2, 5: 3})
+        self.assertEqual([row._index for row in self.rows], [0, 1, 2, 3])
+        self.check_consistent()
+
+    def test_die_during_remap(self):
+        # Drop the last references to rows that are also being moved while the
+        # registry is being updated, so that their weakref callbacks fire part
+        # of the way through
+        first, moved = self.rows[1], self.rows[3:]
+        def on_move():
+            first.on_move = None
+            del moved[:]
+        first.on_move = on_move
+        self.rows = self.rows[:3]
+        self.registry.remap({1: 0, 3: 1, 4: 2, 5: 3})
+        gc.collect()
+        self.assertEqual([row._index for row in self.rows], [0, 0, 2])
+        self.rows = self.rows[1:]
+        self.check_consistent()
+
+    def test_callback_during_remap(self):
+        # A row whose reference is dead but whose callback only runs from the
+        # middle of the remap
+        registry = self.registry
+        victim = self.rows.pop(4)
+        key = id(victim)
+        ref = weakref.KeyedRef(victim, None, key)
+        registry._buckets[4][key] = ref
+        del victim
+        gc.collect()
+        def on_move():
+            self.rows[1].on_move = None
+            registry.rm_by_ref(ref)
+        self.rows[1].on_move = on_move
+        registry.remap({1: 0, 3: 1, 4: 2, 5: 3})
+        self.assertEqual([row._index for row in self.rows], [0, 0, 2, 1, 3])
+        self.rows.pop(0)
+        self.check_consistent()
+
+if __name__ == "__main__":
+    unittest.main()